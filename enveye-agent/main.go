@@ -26,6 +26,26 @@ type Snapshot struct {
 	Timestamp           string                 `json:"timestamp"`
 }
 
+// SnapshotDelta carries only what changed relative to a base snapshot
+type SnapshotDelta struct {
+	DeltaFormat        string                 `json:"delta_format"`
+	Base               string                 `json:"base"`
+	BaseTimestamp      string                 `json:"base_timestamp"`
+	ApplicationName    string                 `json:"application_name"`
+	ApplicationType    string                 `json:"application_type"`
+	Timestamp          string                 `json:"timestamp"`
+	EnvironmentContext map[string]interface{} `json:"environment_context"`
+	RemovedContext     []string               `json:"removed_context"`
+	Files              FileDelta              `json:"app_folder_files"`
+}
+
+// FileDelta lists app_folder_files entries that differ from the base
+type FileDelta struct {
+	Added    map[string]interface{} `json:"added"`
+	Modified map[string]interface{} `json:"modified"`
+	Removed  []string               `json:"removed"`
+}
+
 // getOSInfo returns a map with the current OS details
 func getOSInfo() map[string]string {
 	return map[string]string{
@@ -48,7 +68,7 @@ func readEnvVariables(keys []string) map[string]string {
 }
 
 // writeJSONToFile writes the snapshot data to a JSON file
-func writeJSONToFile(data Snapshot, filename string) error {
+func writeJSONToFile(data interface{}, filename string) error {
 	file, err := os.Create(filename)
 	if err != nil {
 		return err
@@ -60,6 +80,72 @@ func writeJSONToFile(data Snapshot, filename string) error {
 	return encoder.Encode(data)
 }
 
+// sameJSON reports whether two values encode to the same JSON
+func sameJSON(a, b interface{}) bool {
+	ja, errA := json.Marshal(a)
+	jb, errB := json.Marshal(b)
+	return errA == nil && errB == nil && bytes.Equal(ja, jb)
+}
+
+// buildDelta diffs a snapshot against the base snapshot stored at basePath
+func buildDelta(snapshot Snapshot, basePath string) (SnapshotDelta, error) {
+	var base Snapshot
+	data, err := os.ReadFile(basePath)
+	if err != nil {
+		return SnapshotDelta{}, err
+	}
+	if err := json.Unmarshal(data, &base); err != nil {
+		return SnapshotDelta{}, err
+	}
+	if base.EnvironmentContext == nil {
+		return SnapshotDelta{}, fmt.Errorf("base %s is not a full snapshot", basePath)
+	}
+
+	delta := SnapshotDelta{
+		DeltaFormat:        "enveye-delta/1",
+		Base:               filepath.Base(basePath),
+		BaseTimestamp:      base.Timestamp,
+		ApplicationName:    snapshot.ApplicationName,
+		ApplicationType:    snapshot.ApplicationType,
+		Timestamp:          snapshot.Timestamp,
+		EnvironmentContext: map[string]interface{}{},
+		RemovedContext:     []string{},
+		Files: FileDelta{
+			Added:    map[string]interface{}{},
+			Modified: map[string]interface{}{},
+			Removed:  []string{},
+		},
+	}
+
+	for key, value := range snapshot.EnvironmentContext {
+		if key != "app_folder_files" && !sameJSON(value, base.EnvironmentContext[key]) {
+			delta.EnvironmentContext[key] = value
+		}
+	}
+	for key := range base.EnvironmentContext {
+		if _, ok := snapshot.EnvironmentContext[key]; !ok && key != "app_folder_files" {
+			delta.RemovedContext = append(delta.RemovedContext, key)
+		}
+	}
+
+	baseFiles, _ := base.EnvironmentContext["app_folder_files"].(map[string]interface{})
+	files, _ := snapshot.EnvironmentContext["app_folder_files"].(map[string]map[string]interface{})
+	for path, entry := range files {
+		old, ok := baseFiles[path]
+		if !ok {
+			delta.Files.Added[path] = entry
+		} else if !sameJSON(entry, old) {
+			delta.Files.Modified[path] = entry
+		}
+	}
+	for path := range baseFiles {
+		if _, ok := files[path]; !ok {
+			delta.Files.Removed = append(delta.Files.Removed, path)
+		}
+	}
+	return delta, nil
+}
+
 // computeSHA256 computes the SHA256 hash for a file
 func computeSHA256(path string) string {
 	file, err := os.Open(path)
@@ -206,6 +292,8 @@ func main() {
 	extraServicesFlag := flag.String("extra-services", "", "Comma-separated list of extra service names to check")
 	outputFile := flag.String("output", "", "Optional: Custom output filename for the snapshot")
 	snapshotLabel := flag.String("label", "", "Optional: Label snapshot as good or faulty")
+	toStdout := flag.Bool("stdout", false, "Optional: Print the snapshot JSON to stdout instead of writing a file")
+	basePath := flag.String("base", "", "Optional: Previous snapshot file; also write a delta against it to <output>.delta")
 
 	flag.Parse()
 
@@ -284,6 +372,25 @@ func main() {
 		Timestamp: time.Now().Format(time.RFC3339),
 	}
 
+	// Diff against the base snapshot if one was given; fall back to the full snapshot
+	var payload interface{} = snapshot
+	if *basePath != "" {
+		if delta, err := buildDelta(snapshot, *basePath); err == nil {
+			payload = delta
+		} else {
+			fmt.Fprintf(os.Stderr, "⚠️ Base snapshot unusable, sending full snapshot: %v\n", err)
+		}
+	}
+
+	// Stream the snapshot to stdout for collectors that read it directly
+	if *toStdout {
+		if err := json.NewEncoder(os.Stdout).Encode(payload); err != nil {
+			fmt.Fprintf(os.Stderr, "❌ Failed to write snapshot to stdout: %v\n", err)
+			os.Exit(1)
+		}
+		return
+	}
+
 	// Write the snapshot data to the file
 	if err := writeJSONToFile(snapshot, snapshotPath); err != nil {
 		fmt.Printf("❌ Failed to write snapshot: %v\n", err)
@@ -292,9 +399,20 @@ func main() {
 
 	fmt.Printf("✅ Snapshot written to %s\n", snapshotPath)
 
+	// The full snapshot stays on disk as the next base; the delta is what gets sent
+	uploadPath := snapshotPath
+	if *basePath != "" {
+		uploadPath = snapshotPath + ".delta"
+		if err := writeJSONToFile(payload, uploadPath); err != nil {
+			fmt.Printf("❌ Failed to write delta: %v\n", err)
+			os.Exit(1)
+		}
+		fmt.Printf("✅ Delta written to %s\n", uploadPath)
+	}
+
 	// Upload the snapshot if an upload URL is provided
 	if *uploadURL != "" {
-		err := uploadSnapshot(*uploadURL, snapshotPath, hostname, *appFolder)
+		err := uploadSnapshot(*uploadURL, uploadPath, hostname, *appFolder)
 		if err != nil {
 			fmt.Printf("❌ Upload failed: %v\n", err)
 		}
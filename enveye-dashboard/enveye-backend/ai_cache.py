@@ -0,0 +1,135 @@
+"""
+Content-addressed cache of AI diagnosis responses.
+
+Keys are sha256 hashes of (vendor, model, prompt version, normalized prompt
+inputs), one per AI route; an answer is stored under the route that gave it.
+The prompt version covers the template, digest rules and token budget. The
+diff is serialized canonically and timestamps are stripped from the error
+message, OCR text and logs, so many tickets from the same bad rollout share
+one entry.
+Entries live in an in-memory LRU backed by a local SQLite file, and expire
+after a TTL.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from log_blocks import normalize_log_block
+from snapshot_cache import LRUCache
+
+PROMPT_INPUT_FIELDS = ("diff", "error_message", "error_screenshot_text", "log_content")
+PURGE_INTERVAL_SECONDS = 300
+
+
+def prompt_cache_keys(routes, payload, version=""):
+    """
+    Cache key of an initial diagnosis per (vendor, model) in `routes`: a hash
+    of the route, `version` (of how the prompt is built from its inputs, so a
+    new template or budget doesn't serve old answers) and the canonical hash
+    of the inputs.
+    """
+    inputs = {}
+    for field in PROMPT_INPUT_FIELDS:
+        value = payload.get(field) or ("" if field != "diff" else {})
+        inputs[field] = normalize_log_block(value) if isinstance(value, str) else value
+    canonical = json.dumps(inputs, sort_keys=True, separators=(",", ":"), default=str)
+    inputs_digest = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    return {
+        (vendor, model): hashlib.sha256(json.dumps([vendor, model, version, inputs_digest]).encode("utf-8")).hexdigest()
+        for vendor, model in routes
+    }
+
+
+class AIResponseCache:
+    def __init__(self, db_path, ttl_seconds=86400, max_memory_entries=512):
+        self.db_path = Path(db_path)
+        self.ttl_seconds = ttl_seconds
+        self.memory = LRUCache(max_memory_entries)
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS ai_responses (
+                key TEXT PRIMARY KEY,
+                vendor TEXT,
+                model TEXT,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        self._conn.commit()
+        self.metrics = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "stores": 0}
+
+    def _lookup(self, key, now):
+        entry = self.memory.get(key)
+        if entry is not None:
+            response, expires_at = entry
+            if expires_at > now:
+                self.metrics["memory_hits"] += 1
+                return response
+            self.memory.discard_where(lambda k: k == key)
+            self.metrics["expired"] += 1
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, expires_at FROM ai_responses WHERE key = ?", (key,)
+            ).fetchone()
+        if row and row[1] > now:
+            self.memory.put(key, row)
+            self.metrics["disk_hits"] += 1
+            return row[0]
+        if row:
+            with self._lock:
+                self._conn.execute("DELETE FROM ai_responses WHERE key = ? AND expires_at <= ?", (key, now))
+                self._conn.commit()
+            self.metrics["expired"] += 1
+        return None
+
+    def get(self, *keys):
+        """The response under the first of `keys` that has a live entry; one miss if none does."""
+        now = time.time()
+        for key in keys:
+            response = self._lookup(key, now)
+            if response is not None:
+                return response
+        self.metrics["misses"] += 1
+        return None
+
+    def put(self, key, vendor, model, response):
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        self.memory.put(key, (response, expires_at))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ai_responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, vendor, model, response, now, expires_at),
+            )
+            self._conn.commit()
+        self.metrics["stores"] += 1
+        if now - self._last_purge > PURGE_INTERVAL_SECONDS:
+            self.purge_expired()
+
+    def purge_expired(self):
+        """Delete expired entries from disk; run from put() every PURGE_INTERVAL_SECONDS."""
+        self._last_purge = time.time()
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM ai_responses WHERE expires_at <= ?", (self._last_purge,)).rowcount
+            self._conn.commit()
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            disk_entries = self._conn.execute("SELECT COUNT(*) FROM ai_responses").fetchone()[0]
+        lookups = self.metrics["memory_hits"] + self.metrics["disk_hits"] + self.metrics["misses"]
+        hits = self.metrics["memory_hits"] + self.metrics["disk_hits"]
+        return {
+            **self.metrics,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "memory": self.memory.stats(),
+            "disk_entries": disk_entries,
+            "ttl_seconds": self.ttl_seconds,
+        }
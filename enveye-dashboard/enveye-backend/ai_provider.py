@@ -1,17 +1,42 @@
 import json
-from openai import OpenAI
-import google.generativeai as genai
+import asyncio
+from functools import lru_cache
 from config_loader import CONFIG
 import os
 
 # Load from config
 AI_VENDOR = CONFIG["ai"]["vendor"].lower()
 MODEL_NAME = CONFIG["ai"]["model"]
+MAX_CONCURRENCY = CONFIG["ai"].get("max_concurrency", {})
+TIMEOUT_SECONDS = CONFIG["ai"].get("timeout_seconds", 120)
+MOCK_CONFIG = CONFIG["ai"].get("mock", {})
+PERPLEXITY_BASE_URL = "https://api.perplexity.ai"
 
-# Configure clients
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-perplexity_client = OpenAI(api_key=os.getenv("PERPLEXITY_API_KEY"), base_url="https://api.perplexity.ai")
+# Vendor SDKs are imported and their clients built on first use, so only the
+# vendor actually in use is ever loaded.
+@lru_cache(maxsize=None)
+def _openai_client(vendor):
+    from openai import OpenAI
+    if vendor == "perplexity":
+        return OpenAI(api_key=os.getenv("PERPLEXITY_API_KEY"), base_url=PERPLEXITY_BASE_URL)
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+
+
+@lru_cache(maxsize=None)
+def _genai():
+    import google.generativeai as genai
+    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+    return genai
+
+
+def warm_up(vendor=None):
+    """Load the SDK and build the clients for `vendor` (default: the configured one) ahead of the first request."""
+    vendor = (vendor or AI_VENDOR).lower()
+    if vendor in ("openai", "perplexity"):
+        _openai_client(vendor)
+        _async_openai_client(vendor)
+    elif vendor == "gemini":
+        _genai()
 
 
 def send_prompt(messages):
@@ -21,33 +46,153 @@ def send_prompt(messages):
         return _send_gemini(messages)
     elif AI_VENDOR == "perplexity":
         return _send_perplexity(messages)
+    elif AI_VENDOR == "mock":
+        return _mock_response(messages)
     else:
         raise ValueError(f"Unsupported AI_VENDOR: {AI_VENDOR}")
 
 def _send_openai(messages):
     if isinstance(messages, str):
         messages = [{"role": "user", "content": messages}]
-    response = openai_client.chat.completions.create(
+    response = _openai_client("openai").chat.completions.create(
         model=MODEL_NAME,
         messages=messages
     )
     return response.choices[0].message.content.strip()
 
-def _send_gemini(messages):
+def _gemini_prompt(messages):
     if isinstance(messages, list):
-        prompt = "\n".join([m["content"] for m in messages if m["role"] == "user"])
-    else:
-        prompt = messages
+        return "\n".join([m["content"] for m in messages if m["role"] == "user"])
+    return messages
+
+def _send_gemini(messages):
+    prompt = _gemini_prompt(messages)
 
-    model = genai.GenerativeModel(MODEL_NAME)
+    model = _genai().GenerativeModel(MODEL_NAME)
     response = model.generate_content(prompt)
     return response.text.strip()
     
 def _send_perplexity(messages):
     if isinstance(messages, str):
         messages = [{"role": "user", "content": messages}]
-    response = perplexity_client.chat.completions.create(
+    response = _openai_client("perplexity").chat.completions.create(
         model=MODEL_NAME,
         messages=messages
     )
     return response.choices[0].message.content.strip()
+
+
+# --- Async provider layer ---
+# Async clients keep their HTTP connection pools for the life of the process.
+# Each vendor has its own concurrency limit and every call has a timeout, so a
+# slow vendor never blocks the event loop or starves other requests.
+_async_clients = {}
+_semaphores = {}
+
+
+def _async_openai_client(vendor):
+    client = _async_clients.get(vendor)
+    if client is None:
+        from openai import AsyncOpenAI
+        if vendor == "perplexity":
+            client = AsyncOpenAI(api_key=os.getenv("PERPLEXITY_API_KEY"), base_url=PERPLEXITY_BASE_URL)
+        else:
+            client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        _async_clients[vendor] = client
+    return client
+
+
+def _semaphore(vendor):
+    semaphore = _semaphores.get(vendor)
+    if semaphore is None:
+        limit = MAX_CONCURRENCY.get(vendor, MAX_CONCURRENCY.get("default", 4))
+        semaphore = _semaphores[vendor] = asyncio.Semaphore(limit)
+    return semaphore
+
+
+def _as_messages(messages):
+    if isinstance(messages, str):
+        return [{"role": "user", "content": messages}]
+    return messages
+
+
+def _mock_response(messages):
+    prompt = messages if isinstance(messages, str) else "\n".join(m["content"] for m in messages)
+    return MOCK_CONFIG.get(
+        "response",
+        f"Mock diagnosis for a {len(prompt)}-character prompt. Check the changed services and files first."
+    )
+
+
+async def _stream_openai_compatible(vendor, messages, model):
+    client = _async_openai_client(vendor)
+    response = await client.chat.completions.create(
+        model=model,
+        messages=_as_messages(messages),
+        stream=True
+    )
+    async for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def _stream_gemini(messages, model):
+    response = await _genai().GenerativeModel(model).generate_content_async(_gemini_prompt(messages), stream=True)
+    async for chunk in response:
+        if chunk.text:
+            yield chunk.text
+
+
+async def _stream_mock(messages):
+    """Offline vendor for latency/concurrency testing (ai.mock in config.json)."""
+    await asyncio.sleep(MOCK_CONFIG.get("first_token_seconds", 0.2))
+    delay = MOCK_CONFIG.get("token_interval_seconds", 0.02)
+    for word in _mock_response(messages).split(" "):
+        yield word + " "
+        await asyncio.sleep(delay)
+
+
+def _vendor_stream(vendor, messages, model):
+    if vendor in ("openai", "perplexity"):
+        return _stream_openai_compatible(vendor, messages, model)
+    elif vendor == "gemini":
+        return _stream_gemini(messages, model)
+    elif vendor == "mock":
+        return _stream_mock(messages)
+    else:
+        raise ValueError(f"Unsupported AI_VENDOR: {vendor}")
+
+
+async def stream_prompt(messages, vendor=None, model=None, timeout=None):
+    """
+    Async generator of response text chunks. `timeout` bounds the wait for
+    each chunk (and therefore the time to first token).
+    """
+    vendor = (vendor or AI_VENDOR).lower()
+    model = model or MODEL_NAME
+    timeout = timeout or TIMEOUT_SECONDS
+
+    async with _semaphore(vendor):
+        stream = _vendor_stream(vendor, messages, model)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), timeout)
+                except StopAsyncIteration:
+                    break
+                yield chunk
+        finally:
+            await stream.aclose()
+
+
+async def send_prompt_async(messages, vendor=None, model=None, timeout=None):
+    """Non-blocking equivalent of send_prompt()."""
+    timeout = timeout or TIMEOUT_SECONDS
+    chunks = []
+
+    async def collect():
+        async for chunk in stream_prompt(messages, vendor, model, timeout):
+            chunks.append(chunk)
+
+    await asyncio.wait_for(collect(), timeout)
+    return "".join(chunks).strip()
@@ -0,0 +1,301 @@
+"""
+Latency-aware routing of AI prompts across vendors, with fallback and hedging.
+
+The routes (vendor, model) come from config "ai.routing.routes"; without it
+the router has the one configured vendor and behaves like ai_provider.
+
+- Every attempt is timed to its first chunk. Per route the router keeps an
+  EWMA of that latency, a window of samples for quantiles, and an EWMA error
+  rate. Routes are tried healthy first (not cooling down after a 429, error
+  rate under `max_error_rate`), then fastest first; a route with no samples
+  yet keeps its configured rank ahead of measured ones, so each gets tried.
+- If an attempt fails before its first chunk (timeout, 429, API error), the
+  next route is tried. A 429 also puts the route in cooldown.
+- Hedging: if the first attempt has produced nothing after the route's p95
+  (`hedge_quantile`) first-chunk latency, a second route is started and the
+  first to produce a chunk wins; the other is cancelled. Once a stream has
+  started there is no fallback (its text is already out).
+
+`stream` (default ai_provider.stream_prompt) is the only way the router talks
+to vendors, so fake vendors with injected delays can stand in for them (see
+benchmarks/bench_ai_router.py).
+"""
+import asyncio
+import time
+from collections import deque
+
+from ai_provider import AI_VENDOR, MODEL_NAME, TIMEOUT_SECONDS, stream_prompt
+
+DEFAULT_ALPHA = 0.2
+DEFAULT_WINDOW = 200
+
+
+class AllRoutesFailed(Exception):
+    """Every route failed before producing a chunk; `errors` holds (route, exception)."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(f"{route}: {type(e).__name__}: {e}" for route, e in errors) or "No AI routes")
+
+
+def is_rate_limited(error):
+    """True for a vendor's 429 (openai.RateLimitError, google ResourceExhausted, ...), without importing SDKs."""
+    if getattr(error, "status_code", None) == 429 or getattr(error, "code", None) == 429:
+        return True
+    return type(error).__name__ in ("RateLimitError", "ResourceExhausted", "TooManyRequests")
+
+
+class RouteStats:
+    """Latency and error statistics of one (vendor, model) route."""
+
+    def __init__(self, vendor, model, alpha=DEFAULT_ALPHA, window=DEFAULT_WINDOW):
+        self.vendor = vendor
+        self.model = model
+        self.alpha = alpha
+        self.samples = deque(maxlen=window)
+        self.ewma_first_chunk = None
+        self.ewma_total = None
+        self.error_rate = 0.0
+        self.cooldown_until = 0.0
+        self.counts = {"attempts": 0, "successes": 0, "errors": 0, "timeouts": 0, "rate_limited": 0,
+                       "hedges": 0, "hedge_wins": 0, "cancelled": 0}
+
+    def __str__(self):
+        return f"{self.vendor}/{self.model}"
+
+    def _ewma(self, current, value):
+        return value if current is None else current + self.alpha * (value - current)
+
+    def record_first_chunk(self, seconds):
+        self.samples.append(seconds)
+        self.ewma_first_chunk = self._ewma(self.ewma_first_chunk, seconds)
+        self.error_rate += self.alpha * (0.0 - self.error_rate)
+
+    def record_success(self, total_seconds):
+        self.counts["successes"] += 1
+        self.ewma_total = self._ewma(self.ewma_total, total_seconds)
+
+    def record_failure(self, error, now, cooldown_seconds):
+        self.counts["errors"] += 1
+        if isinstance(error, asyncio.TimeoutError):
+            self.counts["timeouts"] += 1
+        elif is_rate_limited(error):
+            self.counts["rate_limited"] += 1
+            self.cooldown_until = now + cooldown_seconds
+        self.error_rate += self.alpha * (1.0 - self.error_rate)
+
+    def record_cancelled(self, seconds):
+        # A cancelled loser took at least this long; count it so a route that
+        # always loses its race doesn't keep a stale, flattering latency.
+        self.counts["cancelled"] += 1
+        self.samples.append(seconds)
+        self.ewma_first_chunk = self._ewma(self.ewma_first_chunk, seconds)
+
+    def quantile(self, q):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def to_dict(self, now):
+        return {
+            "vendor": self.vendor,
+            "model": self.model,
+            **self.counts,
+            "ewma_first_chunk_seconds": _round(self.ewma_first_chunk),
+            "ewma_total_seconds": _round(self.ewma_total),
+            "p50_first_chunk_seconds": _round(self.quantile(0.5)),
+            "p95_first_chunk_seconds": _round(self.quantile(0.95)),
+            "error_rate": round(self.error_rate, 3),
+            "cooldown_seconds": round(max(0.0, self.cooldown_until - now), 1),
+        }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+class AIRouter:
+    """
+    Routes prompts across `routes`, a list of (vendor, model) in preference order.
+
+    Args:
+        stream: Async generator function (messages, vendor, model, timeout)
+            yielding text chunks; `timeout` bounds the wait for each chunk.
+        hedge (bool): Start a second route when the first is slow.
+        hedge_quantile (float): Latency quantile of a route after which it is hedged.
+        hedge_min_seconds (float): Never hedge earlier than this.
+        hedge_default_seconds (float): Hedge delay while a route has fewer than
+            `min_samples` samples.
+        attempt_timeout (float): Per-chunk timeout of each attempt.
+        cooldown_seconds (float): How long a route is skipped after a 429.
+        max_error_rate (float): Routes with a higher error rate are tried last.
+    """
+
+    def __init__(self, routes, stream=stream_prompt, hedge=True, hedge_quantile=0.95, hedge_min_seconds=1.0,
+                 hedge_default_seconds=10.0, min_samples=5, attempt_timeout=None, cooldown_seconds=30.0,
+                 max_error_rate=0.5, alpha=DEFAULT_ALPHA, window=DEFAULT_WINDOW, clock=time.monotonic):
+        if not routes:
+            raise ValueError("AIRouter needs at least one route.")
+        self.routes = [RouteStats(vendor.lower(), model, alpha, window) for vendor, model in routes]
+        self._stream = stream
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_seconds = hedge_min_seconds
+        self.hedge_default_seconds = hedge_default_seconds
+        self.min_samples = min_samples
+        self.attempt_timeout = attempt_timeout or TIMEOUT_SECONDS
+        self.cooldown_seconds = cooldown_seconds
+        self.max_error_rate = max_error_rate
+        self.clock = clock
+
+    @classmethod
+    def from_config(cls, ai_config, **kwargs):
+        """Router for config "ai": its "routing" section, or just the configured vendor."""
+        routing = ai_config.get("routing") or {}
+        routes = [(r["vendor"], r.get("model") or MODEL_NAME) for r in routing.get("routes", ())]
+        return cls(
+            routes or [(AI_VENDOR, MODEL_NAME)],
+            hedge=routing.get("hedge", True),
+            hedge_quantile=routing.get("hedge_quantile", 0.95),
+            hedge_min_seconds=routing.get("hedge_min_seconds", 1.0),
+            hedge_default_seconds=routing.get("hedge_default_seconds", 10.0),
+            min_samples=routing.get("min_samples", 5),
+            attempt_timeout=routing.get("attempt_timeout_seconds", ai_config.get("timeout_seconds")),
+            cooldown_seconds=routing.get("cooldown_seconds", 30.0),
+            max_error_rate=routing.get("max_error_rate", 0.5),
+            **kwargs,
+        )
+
+    @property
+    def vendors(self):
+        return [(route.vendor, route.model) for route in self.routes]
+
+    def candidates(self):
+        """Routes in the order they'd be tried now."""
+        now = self.clock()
+
+        def rank(item):
+            index, route = item
+            return (route.cooldown_until > now, route.error_rate > self.max_error_rate,
+                    route.ewma_first_chunk or 0.0, index)
+
+        return [route for _, route in sorted(enumerate(self.routes), key=rank)]
+
+    def hedge_delay(self, route):
+        if len(route.samples) < self.min_samples:
+            return max(self.hedge_min_seconds, self.hedge_default_seconds)
+        return max(self.hedge_min_seconds, route.quantile(self.hedge_quantile))
+
+    async def _open(self, route, messages):
+        """Start `route`'s stream and wait for its first chunk; returns (stream, first chunk)."""
+        stream = self._stream(messages, route.vendor, route.model, self.attempt_timeout)
+        try:
+            first = await stream.__anext__()
+        except StopAsyncIteration:
+            first = ""
+        except BaseException:
+            await stream.aclose()
+            raise
+        return stream, first
+
+    async def _race(self, messages):
+        """First route to produce a chunk, with fallback and hedging: (route, stream, first chunk, started)."""
+        routes = iter(self.candidates())
+        left = len(self.routes)
+        pending = {}
+        errors = []
+        hedged = False
+
+        def launch(hedge=False):
+            nonlocal left
+            route = next(routes)
+            left -= 1
+            route.counts["attempts"] += 1
+            if hedge:
+                route.counts["hedges"] += 1
+            pending[asyncio.ensure_future(self._open(route, messages))] = (route, self.clock(), hedge)
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and not hedged and left and len(pending) == 1:
+                    (route, started, _), = pending.values()
+                    timeout = max(0.0, started + self.hedge_delay(route) - self.clock())
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    launch(hedge=True)
+                    continue
+
+                winner = None
+                for task in done:
+                    route, started, hedge = pending.pop(task)
+                    error = task.exception()
+                    if error is not None:
+                        route.record_failure(error, self.clock(), self.cooldown_seconds)
+                        errors.append((route, error))
+                    elif winner is None:
+                        route.record_first_chunk(self.clock() - started)
+                        if hedge:
+                            route.counts["hedge_wins"] += 1
+                        winner = (route, *task.result(), started)
+                    else:
+                        # Two routes answered in the same tick; keep one.
+                        await task.result()[0].aclose()
+                if winner is not None:
+                    return winner
+                if not pending and left:
+                    launch()  # fall back to the next route
+            raise AllRoutesFailed([(str(route), error) for route, error in errors])
+        finally:
+            for task, (route, started, _) in pending.items():
+                task.cancel()
+                route.record_cancelled(self.clock() - started)
+            for result in await asyncio.gather(*pending, return_exceptions=True):
+                if isinstance(result, tuple):
+                    await result[0].aclose()
+
+    async def stream(self, messages, on_route=None):
+        """
+        Async generator of response text chunks from the first route to answer;
+        `on_route(route)` is called with that route before the first chunk.
+        """
+        route, stream, first, started = await self._race(messages)
+        try:
+            if on_route is not None:
+                on_route(route)
+            if first:
+                yield first
+            async for chunk in stream:
+                yield chunk
+        except Exception as e:
+            route.record_failure(e, self.clock(), self.cooldown_seconds)
+            raise
+        else:
+            route.record_success(self.clock() - started)
+        finally:
+            await stream.aclose()
+
+    async def send(self, messages, timeout=None, on_route=None):
+        """
+        The whole response text (see stream()). `timeout` bounds the total
+        time; by default one attempt timeout per route.
+        """
+        chunks = []
+
+        async def collect():
+            async for chunk in self.stream(messages, on_route):
+                chunks.append(chunk)
+
+        await asyncio.wait_for(collect(), timeout or self.attempt_timeout * len(self.routes))
+        return "".join(chunks).strip()
+
+    def stats(self):
+        now = self.clock()
+        return {
+            "order": [str(route) for route in self.candidates()],
+            "hedge": self.hedge,
+            "routes": [route.to_dict(now) for route in self.routes],
+        }
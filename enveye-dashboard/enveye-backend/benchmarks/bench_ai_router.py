@@ -0,0 +1,138 @@
+"""
+Benchmark: AI routing with hedging and fallback, against local fake vendors.
+
+Fake vendors stream a canned reply after an injected first-chunk delay
+(log-normal, with a `--slow-share` of calls `--slow-factor` times slower),
+and can answer 429 or hang. Measures
+- end-to-end latency percentiles of one vendor alone vs the hedged router,
+- fallback when the primary rate-limits (429 -> cooldown, next route first),
+- fallback when the primary hangs past the attempt timeout,
+and prints the router's per-route stats.
+
+Usage (from enveye-backend/):
+    python benchmarks/bench_ai_router.py
+    python benchmarks/bench_ai_router.py --requests 500 --median-ms 80 --slow-share 0.1
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from ai_router import AIRouter
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+class FakeVendors:
+    """stream(messages, vendor, model, timeout) over fake vendors configured by name."""
+
+    def __init__(self, median_seconds, slow_share, slow_factor, seed=0):
+        self.rnd = random.Random(seed)
+        self.median_seconds = median_seconds
+        self.slow_share = slow_share
+        self.slow_factor = slow_factor
+        self.behaviour = {}  # vendor -> "ok" | "429" | "hang"
+
+    def delay(self):
+        delay = self.median_seconds * self.rnd.lognormvariate(0, 0.25)
+        if self.rnd.random() < self.slow_share:
+            delay *= self.slow_factor
+        return delay
+
+    async def stream(self, messages, vendor, model, timeout):
+        behaviour = self.behaviour.get(vendor, "ok")
+        if behaviour == "429":
+            await asyncio.sleep(0.005)
+            raise RateLimitError(f"{vendor}: too many requests")
+        delay = 3600 if behaviour == "hang" else self.delay()
+        await asyncio.wait_for(asyncio.sleep(delay), timeout)
+        for word in f"answer from {vendor}".split():
+            yield word + " "
+
+
+async def run(router, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, answers = [], []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            answers.append(await router.send("prompt"))
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return latencies, answers
+
+
+def percentiles(latencies):
+    ordered = sorted(latencies)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return f"p50 {pick(0.5):7.1f} ms  p95 {pick(0.95):7.1f} ms  p99 {pick(0.99):7.1f} ms  " \
+           f"mean {statistics.mean(latencies) * 1000:7.1f} ms"
+
+
+async def main_async(args):
+    median = args.median_ms / 1000
+    routes = [("primary", "m1"), ("secondary", "m2")]
+    options = dict(hedge_min_seconds=median, hedge_default_seconds=median * 3, min_samples=10,
+                   attempt_timeout=median * 20)
+
+    fakes = FakeVendors(median, args.slow_share, args.slow_factor)
+    alone = AIRouter(routes[:1], stream=fakes.stream, hedge=False, **options)
+    latencies, _ = await run(alone, args.requests, args.concurrency)
+    print(f"one vendor:      {percentiles(latencies)}")
+    baseline_p99 = sorted(latencies)[int(0.99 * len(latencies))]
+
+    fakes = FakeVendors(median, args.slow_share, args.slow_factor)
+    hedged = AIRouter(routes, stream=fakes.stream, **options)
+    latencies, _ = await run(hedged, args.requests, args.concurrency)
+    print(f"hedged router:   {percentiles(latencies)}")
+    routes_stats = hedged.stats()["routes"]
+    print(f"  hedges started {sum(r['hedges'] for r in routes_stats)}, "
+          f"won {sum(r['hedge_wins'] for r in routes_stats)}")
+    assert sorted(latencies)[int(0.99 * len(latencies))] < baseline_p99, "hedging did not cut the tail"
+
+    fakes = FakeVendors(median, 0, 1)
+    fakes.behaviour["primary"] = "429"
+    router = AIRouter(routes, stream=fakes.stream, cooldown_seconds=60, **options)
+    _, answers = await run(router, 20, 1)
+    assert all(answer == "answer from secondary" for answer in answers)
+    stats = router.stats()
+    print(f"429 fallback:    order now {stats['order']}, primary rate-limited "
+          f"{stats['routes'][0]['rate_limited']} time(s) in 20 requests")
+    assert stats["order"][0] == "secondary/m2" and stats["routes"][0]["rate_limited"] == 1
+
+    fakes = FakeVendors(median, 0, 1)
+    fakes.behaviour["primary"] = "hang"
+    router = AIRouter(routes, stream=fakes.stream, hedge=False, **options)
+    start = time.perf_counter()
+    winner = []
+    answer = await router.send("prompt", on_route=winner.append)
+    print(f"timeout fallback: '{answer}' after {(time.perf_counter() - start) * 1000:.0f} ms "
+          f"(attempt timeout {options['attempt_timeout'] * 1000:.0f} ms)")
+    assert answer == "answer from secondary" and router.stats()["routes"][0]["timeouts"] == 1
+    assert [str(route) for route in winner] == ["secondary/m2"], "winning route not reported"
+
+    print(json.dumps(hedged.stats(), indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--median-ms", type=float, default=50)
+    parser.add_argument("--slow-share", type=float, default=0.08)
+    parser.add_argument("--slow-factor", type=float, default=10)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
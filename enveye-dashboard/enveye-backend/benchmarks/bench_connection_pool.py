@@ -0,0 +1,169 @@
+"""
+Benchmark: pooled vs fresh SSH connections, against an in-process paramiko server.
+
+A minimal paramiko ServerInterface on 127.0.0.1 accepts one password and
+answers every exec request with the command line and exit status 0. Measures
+- `--collections` commands over a new SSHConnection each vs ConnectionPool.ssh,
+and checks that
+- the pool opened one connection and reused it,
+- a connection idle past `idle_timeout` is evicted and replaced,
+- a connection the server dropped fails the health check and is replaced.
+
+Usage (from enveye-backend/):
+    python benchmarks/bench_connection_pool.py
+    python benchmarks/bench_connection_pool.py --collections 200
+"""
+import argparse
+import socket
+import sys
+import threading
+import time
+from pathlib import Path
+
+import paramiko
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from connection_pool import ConnectionPool, SSHConnection
+
+USERNAME, PASSWORD = "enveye", "secret"
+
+
+class StubServer(paramiko.ServerInterface):
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (USERNAME, PASSWORD):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        def answer():
+            # EOF rather than close: the exec reply may not have gone out yet,
+            # and the client closes the channel once it has read everything.
+            channel.sendall(command + b"\n")
+            channel.send_exit_status(0)
+            channel.shutdown_write()
+
+        threading.Thread(target=answer, daemon=True).start()
+        return True
+
+
+class StubSSHD:
+    """Accepts connections on a free local port; `drop_all()` closes them server-side."""
+
+    def __init__(self):
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+        self.transports = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            transport = paramiko.Transport(client)
+            transport.add_server_key(self.host_key)
+            transport.start_server(server=StubServer())
+            self.transports.append(transport)
+            # Accept (and hold on to: a collected Channel closes itself) every channel.
+            threading.Thread(target=self._drain, args=(transport,), daemon=True).start()
+
+    def _drain(self, transport):
+        channels = []
+        while transport.is_active():
+            channel = transport.accept(1)
+            if channel is not None:
+                channels = [c for c in channels if not c.closed] + [channel]
+
+    def drop_all(self):
+        for transport in self.transports:
+            transport.close()
+        self.transports.clear()
+
+    def close(self):
+        self.drop_all()
+        self.sock.close()
+
+
+def ssh_connection(host, port, username, password, connect_timeout=15):
+    # Without TCP_NODELAY every exec round trip waits out a delayed ACK on loopback.
+    connection = SSHConnection(host, port, username, password, connect_timeout=connect_timeout)
+    connection.client.get_transport().sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return connection
+
+
+def run(connection, command):
+    _, stdout, _ = connection.client.exec_command(command)
+    output = stdout.read()
+    assert stdout.channel.recv_exit_status() == 0 and output == command.encode() + b"\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--collections", type=int, default=50)
+    parser.add_argument("--idle-timeout", type=float, default=0.5)
+    args = parser.parse_args()
+
+    sshd = StubSSHD()
+    try:
+        start = time.perf_counter()
+        for i in range(args.collections):
+            connection = ssh_connection("127.0.0.1", sshd.port, USERNAME, PASSWORD, connect_timeout=5)
+            try:
+                run(connection, f"echo {i}")
+            finally:
+                connection.close()
+        fresh = time.perf_counter() - start
+
+        pool = ConnectionPool(idle_timeout=args.idle_timeout, connect_timeout=5, ports={"ssh": sshd.port},
+                              factories={"ssh": ssh_connection})
+        start = time.perf_counter()
+        for i in range(args.collections):
+            with pool.ssh("127.0.0.1", USERNAME, PASSWORD) as connection:
+                run(connection, f"echo {i}")
+        pooled = time.perf_counter() - start
+
+        print(f"{args.collections} commands, fresh connections: {fresh * 1000:8.1f} ms "
+              f"({fresh / args.collections * 1000:.1f} ms each)")
+        print(f"{args.collections} commands, pooled:            {pooled * 1000:8.1f} ms "
+              f"({pooled / args.collections * 1000:.1f} ms each)  {fresh / pooled:.1f}x")
+        stats = pool.snapshot_stats()
+        assert stats["created"] == 1 and stats["reused"] == args.collections - 1, stats
+
+        time.sleep(args.idle_timeout * 1.5)
+        with pool.ssh("127.0.0.1", USERNAME, PASSWORD) as connection:
+            run(connection, "echo after idle")
+        stats = pool.snapshot_stats()
+        print(f"idle eviction:  evicted {stats['evicted']}, created {stats['created']}")
+        assert stats["evicted"] == 1 and stats["created"] == 2, stats
+
+        sshd.drop_all()
+        time.sleep(0.2)  # let the client transport notice the disconnect
+        with pool.ssh("127.0.0.1", USERNAME, PASSWORD) as connection:
+            run(connection, "echo after drop")
+        stats = pool.snapshot_stats()
+        print(f"health check:   unhealthy {stats['unhealthy']}, created {stats['created']}")
+        assert stats["unhealthy"] == 1 and stats["created"] == 3, stats
+
+        pool.close_all()
+        print(pool.snapshot_stats())
+    finally:
+        sshd.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark: raw diff vs digest in the diagnosis prompt.
+
+For two synthetic snapshots where most changed files only have a new
+`modified` timestamp (as after a redeploy), plus a replaced version folder,
+a stopped service and a changed variable, measures
+- tokens of the raw report as generate_initial_prompt used to inline it,
+- time to build the digest and tokens of its full rendering,
+- what fits in the diff share of a vendor budget, and checks that the
+  service and variable changes come first.
+
+Usage (from enveye-backend/):
+    python benchmarks/bench_diff_digest.py
+    python benchmarks/bench_diff_digest.py --files 500000 --touched 0.3 --budget 8000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from bench_snapshot_diff import make_context, mutate_context
+from diff_digest import DigestRules, digest_report
+from snapshot_diff import diff_environment_context
+from token_budget import count_tokens
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def redeploy(context, touched, version_files, seed=2):
+    """A copy of `context` after a redeploy: new timestamps, a new version folder, a stopped service."""
+    rnd = random.Random(seed)
+    new = mutate_context(context, 0.001)
+    files = new["app_folder_files"]
+    for path in rnd.sample(list(files), int(len(files) * touched)):
+        files[path]["modified"] = "2025-06-02T03:00:00-04:00"
+    for i in range(version_files):
+        files[f"Application\\136.0.3240.50\\{'locales' if i % 4 else 'bin'}\\part_{i}.dll"] = {
+            "modified": "2025-06-02T03:00:00-04:00", "sha256": f"{i:064x}", "size_bytes": i,
+        }
+    new["required_services_status"]["W3SVC"] = "Stopped"
+    new["critical_environment_variables"]["APP_ENV"] = "staging"
+    return new
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=100_000)
+    parser.add_argument("--touched", type=float, default=0.2, help="Share of files with a new timestamp only")
+    parser.add_argument("--version-files", type=int, default=412)
+    parser.add_argument("--budget", type=int, default=7000, help="Tokens for the diff (50%% of a 16k context)")
+    args = parser.parse_args()
+
+    old = make_context(args.files)
+    new = redeploy(old, args.touched, args.version_files)
+    report = diff_environment_context(old, new)
+    changes = sum(len(entries) for entries in report.values())
+
+    raw_tokens, seconds = timed(count_tokens, json.dumps(report, indent=2))
+    print(f"{args.files} files, {changes} changes")
+    print(f"raw report:    {raw_tokens:>9} tokens  (counted in {seconds * 1000:.0f} ms)")
+
+    digest, seconds = timed(digest_report, report, DigestRules())
+    text, _ = digest.render()
+    print(f"digest:        {count_tokens(text):>9} tokens  {len(digest)} lines  built in {seconds * 1000:.0f} ms")
+
+    (packed, omitted), seconds = timed(digest.render, args.budget)
+    print(f"in {args.budget} tokens: {count_tokens(packed):>6} tokens  {omitted} items omitted  "
+          f"({seconds * 1000:.0f} ms)")
+    print()
+    print("\n".join(packed.splitlines()[:12]))
+
+    lines = packed.splitlines()
+    headers = [line for line in lines if line.endswith(":")]
+    assert headers[0].startswith("Service status changes") and "W3SVC" in packed, "service flips are not first"
+    assert headers[1].startswith("Environment variable changes"), "variable changes are not second"
+    assert any(f"{args.version_files} files under Application\\136.0.3240.50\\" in line for line in lines), \
+        "version folder is not collapsed"
+    assert count_tokens(packed) <= args.budget
+
+
+if __name__ == "__main__":
+    main()
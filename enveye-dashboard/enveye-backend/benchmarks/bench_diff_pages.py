@@ -0,0 +1,93 @@
+"""
+Benchmark: whole diff report vs first page / first NDJSON chunk.
+
+For two synthetic snapshots (loaded compact, as /compare does) measures
+- the whole report: diff time, JSON encode time and payload size,
+- the first page of `--page-size` records, and a filtered first page,
+- the NDJSON stream: time to the first chunk and to the end,
+- walking every page of a cached diff (as /compare_stored does) by cursor,
+and checks that the pages and the NDJSON stream both give exactly the
+records of the full change stream.
+
+Usage (from enveye-backend/):
+    python benchmarks/bench_diff_pages.py
+    python benchmarks/bench_diff_pages.py --files 500000 --change-ratio 0.2 --page-size 200
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from bench_snapshot_diff import make_context, mutate_context
+from diff_pages import DiffFilter, change_record, iter_ndjson, page_changes
+from file_table import compact_snapshot
+from snapshot_diff import diff_snapshots, iter_changes
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200_000)
+    parser.add_argument("--change-ratio", type=float, default=0.2)
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    old_context = make_context(args.files)
+    new_context = mutate_context(old_context, args.change_ratio)
+    old = compact_snapshot({"environment_context": old_context})
+    new = compact_snapshot({"environment_context": new_context})
+
+    report, diff_seconds = timed(diff_snapshots, old, new)
+    payload, encode_seconds = timed(lambda: json.dumps({"differences": report}, ensure_ascii=False).encode("utf-8"))
+    total = sum(len(entries) for entries in report.values())
+    print(f"{args.files} files, {total} changes")
+    print(f"whole report:        diff {diff_seconds * 1000:7.0f} ms  encode {encode_seconds * 1000:6.0f} ms  "
+          f"{len(payload) / 2**20:6.1f} MB")
+
+    page, seconds = timed(page_changes, iter_changes(old, new), limit=args.page_size)
+    size = len(json.dumps(page, ensure_ascii=False).encode("utf-8"))
+    print(f"first page:          {seconds * 1000:7.1f} ms  {len(page['changes'])} records  {size / 1024:.1f} KB")
+
+    dll_filter = DiffFilter.from_params(sections="app_folder_files", types="removed", include="*/1/*.dll")
+    page, seconds = timed(page_changes, iter_changes(old, new), dll_filter, limit=args.page_size)
+    print(f"filtered first page: {seconds * 1000:7.1f} ms  {len(page['changes'])} records")
+
+    start = time.perf_counter()
+    chunks = iter_ndjson(iter_changes(old, new))
+    first = next(chunks)
+    first_seconds = time.perf_counter() - start
+    body = first + b"".join(chunks)
+    print(f"ndjson stream:       first chunk {first_seconds * 1000:6.1f} ms  "
+          f"all {(time.perf_counter() - start) * 1000:7.0f} ms  {len(body) / 2**20:6.1f} MB")
+
+    expected = [json.loads(json.dumps(change_record(c), ensure_ascii=False)) for c in iter_changes(old, new)]
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert lines[-1] == {"done": True, "count": len(expected)}, "stream summary is wrong"
+    assert lines[:-1] == expected, "stream records differ from the change stream"
+
+    cached = tuple(iter_changes(old, new))  # what /compare_stored pages over
+    walked, cursor, pages = [], None, 0
+    start = time.perf_counter()
+    while True:
+        page = page_changes(cached, limit=1000, cursor=cursor)
+        walked.extend(json.loads(json.dumps(page["changes"], ensure_ascii=False)))
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    print(f"walked {pages} pages of 1000 of the cached diff in {(time.perf_counter() - start) * 1000:.0f} ms")
+    assert walked == expected, "pages differ from the change stream"
+    assert {r["path"] for r in expected} == {p for entries in report.values() for p in entries}
+    print("pages, stream and report agree")
+
+
+if __name__ == "__main__":
+    main()
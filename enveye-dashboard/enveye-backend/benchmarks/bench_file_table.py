@@ -0,0 +1,84 @@
+"""
+Benchmark: app_folder_files as dicts vs as a FileTable.
+
+For synthetic snapshots of each size, measures
+- memory held by the parsed file map (tracemalloc), dicts vs table, for the
+  first snapshot and for each further snapshot of the same host (whose
+  tables share the interned paths, as in the snapshot cache),
+- time to build the table from the dict and straight from the JSON stream,
+- diff time of two snapshots (dict join vs columnar sorted merge),
+and checks that the table round-trips to the same JSON and that both diffs
+report the same changes.
+
+Usage (from enveye-backend/):
+    python benchmarks/bench_file_table.py
+    python benchmarks/bench_file_table.py --sizes 10000 100000 500000 --change-ratio 0.01
+"""
+import argparse
+import gc
+import io
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from bench_snapshot_diff import make_context, mutate_context
+from file_table import FileTable, compact_snapshot, expand_snapshot
+from snapshot_diff import diff_snapshots
+from snapshot_ingest import read_compact_snapshot
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def allocated(build):
+    """(object built by `build()`, bytes it still holds)"""
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--change-ratio", type=float, default=0.01)
+    args = parser.parse_args()
+
+    print(f"{'files':>9} {'dict MB':>8} {'table MB':>9} {'ratio':>6} {'next MB':>8} {'ratio':>6} "
+          f"{'build':>8} {'stream':>8} {'dict diff':>10} {'table diff':>11} {'speedup':>8}")
+    for size in args.sizes:
+        old = {"environment_context": make_context(size)}
+        new = {"environment_context": mutate_context(old["environment_context"], args.change_ratio)}
+        data = json.dumps(old).encode("utf-8")
+
+        _, dict_bytes = allocated(lambda: json.loads(data)["environment_context"]["app_folder_files"])
+        table, table_bytes = allocated(lambda: compact_snapshot(json.loads(data))["environment_context"]["app_folder_files"])
+        next_table, next_bytes = allocated(lambda: compact_snapshot(json.loads(data))["environment_context"]["app_folder_files"])
+        _, build = timed(FileTable.from_mapping, old["environment_context"]["app_folder_files"])
+        streamed, stream = timed(read_compact_snapshot, io.BytesIO(data))
+        assert json.dumps(expand_snapshot(streamed)).encode("utf-8") == data, "round trip changed the JSON"
+
+        old_compact = compact_snapshot(json.loads(data))
+        new_compact = compact_snapshot(json.loads(json.dumps(new)))
+        expected, dict_diff = timed(diff_snapshots, old, new)
+        got, table_diff = timed(diff_snapshots, old_compact, new_compact)
+        assert got == expected, "columnar diff disagrees with the dict diff"
+
+        print(f"{size:>9} {dict_bytes / 2**20:8.1f} {table_bytes / 2**20:9.1f} {dict_bytes / table_bytes:5.1f}x "
+              f"{next_bytes / 2**20:8.1f} {dict_bytes / next_bytes:5.1f}x {build * 1000:6.0f}ms {stream * 1000:6.0f}ms "
+              f"{dict_diff * 1000:8.1f}ms {table_diff * 1000:9.1f}ms {dict_diff / table_diff:7.1f}x")
+        del table, next_table
+
+
+if __name__ == "__main__":
+    main()
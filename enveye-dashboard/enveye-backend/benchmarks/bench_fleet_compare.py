@@ -0,0 +1,71 @@
+"""
+Benchmark: N-way fleet compare over stored snapshots.
+
+Writes a synthetic fleet (most hosts identical to a golden snapshot, a few
+drift groups) through the sectioned store, then times compare_fleet against
+the golden baseline and against the fleet majority.
+
+Usage (from enveye-backend/):
+    python benchmarks/bench_fleet_compare.py
+    python benchmarks/bench_fleet_compare.py --hosts 1000 --files 2000 --workers 8
+"""
+import argparse
+import copy
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from bench_snapshot_diff import make_context, mutate_context
+from fleet_compare import compare_fleet
+from snapshot_store import SectionStore
+
+
+def build_fleet(directory, hosts, files, drift_groups):
+    store = SectionStore(directory)
+    golden = {"application_name": "App", "application_type": "web", "environment_context": make_context(files)}
+    variants = [mutate_context(golden["environment_context"], 0.002, seed=g + 1) for g in range(drift_groups)]
+    paths = []
+    for i in range(hosts):
+        snapshot = copy.copy(golden)
+        # Every 25th host drifts, into one of `drift_groups` shapes.
+        if i % 25 == 0 and variants:
+            snapshot["environment_context"] = variants[(i // 25) % len(variants)]
+        snapshot["timestamp"] = f"2025-06-01T00:00:{i % 60:02d}Z"
+        path = directory / f"host{i:04d}_App_20250601120000.json"
+        store.write(path, snapshot)
+        paths.append(path)
+    golden_path = directory / "golden_App_20250601000000.json"
+    store.write(golden_path, golden)
+    return golden_path, paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--hosts", type=int, default=1000)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--drift-groups", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    directory = Path(tempfile.mkdtemp(prefix="fleet-bench-"))
+    try:
+        start = time.perf_counter()
+        golden_path, paths = build_fleet(directory, args.hosts, args.files, args.drift_groups)
+        print(f"wrote {len(paths)} snapshots x {args.files} files in {time.perf_counter() - start:.1f}s")
+
+        for label, baseline in (("baseline", golden_path), ("majority", None)):
+            start = time.perf_counter()
+            result = compare_fleet(paths, baseline, max_workers=args.workers)
+            elapsed = time.perf_counter() - start
+            print(f"{label:>9}: {elapsed:6.2f}s  drifted={result['drifted']:<4} groups={len(result['groups'])} "
+                  f"keys={len(result['keys'])}")
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
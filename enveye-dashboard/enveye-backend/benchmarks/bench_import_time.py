@@ -0,0 +1,85 @@
+"""
+Benchmark / guard: cold import time of the backend.
+
+Imports the module in fresh interpreters under `python -X importtime`, reports
+the best total and the slowest imports, and exits non-zero if the total is
+over budget or if any heavy optional dependency (vendor SDKs, OCR, SSH/WinRM,
+tokenizer) was imported eagerly instead of on first use.
+
+Usage (from enveye-backend/, with the env the server runs with):
+    python benchmarks/bench_import_time.py
+    python benchmarks/bench_import_time.py --budget-ms 800 --runs 5 --top 25
+"""
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Must only be imported on first use (see ai_provider, ocr_service, connection_pool, token_budget).
+LAZY_MODULES = (
+    "openai",
+    "google.generativeai",
+    "PIL",
+    "pytesseract",
+    "paramiko",
+    "winrm",
+    "tiktoken",
+    "deepdiff",
+)
+
+
+def measure(module):
+    """[(self_us, cumulative_us, depth, name)] for one cold import of `module`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, env=os.environ,
+    )
+    if result.returncode != 0:
+        sys.exit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="enveye_backend")
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    runs = [measure(args.module) for _ in range(args.runs)]
+    totals = [sum(cumulative for _, cumulative, depth, _ in rows if depth == 0) / 1000 for rows in runs]
+    best = min(range(len(runs)), key=totals.__getitem__)
+    rows = runs[best]
+
+    print(f"import {args.module}: best {totals[best]:.0f} ms, runs {', '.join(f'{t:.0f}' for t in totals)} ms")
+    print(f"\n{'cumulative':>12} {'self':>9}  module")
+    for self_us, cumulative_us, depth, name in sorted(rows, key=lambda r: -r[1])[:args.top]:
+        print(f"{cumulative_us / 1000:10.1f}ms {self_us / 1000:7.1f}ms  {'  ' * depth}{name}")
+
+    eager = sorted({name for _, _, _, name in rows for lazy in LAZY_MODULES if name == lazy or name.startswith(lazy + ".")})
+    failures = []
+    if totals[best] > args.budget_ms:
+        failures.append(f"import time {totals[best]:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+    if eager:
+        roots = sorted({lazy for lazy in LAZY_MODULES for name in eager if name == lazy or name.startswith(lazy + ".")})
+        failures.append(f"imported eagerly: {', '.join(roots)}")
+    for failure in failures:
+        print(f"\nFAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print(f"\nOK: within {args.budget_ms:.0f} ms, no eager heavy imports")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark: extract_important_log_blocks, legacy line-by-line version vs log_blocks.
+
+Usage (from enveye-backend/):
+    python benchmarks/bench_log_blocks.py --lines 2000000 --error-every 50 1000
+"""
+import argparse
+import re
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from log_blocks import extract_important_log_blocks
+
+
+def legacy_normalize_log_block(block):
+    clean = re.sub(r'\d{4}-\d{2}-\d{2}[\sT]\d{2}:\d{2}:\d{2}(?:[,\.]\d+)?', '', block)
+    clean = re.sub(r'\d{2}:\d{2}:\d{2}(?:[,\.]\d+)?', '', clean)
+    return clean.strip()
+
+
+def legacy_extract_important_log_blocks(log_text, keywords=None, max_blocks=30):
+    """The implementation that used to live in enveye_backend.py."""
+    keywords = keywords or ['ERROR', 'Exception', 'Traceback', 'CRITICAL', 'Failed', 'Caused by']
+    lines = log_text.splitlines()
+
+    blocks = []
+    current_block = []
+    seen = set()
+
+    def commit_block():
+        if current_block:
+            full_block = "\n".join(current_block).strip()
+            norm = legacy_normalize_log_block(full_block)
+            if norm not in seen:
+                seen.add(norm)
+                blocks.append(full_block)
+            current_block.clear()
+
+    for line in lines:
+        if any(k in line for k in keywords):
+            commit_block()
+            current_block.append(line)
+        elif current_block and (line.startswith(" ") or line.startswith("\t") or line.strip() == ""):
+            current_block.append(line)
+        else:
+            commit_block()
+
+    commit_block()
+    return "\n\n---\n\n".join(blocks[-max_blocks:])
+
+
+def make_log(line_count, error_every):
+    parts = []
+    for i in range(line_count):
+        if i % error_every:
+            parts.append(f"2025-05-07 13:29:{i % 60:02d},123 INFO  [worker-{i % 8}] Request {i} handled\n")
+        else:
+            parts.append(f"2025-05-07 13:29:{i % 60:02d},456 ERROR [worker-{i % 8}] Failed to open db {i % 500}\n"
+                         f"    at App.Storage.Open(String path)\n"
+                         f"    at App.Main()\n")
+    return "".join(parts)
+
+
+def measure(fn, with_memory):
+    if with_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] if with_memory else 0
+    if with_memory:
+        tracemalloc.stop()
+    return elapsed, peak, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=2_000_000)
+    parser.add_argument("--error-every", type=int, nargs="+", default=[50, 1000])
+    args = parser.parse_args()
+
+    for error_every in args.error_every:
+        log_text = make_log(args.lines, error_every)
+        print(f"\n== {len(log_text) / 1e6:.0f} MB, one error block every {error_every} lines ==")
+        for label, fn in (("legacy", legacy_extract_important_log_blocks), ("log_blocks", extract_important_log_blocks)):
+            elapsed, _, result = measure(lambda: fn(log_text), with_memory=False)
+            _, peak, _ = measure(lambda: fn(log_text), with_memory=True)
+            print(f"{label:<12} {elapsed:>8.3f}s  peak {peak / 2**20:>8.1f} MiB  ({len(result)} chars)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark: repeat error-block extraction of a growing log, full re-read vs log_index.
+
+Writes a synthetic log, then appends `--append-mb` of new lines `--rounds`
+times. After each append measures what /read_log (blocks) and /explain used
+to do (read_tail of the last `--max-lines` + extract_important_log_blocks)
+against LogIndex.extract, and checks the index against a full extraction of
+everything from where it started indexing. (The two differ when a block
+recurs: the index dedupes over all it has read, a tail re-read only within
+the current window.)
+
+Usage (from enveye-backend/):
+    python benchmarks/bench_log_index.py
+    python benchmarks/bench_log_index.py --size-mb 2000 --append-mb 1 --initial-tail-lines 0 --dir /data/tmp
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from log_blocks import extract_important_log_blocks
+from log_index import LogIndex
+from log_reader import decode_log, read_tail, tail_offset
+
+LINE_TEMPLATES = [
+    "2025-05-07 13:29:{s:02d},123 INFO  [worker-{w}] Request handled in {n}ms\n",
+    "2025-05-07 13:29:{s:02d},456 ERROR [worker-{w}] Failed to open C:\\App\\data\\{e}.db\n",
+    "    at App.Storage.Open(String path) in Storage.cs:line {e}\n",
+    "2025-05-07 13:29:{s:02d},789 DEBUG [worker-{w}] Cache size {n}\n",
+]
+
+
+def log_chunk(start, size_bytes):
+    """About `size_bytes` of log lines; one error block in ~40 lines, from a pool of 500 distinct ones."""
+    lines, written, i = [], 0, start
+    while written < size_bytes:
+        template = LINE_TEMPLATES[1 + (i % 2)] if i % 40 in (0, 1) else LINE_TEMPLATES[3 * (i % 2)]
+        line = template.format(s=i % 60, w=i % 8, n=i, e=(i // 40) % 500)
+        lines.append(line)
+        written += len(line)
+        i += 1
+    return "".join(lines).encode(), i
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=200)
+    parser.add_argument("--append-mb", type=float, default=0.5)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--max-lines", type=int, default=200_000, help="Tail read_log_file_safely reads")
+    parser.add_argument("--initial-tail-lines", type=int, default=200_000)
+    parser.add_argument("--dir", type=Path, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        path = Path(tmp) / "app.log"
+        line = 0
+        with open(path, "wb") as f:
+            for _ in range(max(1, int(args.size_mb))):
+                chunk, line = log_chunk(line, min(2**20, int(args.size_mb * 2**20)))
+                f.write(chunk)
+        print(f"log: {path.stat().st_size / 2**20:.0f} MiB")
+
+        start = tail_offset(str(path), args.initial_tail_lines) if args.initial_tail_lines else 0
+        index = LogIndex(Path(tmp) / "log_index.sqlite3", initial_tail_lines=args.initial_tail_lines)
+        _, seconds = timed(index.extract, str(path))
+        print(f"first index:       {seconds * 1000:8.1f} ms")
+        _, seconds = timed(index.extract, str(path))
+        print(f"unchanged:         {seconds * 1000:8.1f} ms")
+
+        print(f"{'round':>5} {'full re-read':>13} {'incremental':>12} {'speedup':>8} {'same':>5}")
+        for round_no in range(1, args.rounds + 1):
+            chunk, line = log_chunk(line, int(args.append_mb * 2**20))
+            with open(path, "ab") as f:
+                f.write(chunk)
+            _, full_s = timed(lambda: extract_important_log_blocks(
+                read_tail(str(path), max_lines=args.max_lines), max_blocks=30))
+            got, incremental_s = timed(index.extract, str(path), 30)
+            with open(path, "rb") as f:
+                f.seek(start)
+                expected = extract_important_log_blocks(decode_log(f.read()), max_blocks=30)
+            print(f"{round_no:>5} {full_s * 1000:>11.1f}ms {incremental_s * 1000:>10.1f}ms "
+                  f"{full_s / incremental_s:>7.1f}x {str(got == expected):>5}")
+            assert got == expected, "incremental blocks differ from a full extraction"
+        print(index.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark: tail reading of large logs, readlines() vs log_reader.
+
+Generates a synthetic log of the requested size (reused if it already exists)
+and measures wall time and peak Python memory of each strategy.
+
+Usage (from enveye-backend/):
+    python benchmarks/bench_log_tail.py --size-gb 1
+    python benchmarks/bench_log_tail.py --size-gb 10 --skip-readlines --dir /data/tmp
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from log_reader import read_tail
+
+LINE_TEMPLATES = [
+    "2025-05-07 13:29:{s:02d},123 INFO  [worker-{n}] Request handled in {n}ms\n",
+    "2025-05-07 13:29:{s:02d},456 ERROR [worker-{n}] Failed to open C:\\App\\data\\{n}.db\n",
+    "    at App.Storage.Open(String path) in Storage.cs:line {n}\n",
+]
+
+
+def make_log(path, size_bytes):
+    if path.exists() and path.stat().st_size >= size_bytes:
+        return
+    print(f"Generating {size_bytes / 1e9:.1f} GB log at {path} ...")
+    chunk = "".join(LINE_TEMPLATES[i % 3].format(s=i % 60, n=i) for i in range(20000)).encode()
+    written = 0
+    with open(path, "wb") as f:
+        while written < size_bytes:
+            f.write(chunk)
+            written += len(chunk)
+
+
+def read_with_readlines(path, max_lines):
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        lines = f.readlines()
+        return ''.join(lines[-max_lines:])
+
+
+def measure(label, fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<22} {elapsed:>9.3f}s  peak {peak / 2**20:>9.1f} MiB  ({len(result)} chars)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-gb", type=float, nargs="+", default=[1.0])
+    parser.add_argument("--max-lines", type=int, default=200000)
+    parser.add_argument("--dir", default=tempfile.gettempdir())
+    parser.add_argument("--skip-readlines", action="store_true", help="Don't run the old readlines() path")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated log files")
+    args = parser.parse_args()
+
+    for size_gb in args.size_gb:
+        path = Path(args.dir) / f"enveye_bench_{size_gb:g}gb.log"
+        make_log(path, int(size_gb * 1e9))
+        print(f"\n== {size_gb:g} GB, last {args.max_lines} lines ==")
+        if not args.skip_readlines:
+            measure("readlines()", lambda: read_with_readlines(path, args.max_lines))
+        measure("read_tail", lambda: read_tail(path, max_lines=args.max_lines))
+        measure("read_tail (mmap)", lambda: read_tail(path, max_lines=args.max_lines, use_mmap=True))
+        if not args.keep:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark: OCR throughput and latency for error screenshots.
+
+Renders synthetic HiDPI screenshots (an error dialog on a flat desktop), then
+measures
+- preprocessing time and how many pixels reach tesseract,
+- per-image latency of plain pytesseract on the original vs ocr_image_bytes,
+- OCRService throughput and p50/p95 latency at a given concurrency,
+- latency of a repeated (cached) screenshot.
+The tesseract measurements are skipped if tesseract isn't installed.
+
+Usage (from enveye-backend/):
+    python benchmarks/bench_ocr.py
+    python benchmarks/bench_ocr.py --images 32 --concurrency 8 --workers 4 --scale 3
+"""
+import argparse
+import asyncio
+import io
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from PIL import Image, ImageDraw, ImageFont
+
+from ocr_service import DEFAULT_OPTIONS, OCRService, ocr_image_bytes, preprocess
+
+MESSAGES = [
+    "Unhandled exception: System.IO.FileNotFoundException",
+    "Could not load file or assembly 'App.Storage, Version=2.1.0.0'",
+    "The system cannot find the file specified.",
+    "at App.Storage.Open(String path) in Storage.cs:line {n}",
+    "Service 'AppWorker' failed to start (error 1053).",
+]
+
+
+def make_screenshot(n, scale):
+    """A 1440x900 logical desktop at `scale`x with an error dialog; PNG bytes tagged with its DPI."""
+    width, height = 1440 * scale, 900 * scale
+    image = Image.new("RGB", (width, height), (32, 96, 160))
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=14 * scale)
+    except TypeError:  # Pillow < 10.1
+        font = ImageFont.load_default()
+    left, top = 360 * scale, 300 * scale
+    draw.rectangle((left, top, left + 720 * scale, top + 220 * scale), fill=(240, 240, 240))
+    for i, line in enumerate(MESSAGES):
+        draw.text((left + 20 * scale, top + (20 + 36 * i) * scale), line.format(n=n), fill=(0, 0, 0), font=font)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", dpi=(96 * scale, 96 * scale))
+    return buffer.getvalue()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+async def run_service(images, concurrency, workers):
+    service = OCRService(max_workers=workers, max_queue=len(images))
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(data):
+        async with semaphore:
+            started = time.perf_counter()
+            await service.extract_text(data)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(data) for data in images))
+    elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    await service.extract_text(images[0])
+    cached = time.perf_counter() - started
+    service.shutdown()
+    return elapsed, latencies, cached
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=16)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--scale", type=int, default=2, help="HiDPI factor of the synthetic screenshots")
+    args = parser.parse_args()
+
+    images = [make_screenshot(n, args.scale) for n in range(args.images)]
+    with Image.open(io.BytesIO(images[0])) as original:
+        original.load()
+        started = time.perf_counter()
+        prepared, dpi = preprocess(original, DEFAULT_OPTIONS)
+        prep_ms = (time.perf_counter() - started) * 1000
+        print(f"screenshot {original.width}x{original.height} @ {original.info['dpi'][0]:.0f} dpi -> "
+              f"{prepared.width}x{prepared.height} @ {dpi} dpi "
+              f"({original.width * original.height / (prepared.width * prepared.height):.0f}x fewer pixels), "
+              f"preprocess {prep_ms:.1f} ms")
+
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+    except Exception as e:
+        print(f"tesseract not available ({e}); skipping OCR timings")
+        return
+
+    with Image.open(io.BytesIO(images[0])) as original:
+        started = time.perf_counter()
+        pytesseract.image_to_string(original)
+        raw = time.perf_counter() - started
+    started = time.perf_counter()
+    text = ocr_image_bytes(images[0])
+    pre = time.perf_counter() - started
+    print(f"single image: original {raw * 1000:.0f} ms, preprocessed {pre * 1000:.0f} ms  ({text[:60]!r}...)")
+
+    elapsed, latencies, cached = asyncio.run(run_service(images, args.concurrency, args.workers))
+    print(f"service: {len(images)} images in {elapsed:.2f}s ({len(images) / elapsed:.1f}/s) at concurrency "
+          f"{args.concurrency}; p50 {statistics.median(latencies) * 1000:.0f} ms, "
+          f"p95 {percentile(latencies, 95) * 1000:.0f} ms; cached repeat {cached * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
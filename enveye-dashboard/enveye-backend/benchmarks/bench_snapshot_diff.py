@@ -0,0 +1,94 @@
+"""
+Benchmark: snapshot_diff vs DeepDiff on synthetic snapshots.
+
+Usage (from enveye-backend/):
+    python benchmarks/bench_snapshot_diff.py
+    python benchmarks/bench_snapshot_diff.py --sizes 10000 100000 1000000 --deepdiff-max 100000
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from snapshot_diff import diff_environment_context
+
+
+def make_context(file_count, seed=0):
+    rnd = random.Random(seed)
+    files = {}
+    for i in range(file_count):
+        path = f"Application\\{i % 97}\\module_{i}.dll"
+        files[path] = {
+            "modified": f"2025-05-01T{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}:00-04:00",
+            "sha256": hashlib.sha256(str(i).encode()).hexdigest(),
+            "size_bytes": rnd.randint(1, 10_000_000),
+        }
+    return {
+        "app_folder_files": files,
+        "critical_environment_variables": {"APP_ENV": "prod", "ENVIRONMENT": "Not Set"},
+        "os_info": {"architecture": "amd64", "name": "windows"},
+        "required_services_status": {"W3SVC": "Running", "WinRM": "Running", "MongoDB": "Running"},
+    }
+
+
+def mutate_context(context, change_ratio=0.01, seed=1):
+    """Copy a context and change/add/remove roughly `change_ratio` of its files."""
+    rnd = random.Random(seed)
+    mutated = json.loads(json.dumps(context))
+    files = mutated["app_folder_files"]
+    paths = list(files)
+    touched = max(1, int(len(paths) * change_ratio))
+    for path in rnd.sample(paths, touched):
+        roll = rnd.random()
+        if roll < 0.6:
+            files[path]["sha256"] = hashlib.sha256(path.encode()).hexdigest()
+            files[path]["size_bytes"] += 1
+        elif roll < 0.8:
+            del files[path]
+        else:
+            files[path + ".new"] = dict(files[path])
+    mutated["required_services_status"]["MongoDB"] = "Stopped"
+    return mutated
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def run_deepdiff(left, right):
+    from deepdiff import DeepDiff
+    return json.loads(DeepDiff(left, right, view='tree').to_json())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--deepdiff-max", type=int, default=100_000,
+                        help="Skip DeepDiff above this many files (it takes minutes at 1M)")
+    parser.add_argument("--change-ratio", type=float, default=0.01)
+    args = parser.parse_args()
+
+    print(f"{'files':>10} {'snapshot_diff':>14} {'deepdiff':>10} {'speedup':>8} {'changes':>8} {'same':>5}")
+    for size in args.sizes:
+        left = make_context(size)
+        right = mutate_context(left, args.change_ratio)
+
+        ours_s, ours = timed(lambda: diff_environment_context(left, right))
+        changes = sum(len(entries) for entries in ours.values())
+
+        if size <= args.deepdiff_max:
+            theirs_s, theirs = timed(lambda: run_deepdiff(left, right))
+            print(f"{size:>10} {ours_s:>13.3f}s {theirs_s:>9.3f}s {theirs_s / ours_s:>7.1f}x {changes:>8} {str(ours == theirs):>5}")
+        else:
+            print(f"{size:>10} {ours_s:>13.3f}s {'skipped':>10} {'-':>8} {changes:>8} {'-':>5}")
+
+
+if __name__ == "__main__":
+    main()
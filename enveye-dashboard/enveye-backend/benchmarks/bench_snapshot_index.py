@@ -0,0 +1,134 @@
+"""
+Benchmark: inverted index build and query latency over a large fleet.
+
+Writes `--variants` distinct synthetic snapshots into a temporary sectioned
+store, then `--snapshots` manifests of hosts running one of them (as a fleet
+of mostly identical hosts looks), catalogs them and measures
+- a parallel rebuild of the index from scratch,
+- indexing one more snapshot incrementally,
+- query latency (median of `--repeat`) for a file by name and sha256, a
+  service state and an environment variable value,
+and checks the answers against the fleet that was generated.
+
+Usage (from enveye-backend/):
+    python benchmarks/bench_snapshot_index.py
+    python benchmarks/bench_snapshot_index.py --snapshots 20000 --variants 50 --files 2000 --workers 4
+"""
+import argparse
+import json
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from bench_snapshot_diff import make_context
+from snapshot_catalog import SnapshotCatalog
+from snapshot_index import SnapshotIndex, term_query
+from snapshot_store import SectionStore, _dumps, read_manifest
+
+SERVICE = "W3SVC"
+
+
+def make_variant(base_context, n, rnd):
+    context = json.loads(json.dumps(base_context))
+    files = context["app_folder_files"]
+    for path in rnd.sample(sorted(files), 5):
+        files[path] = {**files[path], "sha256": f"{n:064x}"}
+    context["required_services_status"][SERVICE] = "Stopped" if n % 10 == 0 else "Running"
+    context["critical_environment_variables"]["APP_ENV"] = "staging" if n % 5 == 0 else "prod"
+    return {"application_name": "App", "timestamp": "2025-05-01T00:00:00Z", "environment_context": context}
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def median_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        result, elapsed = timed(fn)
+        times.append(elapsed)
+    return result, statistics.median(times) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--snapshots", type=int, default=5000)
+    parser.add_argument("--variants", type=int, default=20)
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rnd = random.Random(0)
+    tmp = Path(tempfile.mkdtemp(prefix="enveye-index-"))
+    try:
+        snapshot_dir = tmp / "snapshots"
+        snapshot_dir.mkdir()
+        store = SectionStore(snapshot_dir, codec="gzip")
+        base = make_context(args.files)
+        variants = [make_variant(base, n, rnd) for n in range(args.variants)]
+        manifests = []
+        for n, variant in enumerate(variants):
+            path = snapshot_dir / f"variant-{n}.json"
+            store.write(path, variant)
+            manifests.append(read_manifest(path))
+            path.unlink()
+
+        catalog = SnapshotCatalog(tmp / "catalog.sqlite3", snapshot_dir)
+        start = time.perf_counter()
+        assignment = {}
+        for i in range(args.snapshots):
+            name = f"host{i:05d}_App_20250501T{i % 240000:06d}.json"
+            assignment[name] = i % args.variants
+            (snapshot_dir / name).write_bytes(_dumps(manifests[assignment[name]]))
+            catalog.record(snapshot_dir / name, variants[assignment[name]])
+        print(f"{args.snapshots} snapshots of {args.files} files ({args.variants} distinct) "
+              f"written and catalogued in {time.perf_counter() - start:.1f}s")
+
+        index = SnapshotIndex(catalog)
+        result, elapsed = timed(index.rebuild, full=True, max_workers=args.workers)
+        print(f"rebuild: {elapsed:.2f}s {result}")
+        print(f"index size: {index.stats()}")
+
+        extra = snapshot_dir / "hostnew_App_20250502T000000.json"
+        extra.write_bytes(_dumps(manifests[0]))
+        catalog.record(extra, variants[0])
+        result, elapsed = timed(index.record, extra.name)
+        print(f"incremental record of a known build: {elapsed * 1000:.1f} ms {result}")
+        assignment[extra.name] = 0
+
+        marker = f"{3 % args.variants:064x}"  # the hash make_variant() gave a few files of variant 3
+        changed_path = next(p for p, e in variants[3 % args.variants]["environment_context"]["app_folder_files"].items()
+                            if e["sha256"] == marker)
+        file_name = changed_path.rsplit("\\", 1)[-1]
+        queries = {
+            "file name": term_query(file=file_name),
+            "file + sha256": term_query(file=file_name, sha256=marker),
+            "service stopped": term_query(service=SERVICE.lower(), status="Stopped"),
+            "variable value": term_query(variable="APP_ENV", value="staging"),
+        }
+        expected = {
+            "file name": len(assignment),
+            "file + sha256": sum(1 for v in assignment.values() if v == 3 % args.variants),
+            "service stopped": sum(1 for v in assignment.values() if v % 10 == 0),
+            "variable value": sum(1 for v in assignment.values() if v % 5 == 0),
+        }
+        for label, query in queries.items():
+            page, ms = median_ms(lambda: index.search(**query, limit=100), args.repeat)
+            check = expected.get(label)
+            status = "" if check is None else ("ok" if page["total"] == check else f"MISMATCH (expected {check})")
+            print(f"query {label:<16} {ms:7.2f} ms  total {page['total']:>6}  {status}")
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    main()
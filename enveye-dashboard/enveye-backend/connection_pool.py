@@ -0,0 +1,213 @@
+"""
+Keyed pool of SSH / WinRM connections for remote collection.
+
+Connections are keyed on (transport, host, port, user, credential fingerprint),
+so repeated and scheduled collections against the same host skip the SSH
+handshake / NTLM setup. Idle connections are evicted after `idle_timeout`,
+checked for health before reuse (SSH: a keepalive on the transport; WinRM: a
+trivial `echo` command), and the number of idle connections is capped at
+`max_size`. `connect_timeout` bounds opening a connection (and every WinRM
+request, the health probe included). A connection is used by one collection at a time.
+
+Connection factories can be swapped per transport (e.g. to point at a local
+sshd or an in-process paramiko server).
+
+paramiko and pywinrm are imported when the first connection of their kind
+is opened (or by load_transports()).
+"""
+import hashlib
+import threading
+import time
+from contextlib import contextmanager
+
+
+def load_transports():
+    """Import the SSH and WinRM client libraries up front (startup warm-up)."""
+    import paramiko
+    import winrm
+    return paramiko, winrm
+
+
+class SSHConnection:
+    def __init__(self, host, port, username, password, connect_timeout=15):
+        import paramiko
+
+        self.client = paramiko.SSHClient()
+        self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.client.connect(host, port=port, username=username, password=password,
+                            look_for_keys=False, allow_agent=False, timeout=connect_timeout,
+                            banner_timeout=connect_timeout, auth_timeout=connect_timeout)
+        self._sftp = None
+
+    def sftp(self):
+        """SFTP channel, opened once and reused for the life of the connection."""
+        if self._sftp is None:
+            self._sftp = self.client.open_sftp()
+        return self._sftp
+
+    def is_healthy(self):
+        transport = self.client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            transport.send_ignore()
+            return True
+        except Exception:
+            return False
+
+    def close(self):
+        try:
+            if self._sftp is not None:
+                self._sftp.close()
+        finally:
+            self.client.close()
+
+
+class WinRMConnection:
+    def __init__(self, host, port, username, password, connect_timeout=15):
+        # The underlying requests session keeps the NTLM-authenticated
+        # HTTP connection alive between run_ps calls. WinRM has no separate
+        # connect step, so the timeout bounds each request; long-running
+        # commands are unaffected (output is polled every operation timeout).
+        import winrm
+
+        self.session = winrm.Session(
+            f'http://{host}:{port}/wsman',
+            auth=(username, password),
+            transport='ntlm',
+            operation_timeout_sec=connect_timeout,
+            read_timeout_sec=connect_timeout + 10,
+        )
+
+    def is_healthy(self):
+        try:
+            return self.session.run_cmd("echo", ["ok"]).status_code == 0
+        except Exception:
+            return False
+
+    def close(self):
+        pass
+
+
+DEFAULT_FACTORIES = {"ssh": SSHConnection, "winrm": WinRMConnection}
+DEFAULT_PORTS = {"ssh": 22, "winrm": 5985}
+
+
+def _credential_fingerprint(password):
+    # Never reuse a connection for a caller that didn't present the same password.
+    return hashlib.sha256((password or "").encode("utf-8")).hexdigest()
+
+
+class ConnectionPool:
+    def __init__(self, max_size=32, idle_timeout=300, connect_timeout=15, ports=None, factories=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.ports = {**DEFAULT_PORTS, **(ports or {})}
+        self.factories = {**DEFAULT_FACTORIES, **(factories or {})}
+        self._idle = {}  # key -> list of (connection, last_used)
+        self._lock = threading.Lock()
+        self.stats = {"created": 0, "reused": 0, "evicted": 0, "unhealthy": 0}
+
+    def _key(self, transport, host, username, password):
+        return (transport, host, self.ports[transport], username, _credential_fingerprint(password))
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception as e:
+            print(f"⚠️ Error closing pooled connection: {e}")
+
+    def evict_idle(self):
+        """Close connections idle for longer than `idle_timeout`."""
+        cutoff = time.time() - self.idle_timeout
+        expired = []
+        with self._lock:
+            for key, entries in list(self._idle.items()):
+                keep = [(c, t) for c, t in entries if t >= cutoff]
+                expired.extend(c for c, t in entries if t < cutoff)
+                if keep:
+                    self._idle[key] = keep
+                else:
+                    del self._idle[key]
+            self.stats["evicted"] += len(expired)
+        for connection in expired:
+            self._close(connection)
+
+    def _checkout(self, key):
+        while True:
+            with self._lock:
+                entries = self._idle.get(key)
+                if not entries:
+                    return None
+                connection, _ = entries.pop()
+                if not entries:
+                    del self._idle[key]
+            if connection.is_healthy():
+                self.stats["reused"] += 1
+                return connection
+            self.stats["unhealthy"] += 1
+            self._close(connection)
+
+    def _checkin(self, key, connection):
+        overflow = []
+        with self._lock:
+            self._idle.setdefault(key, []).append((connection, time.time()))
+            idle = sorted(
+                ((t, k, c) for k, entries in self._idle.items() for c, t in entries),
+                key=lambda item: item[0],
+            )
+            while len(idle) > self.max_size:
+                _, old_key, old_connection = idle.pop(0)
+                self._idle[old_key] = [(c, t) for c, t in self._idle[old_key] if c is not old_connection]
+                if not self._idle[old_key]:
+                    del self._idle[old_key]
+                overflow.append(old_connection)
+            self.stats["evicted"] += len(overflow)
+        for old_connection in overflow:
+            self._close(old_connection)
+
+    @contextmanager
+    def connection(self, transport, host, username, password, keep_on=()):
+        """
+        Borrow a connection. It goes back to the pool when the block exits
+        normally or raises one of `keep_on` (errors that leave the connection
+        usable, e.g. the remote command failing), and is closed if the block
+        raises anything else.
+        """
+        self.evict_idle()
+        key = self._key(transport, host, username, password)
+        connection = self._checkout(key)
+        if connection is None:
+            connection = self.factories[transport](host, self.ports[transport], username, password,
+                                                   connect_timeout=self.connect_timeout)
+            self.stats["created"] += 1
+        try:
+            yield connection
+        except keep_on:
+            self._checkin(key, connection)
+            raise
+        except BaseException:
+            self._close(connection)
+            raise
+        else:
+            self._checkin(key, connection)
+
+    def ssh(self, host, username, password, keep_on=()):
+        return self.connection("ssh", host, username, password, keep_on)
+
+    def winrm(self, host, username, password, keep_on=()):
+        return self.connection("winrm", host, username, password, keep_on)
+
+    def close_all(self):
+        with self._lock:
+            connections = [c for entries in self._idle.values() for c, _ in entries]
+            self._idle.clear()
+        for connection in connections:
+            self._close(connection)
+
+    def snapshot_stats(self):
+        with self._lock:
+            idle = sum(len(entries) for entries in self._idle.values())
+        return {**self.stats, "idle": idle, "max_size": self.max_size, "idle_timeout": self.idle_timeout,
+                "connect_timeout": self.connect_timeout}
@@ -0,0 +1,156 @@
+"""
+Incremental prompt context for diagnosis follow-ups.
+
+A follow-up prompt is the system message, the session's initial prompt, a
+summary of its older turns and the most recent turns verbatim:
+
+- The initial prompt (the packed diff, error, OCR text and logs) is rendered
+  once per payload and budget and kept in an LRU, instead of re-packing and
+  re-serializing the diff on every follow-up. It gets a fixed share of the
+  context budget.
+- At most `window_turns` recent turns are replayed verbatim, newest first,
+  within what the budget has left.
+- Turns that have fallen out of the window are kept verbatim (if they fit)
+  until they add up to `summarize_after_tokens`; then a background task folds
+  them, with the previous summary, into a new summary of at most
+  `summary_tokens`, stored on the session. The follow-up that crossed the
+  threshold doesn't wait for it.
+
+So the work and the prompt size per follow-up are bounded by the window and
+the threshold, however long the session gets.
+"""
+import asyncio
+
+from snapshot_cache import LRUCache
+from token_budget import count_tokens, truncate_to_budget
+
+SYSTEM_PROMPT = "You are a highly skilled IT troubleshooting assistant helping diagnose configuration issues across systems."
+SUMMARY_PROMPT = (
+    "Summarize this troubleshooting conversation for your own later reference. Keep every finding, "
+    "hypothesis ruled in or out, command or check suggested and its result, and open question. "
+    "Be concise; do not add anything new."
+)
+
+
+def turn_messages(turn):
+    ai_msg, user_msg = turn
+    return [{"role": "assistant", "content": ai_msg["content"]}, {"role": "user", "content": user_msg["content"]}]
+
+
+def turn_tokens(turn):
+    return sum(count_tokens(m["content"]) for m in turn_messages(turn))
+
+
+def session_turns(session):
+    """(assistant reply, user follow-up) pairs, oldest first."""
+    return list(zip(session.ai_messages, session.user_followups))
+
+
+class ConversationContext:
+    """
+    Builds follow-up prompts for sessions in `store`. `render_initial(payload,
+    budget)` renders the initial prompt; `send(messages)` is the async AI call
+    used for summaries.
+    """
+
+    def __init__(self, store, render_initial, send, budget, window_turns=6, initial_share=0.5,
+                 summarize_after_tokens=1500, summary_tokens=400, cache_entries=128):
+        self.store = store
+        self.render_initial = render_initial
+        self.send = send
+        self.budget = budget
+        self.window_turns = window_turns
+        self.initial_budget = int(budget * initial_share)
+        self.summarize_after_tokens = summarize_after_tokens
+        self.summary_tokens = summary_tokens
+        self.initial_prompts = LRUCache(cache_entries)
+        self._summarizing = {}  # session_id -> task (keeps a reference until it's done)
+        self.metrics = {"summaries": 0, "summary_errors": 0, "dropped_turns": 0}
+
+    def initial_prompt(self, session):
+        """(rendered initial prompt, its token count), rendered once per payload."""
+        key = (session.payload_key, self.initial_budget)
+        cached = self.initial_prompts.get(key) if session.payload_key else None
+        if cached is None:
+            prompt = self.render_initial(session.initial_input, self.initial_budget)
+            cached = (prompt, count_tokens(prompt))
+            if session.payload_key:
+                self.initial_prompts.put(key, cached)
+        return cached
+
+    def _split(self, session):
+        """(window turns, pending turns) among the turns the summary doesn't cover."""
+        turns = session_turns(session)[session.summarized_turns:]
+        window = turns[-self.window_turns:] if self.window_turns > 0 else turns[-1:]
+        return window, turns[:len(turns) - len(window)]
+
+    def build(self, session):
+        """Prompt messages for the session's latest follow-up."""
+        initial, initial_tokens = self.initial_prompt(session)
+        remaining = self.budget - initial_tokens - count_tokens(SYSTEM_PROMPT) - count_tokens(session.summary)
+        window, pending = self._split(session)
+
+        # Newest turns first; the latest one is always sent.
+        history = []
+        for turn in reversed(window + pending):
+            tokens = turn_tokens(turn)
+            if history and tokens > remaining:
+                self.metrics["dropped_turns"] += 1
+                break
+            history.append(turn)
+            remaining -= tokens
+        history.reverse()
+
+        messages = [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": initial}]
+        if session.summary:
+            messages.append({"role": "user", "content": f"Summary of the conversation so far:\n{session.summary}"})
+        for turn in history:
+            messages.extend(turn_messages(turn))
+        return messages
+
+    def needs_summary(self, session):
+        _, pending = self._split(session)
+        return bool(pending) and sum(turn_tokens(t) for t in pending) >= self.summarize_after_tokens
+
+    async def summarize(self, session):
+        """Fold the pending turns into the session's summary."""
+        _, pending = self._split(session)
+        if not pending:
+            return
+        transcript = "\n\n".join(f"{m['role']}: {m['content']}" for t in pending for m in turn_messages(t))
+        previous = f"Earlier summary:\n{session.summary}\n\n" if session.summary else ""
+        summary = await self.send([
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": f"{previous}Conversation:\n{transcript}"},
+        ])
+        summary = truncate_to_budget(summary.strip(), self.summary_tokens)
+        await asyncio.to_thread(self.store.set_summary, session, summary, session.summarized_turns + len(pending))
+        self.metrics["summaries"] += 1
+
+    async def _summarize_in_background(self, session):
+        try:
+            await self.summarize(session)
+        except Exception as e:
+            self.metrics["summary_errors"] += 1
+            print(f"⚠️ Summarizing session {session.session_id} failed: {e}")
+        finally:
+            self._summarizing.pop(session.session_id, None)
+
+    def schedule_summary(self, session):
+        """Start summarizing in the background if the pending turns crossed the threshold."""
+        if session.session_id in self._summarizing or not self.needs_summary(session):
+            return False
+        self._summarizing[session.session_id] = asyncio.get_running_loop().create_task(
+            self._summarize_in_background(session)
+        )
+        return True
+
+    def stats(self):
+        return {
+            **self.metrics,
+            "summarizing": len(self._summarizing),
+            "initial_prompts": self.initial_prompts.stats(),
+            "budget": self.budget,
+            "initial_budget": self.initial_budget,
+            "window_turns": self.window_turns,
+        }
@@ -0,0 +1,390 @@
+"""
+Noise-aware digest of a snapshot diff for the AI diagnosis prompt.
+
+A raw diff between two hosts is mostly noise for a diagnosis: thousands of
+files whose `modified` timestamp moved and nothing else. The digest sits
+between compare and prompt:
+
+- Ignore rules drop changes by field (`modified` by default), by key glob
+  (as diff_pages.DiffFilter's exclude) and by regex on the DeepDiff path.
+  What was dropped is counted, not silently lost.
+- What is left is grouped per item (a file's sha256 and size changes are one
+  line) and ranked by severity: service status flips, environment variable
+  changes, binary (DLL / EXE) hash changes, other configuration, other files.
+- Within the file tiers, `collapse_threshold` or more changes under one
+  directory become one line, e.g.
+  "412 files under Application\\136.0.3240.50\\ changed (400 changed, 12 added)".
+- render(budget) emits the lines most severe first until the token budget is
+  spent, so a diff of any size yields a bounded, ranked prompt section.
+
+    digest = digest_report(payload["diff"], DigestRules.from_config(CONFIG.get("diff_digest")))
+    text, omitted = digest.render(budget)
+"""
+import ast
+import json
+import re
+from collections import Counter, defaultdict
+
+from diff_pages import DiffFilter
+from snapshot_diff import FILES_SECTION, REPORT_TYPES
+from token_budget import count_tokens
+
+SERVICES_SECTION = "required_services_status"
+ENV_SECTION = "critical_environment_variables"
+
+# Severity tiers in rank order; lower tiers go into the prompt first.
+TIERS = (
+    "Service status changes",
+    "Environment variable changes",
+    "Binary hash changes",
+    "Configuration changes",
+    "File changes",
+)
+SERVICE_TIER, ENV_TIER, BINARY_TIER, CONFIG_TIER, FILE_TIER = range(len(TIERS))
+
+DEFAULT_IGNORE_FIELDS = ("modified",)
+DEFAULT_BINARY_EXTENSIONS = (".dll", ".exe", ".sys")
+DEFAULT_COLLAPSE_THRESHOLD = 20
+MAX_VALUE_CHARS = 160
+COLLAPSE_EXAMPLES = 3
+
+KIND_BY_REPORT_TYPE = {
+    "dictionary_item_added": "added",
+    "dictionary_item_removed": "removed",
+    "values_changed": "changed",
+    "type_changes": "changed",
+}
+
+_PATH_ELEMENT_RE = re.compile(r"\[(\d+)\]|\['|\[\"")
+_SEPARATOR_RE = re.compile(r"[\\/]")
+
+
+def parse_path(path):
+    """
+    The keys of a DeepDiff path as rendered by snapshot_diff.format_key,
+    e.g. "root['app_folder_files']['bin\\app.dll']['sha256']" ->
+    ["app_folder_files", "bin\\app.dll", "sha256"].
+    """
+    keys = []
+    position = len("root")
+    while position < len(path):
+        match = _PATH_ELEMENT_RE.match(path, position)
+        if match is None:
+            raise ValueError(f"Not a diff path: {path!r}")
+        if match.group(1) is not None:
+            keys.append(int(match.group(1)))
+            position = match.end()
+            continue
+        quote = path[match.end() - 1]
+        # Keys are not escaped; one ends at the quote that closes its element.
+        # A key with both quote kinds is rendered as its repr(), which can
+        # contain "\\']": the end is then the first candidate that parses.
+        end = match.end()
+        while True:
+            end = path.find(quote + "]", end)
+            if end == -1:
+                raise ValueError(f"Not a diff path: {path!r}")
+            if end + 2 == len(path) or path[end + 2] == "[":
+                key = path[match.end():end]
+                if quote != "'" or "'" not in key:
+                    break
+                try:
+                    key = ast.literal_eval(quote + key + quote)
+                    break
+                except (SyntaxError, ValueError):
+                    pass
+            end += 1
+        keys.append(key)
+        position = end + 2
+    return keys
+
+
+def report_changes(report):
+    """A DeepDiff-style report as (report_type, section, key, path, value) changes, like iter_changes()."""
+    for report_type in REPORT_TYPES:
+        for path, value in (report.get(report_type) or {}).items():
+            keys = parse_path(path)
+            section = keys[0] if keys else None
+            yield (report_type, section, keys[1] if len(keys) > 1 else None, path, value)
+
+
+class DigestRules:
+    """
+    Which changes the digest drops and how it groups the rest.
+
+    Args:
+        ignore_fields (iterable): Leaf field names whose changes are noise
+            (e.g. "modified"); matched against the last key of the path.
+        ignore_paths (iterable): Globs on the item key (file path, service,
+            variable), case-insensitive, / and \\ alike.
+        ignore_patterns (iterable): Regexes searched in the full DeepDiff path.
+        binary_extensions (iterable): File extensions ranked as binaries.
+        collapse_threshold (int): Changes under one directory that are
+            collapsed into one line; 0 never collapses.
+    """
+
+    def __init__(self, ignore_fields=DEFAULT_IGNORE_FIELDS, ignore_paths=(), ignore_patterns=(),
+                 binary_extensions=DEFAULT_BINARY_EXTENSIONS, collapse_threshold=DEFAULT_COLLAPSE_THRESHOLD):
+        self.ignore_fields = frozenset(ignore_fields or ())
+        self.path_filter = DiffFilter(exclude=list(ignore_paths)) if ignore_paths else None
+        self.ignore_patterns = [re.compile(pattern) for pattern in ignore_patterns or ()]
+        self.binary_extensions = tuple(ext.casefold() for ext in binary_extensions or ())
+        self.collapse_threshold = collapse_threshold
+
+    @classmethod
+    def from_config(cls, config):
+        """Rules from the "diff_digest" config section (missing keys use the defaults)."""
+        config = config or {}
+        return cls(
+            ignore_fields=config.get("ignore_fields", DEFAULT_IGNORE_FIELDS),
+            ignore_paths=config.get("ignore_paths", ()),
+            ignore_patterns=config.get("ignore_patterns", ()),
+            binary_extensions=config.get("binary_extensions", DEFAULT_BINARY_EXTENSIONS),
+            collapse_threshold=config.get("collapse_threshold", DEFAULT_COLLAPSE_THRESHOLD),
+        )
+
+    def ignored_by(self, change, keys):
+        """Name of the rule that drops `change`, or None to keep it."""
+        if change[0] in ("values_changed", "type_changes") and len(keys) > 2 and keys[-1] in self.ignore_fields:
+            return "field"
+        if self.path_filter is not None and not self.path_filter(change):
+            return "path"
+        if any(pattern.search(change[3]) for pattern in self.ignore_patterns):
+            return "pattern"
+        return None
+
+    def is_binary(self, file_path):
+        return str(file_path).casefold().endswith(self.binary_extensions)
+
+
+def _short(value):
+    text = json.dumps(value, ensure_ascii=False, default=str)
+    return text if len(text) <= MAX_VALUE_CHARS else text[:MAX_VALUE_CHARS - 3] + "..."
+
+
+class DigestItem:
+    """The changes of one item (a file, a service, a variable, a whole section)."""
+
+    __slots__ = ("section", "key", "kind", "fields", "order")
+
+    def __init__(self, section, key, order):
+        self.section = section
+        self.key = key
+        self.kind = None
+        self.fields = []  # (subpath, report_type, value)
+        self.order = order
+
+    def add(self, report_type, subpath, value):
+        kind = KIND_BY_REPORT_TYPE[report_type]
+        # Adding or removing a field of an existing item is a change of the item.
+        self.kind = kind if self.kind is None and not subpath else "changed"
+        self.fields.append((subpath, report_type, value))
+
+    def tier(self, rules):
+        if self.section == SERVICES_SECTION:
+            return SERVICE_TIER
+        if self.section == ENV_SECTION:
+            return ENV_TIER
+        if self.section != FILES_SECTION or self.key is None:
+            return CONFIG_TIER
+        if rules.is_binary(self.key) and (self.kind != "changed" or any(f[0] == ["sha256"] for f in self.fields)):
+            return BINARY_TIER
+        return FILE_TIER
+
+    def render(self):
+        if self.key is None:
+            name = self.section
+        elif self.section in (SERVICES_SECTION, ENV_SECTION, FILES_SECTION):
+            name = str(self.key)
+        else:
+            name = f"{self.section}.{self.key}"
+        if self.section == FILES_SECTION and self.key is not None:
+            return f"- {name}: {self._render_file()}"
+        parts = []
+        for subpath, report_type, value in self.fields:
+            prefix = "".join(f".{key}" for key in subpath)
+            parts.append(prefix.lstrip(".") + (": " if prefix else "") + self._render_value(report_type, value))
+        return f"- {name}: " + "; ".join(parts)
+
+    def _render_file(self):
+        if self.kind != "changed":
+            value = self.fields[0][2]
+            size = value.get("size_bytes") if isinstance(value, dict) else None
+            return self.kind + (f" ({size} bytes)" if size is not None else "")
+        details = []
+        for subpath, report_type, value in self.fields:
+            field = ".".join(str(key) for key in subpath) or "entry"
+            if field == "sha256" and report_type == "values_changed":
+                details.append("sha256 changed")
+            else:
+                details.append(f"{field} {self._render_value(report_type, value)}")
+        return ", ".join(details)
+
+    @staticmethod
+    def _render_value(report_type, value):
+        if report_type == "dictionary_item_added":
+            return f"added {_short(value)}"
+        if report_type == "dictionary_item_removed":
+            return f"removed (was {_short(value)})"
+        if not (isinstance(value, dict) and "old_value" in value and "new_value" in value):
+            return _short(value)
+        return f"{_short(value['old_value'])} -> {_short(value['new_value'])}"
+
+
+def _directory(file_path):
+    return tuple(_SEPARATOR_RE.split(str(file_path))[:-1])
+
+
+def _render_directory(parts, example):
+    separator = "\\" if "\\" in str(example) else "/"
+    return separator.join(parts) + separator
+
+
+def collapse_by_directory(items, threshold):
+    """
+    Split file items into ([(directory line, item count, first order)], items
+    kept as they are). Directories are visited deepest first: one with
+    `threshold` or more not-yet-collapsed items under it becomes one line, and
+    one with two or more collapsed subdirectories becomes one line for all of
+    them (so a replaced version folder is one line, not one per subfolder).
+    """
+    if not threshold or len(items) < threshold:
+        return [], items
+    pending = defaultdict(list)
+    for item in items:
+        pending[_directory(item.key)].append(item)
+    directories = {directory[:depth] for directory in pending for depth in range(len(directory) + 1)}
+
+    collapsed = defaultdict(list)
+    for directory in sorted(directories, key=len, reverse=True):
+        members = pending.pop(directory, [])
+        groups = collapsed.pop(directory, [])
+        if not directory:
+            pending[directory], collapsed[directory] = members, groups
+            continue
+        if len(groups) > 1:
+            members = [item for _, group in groups for item in group] + members
+            groups = []
+        if len(members) >= threshold:
+            groups.append((directory, members))
+            members = []
+        pending[directory[:-1]].extend(members)
+        collapsed[directory[:-1]].extend(groups)
+
+    lines = []
+    for directory, members in collapsed[()]:
+        kinds = Counter(item.kind for item in members)
+        breakdown = ", ".join(f"{kinds[kind]} {kind}" for kind in ("changed", "added", "removed") if kinds[kind])
+        members.sort(key=lambda item: item.order)
+        examples = ", ".join(_SEPARATOR_RE.split(str(m.key))[-1] for m in members[:COLLAPSE_EXAMPLES])
+        line = (f"- {len(members)} files under {_render_directory(directory, members[0].key)} changed "
+                f"({breakdown}), e.g. {examples}")
+        lines.append((line, len(members), members[0].order))
+    kept = sorted(pending[()], key=lambda item: item.order)
+    return lines, kept
+
+
+class DiffDigest:
+    """Ranked, collapsed lines of a diff; see render()."""
+
+    def __init__(self, tiers, total, ignored):
+        self.tiers = tiers  # [(title, [(line, item count)])] in rank order, empty tiers dropped
+        self.total = total
+        self.ignored = ignored
+        self._costs = {}
+
+    def __len__(self):
+        return sum(len(lines) for _, lines in self.tiers)
+
+    def _cost(self, line):
+        cost = self._costs.get(line)
+        if cost is None:
+            cost = self._costs[line] = count_tokens(line) + 1
+        return cost
+
+    def ignored_note(self):
+        if not self.ignored:
+            return ""
+        reasons = ", ".join(f"{count} by {reason}" for reason, count in sorted(self.ignored.items()))
+        return f"[{sum(self.ignored.values())} changes ignored as noise ({reasons})]"
+
+    def render(self, budget=None):
+        """
+        The digest as text, most severe lines first.
+
+        Args:
+            budget (int): Token budget, or None for everything.
+
+        Returns:
+            tuple: (text, number of items left out to fit the budget)
+        """
+        note = self.ignored_note()
+        out = []
+        used = self._cost(note) if note else 0
+        omitted = 0
+        for title, lines in self.tiers:
+            header = f"{title} ({sum(count for _, count in lines)}):"
+            kept = []
+            for line, count in lines:
+                cost = self._cost(line) + (self._cost(header) if not kept else 0)
+                if budget is not None and used + cost > budget:
+                    omitted += count
+                    continue
+                kept.append(line)
+                used += cost
+            if kept:
+                out.append(header)
+                out.extend(kept)
+        if not out:
+            out.append("No relevant differences.")
+        if note:
+            out.append(note)
+        return "\n".join(out), omitted
+
+
+def digest_changes(changes, rules=None):
+    """
+    Digest a stream of changes (snapshot_diff.iter_changes() or
+    report_changes()) under `rules` (default DigestRules()).
+    """
+    rules = rules or DigestRules()
+    items = {}
+    ignored = Counter()
+    total = 0
+    for change in changes:
+        total += 1
+        report_type, section, key, path, value = change
+        keys = parse_path(path)
+        reason = rules.ignored_by(change, keys)
+        if reason:
+            ignored[reason] += 1
+            continue
+        item = items.get((section, key))
+        if item is None:
+            item = items[(section, key)] = DigestItem(section, key, len(items))
+        item.add(report_type, keys[2:], value)
+
+    by_tier = defaultdict(list)
+    for item in items.values():
+        by_tier[item.tier(rules)].append(item)
+
+    tiers = []
+    for tier, title in enumerate(TIERS):
+        members = by_tier.get(tier)
+        if not members:
+            continue
+        if tier in (BINARY_TIER, FILE_TIER):
+            groups, members = collapse_by_directory(members, rules.collapse_threshold)
+            # Collapsed directories first (largest first): most changes per token.
+            groups.sort(key=lambda group: (-group[1], group[2]))
+            lines = [(line, count) for line, count, _ in groups]
+        else:
+            lines = []
+        lines.extend((item.render(), 1) for item in members)
+        tiers.append((title, lines))
+    return DiffDigest(tiers, total, dict(ignored))
+
+
+def digest_report(report, rules=None):
+    """digest_changes() for a DeepDiff-style report, as the frontend sends it."""
+    return digest_changes(report_changes(report or {}), rules)
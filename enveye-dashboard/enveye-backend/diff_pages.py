@@ -0,0 +1,173 @@
+"""
+Filtered, paginated and streamed views of a snapshot diff.
+
+/compare and /compare_stored return the whole DeepDiff-style report by
+default. Asked for a page or a stream, they serve the change stream of
+snapshot_diff.iter_changes() instead, one record per change:
+
+    {"type": "values_changed", "section": "app_folder_files", "key": "bin\\app.dll",
+     "path": "root['app_folder_files']['bin\\\\app.dll']['sha256']", "value": {...}}
+
+- sections / types: keep only these sections and change types (report type
+  names, or added / removed / changed as in the drift timeline),
+- include / exclude: glob patterns matched against the key (case-insensitive,
+  / and \\ alike; a change to a whole section is matched by the section name),
+- limit / cursor: a page of at most `limit` records and the cursor of the
+  next one. The order is that of iter_changes(), which is stable for the same
+  inputs, so a page only computes the diff up to its last record,
+- NDJSON: one record per line as the diff is computed, then a final
+  {"done": true, "count": n} line.
+"""
+import base64
+import binascii
+import json
+import re
+from collections import deque
+from fnmatch import translate
+from itertools import islice
+
+from snapshot_catalog import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from snapshot_diff import REPORT_TYPES
+
+TYPE_ALIASES = {
+    "added": ("dictionary_item_added",),
+    "removed": ("dictionary_item_removed",),
+    "changed": ("values_changed", "type_changes"),
+}
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def _split(value):
+    """A list of values from a comma-separated string or a list of them."""
+    if not value:
+        return []
+    items = value if isinstance(value, (list, tuple)) else [value]
+    return [part.strip() for item in items for part in item.split(",") if part.strip()]
+
+
+def _fold(text):
+    return str(text).replace("\\", "/").casefold()
+
+
+class DiffFilter:
+    """Predicate over changes (see snapshot_diff.iter_changes); empty filters keep everything."""
+
+    def __init__(self, sections=None, types=None, include=None, exclude=None):
+        self.sections = frozenset(sections) if sections else None
+        self.types = None
+        if types:
+            self.types = set()
+            for change_type in types:
+                if change_type in TYPE_ALIASES:
+                    self.types.update(TYPE_ALIASES[change_type])
+                elif change_type in REPORT_TYPES:
+                    self.types.add(change_type)
+                else:
+                    raise ValueError(
+                        f"Unknown change type '{change_type}'; use {', '.join((*TYPE_ALIASES, *REPORT_TYPES))}."
+                    )
+        self.include = [re.compile(translate(_fold(pattern))) for pattern in include or ()]
+        self.exclude = [re.compile(translate(_fold(pattern))) for pattern in exclude or ()]
+
+    @classmethod
+    def from_params(cls, sections=None, types=None, include=None, exclude=None):
+        """A filter from API parameters, each a comma-separated string or a list."""
+        return cls(_split(sections), _split(types), _split(include), _split(exclude))
+
+    def __bool__(self):
+        return bool(self.sections or self.types or self.include or self.exclude)
+
+    def __call__(self, change):
+        change_type, section, key, _, _ = change
+        if self.sections is not None and section not in self.sections:
+            return False
+        if self.types is not None and change_type not in self.types:
+            return False
+        if self.include or self.exclude:
+            name = _fold(section if key is None else key)
+            if self.include and not any(pattern.match(name) for pattern in self.include):
+                return False
+            if any(pattern.match(name) for pattern in self.exclude):
+                return False
+        return True
+
+
+def change_record(change):
+    change_type, section, key, path, value = change
+    return {"type": change_type, "section": section, "key": key, "path": path, "value": value}
+
+
+def encode_cursor(position, change):
+    """Opaque cursor: how many records were served, and the path of the last one."""
+    raw = json.dumps([position, change[3]], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position, path = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError):
+        raise ValueError("Invalid cursor.") from None
+    if not isinstance(position, int) or position < 1 or not isinstance(path, str):
+        raise ValueError("Invalid cursor.")
+    return position, path
+
+
+def page_changes(changes, diff_filter=None, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """
+    One page of the filtered change stream.
+
+    Args:
+        changes (iterable): Changes in iter_changes() order; consumed lazily.
+        diff_filter (DiffFilter): Optional filter.
+        limit (int): Page size, capped at MAX_PAGE_SIZE.
+        cursor (str): `next_cursor` of the previous page, or None for the first.
+
+    Returns:
+        dict: {"changes": [records], "limit", "next_cursor": None on the last page}
+
+    Raises:
+        ValueError: If the cursor is malformed or was not issued for this diff
+            and filter (the record before it is not where it was).
+    """
+    limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    matching = filter(diff_filter, changes) if diff_filter else iter(changes)
+    position = 0
+    if cursor:
+        position, last_path = decode_cursor(cursor)
+        previous = deque(islice(matching, position), maxlen=1)
+        if not previous or previous[0][3] != last_path:
+            raise ValueError("The cursor does not belong to this diff and filter; start again without it.")
+    page = list(islice(matching, limit + 1))
+    more = len(page) > limit
+    page = page[:limit]
+    return {
+        "changes": [change_record(change) for change in page],
+        "limit": limit,
+        "next_cursor": encode_cursor(position + len(page), page[-1]) if more else None,
+    }
+
+
+def iter_ndjson(changes, diff_filter=None, chunk_bytes=STREAM_CHUNK_BYTES):
+    """
+    Yield the filtered change stream as NDJSON bytes, batched into chunks of
+    about `chunk_bytes`, ending with a {"done": true, "count": n} line.
+    """
+    encoder = json.JSONEncoder(ensure_ascii=False)
+    buffer = []
+    size = 0
+    count = 0
+    for change in changes:
+        if diff_filter and not diff_filter(change):
+            continue
+        line = encoder.encode(change_record(change)) + "\n"
+        buffer.append(line)
+        size += len(line)
+        count += 1
+        if size >= chunk_bytes:
+            yield "".join(buffer).encode("utf-8")
+            buffer, size = [], 0
+    buffer.append(encoder.encode({"done": True, "count": count}) + "\n")
+    yield "".join(buffer).encode("utf-8")
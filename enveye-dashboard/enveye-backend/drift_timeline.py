@@ -0,0 +1,335 @@
+"""
+Per-host drift timeline.
+
+Each stored snapshot is diffed once, when it is catalogued, against the
+previous snapshot of the same host and app (by collection time), and every
+changed key is written to SQLite next to the catalog: one row per key with
+its section, item (file path, service, variable, ...), the kind of change and
+the old and new values. Keys are the same flattened keys fleet_compare uses,
+so a file "changes" when its sha256 does.
+
+Timeline and range queries ("first snapshot where file X changed", "every
+service status flip in May") then read only those rows; no snapshot is
+parsed at query time.
+
+Snapshots in the sectioned store are diffed section by section: sections (and
+app_folder_files chunks) whose digests both manifests share are skipped
+without being read, so an unchanged host costs two manifest reads.
+
+    python drift_timeline.py snapshots/<user> [--db snapshot_catalog.sqlite3]   # backfill
+"""
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from fleet_compare import flatten_context, flatten_snapshot, render_key, render_value
+from snapshot_catalog import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, SnapshotCatalog, parse_timestamp
+from snapshot_store import MANIFEST_FORMAT, SNAPSHOT_READ_ERRORS, load_snapshot, read_manifest, read_section
+
+CHANGE_KINDS = ("added", "removed", "changed")
+
+_ABSENT = object()
+
+
+def _sections(manifest):
+    """{(section key, digest): codec} for a sectioned manifest, else None."""
+    if not manifest or manifest["format"] != MANIFEST_FORMAT or not manifest["sectioned"]:
+        return None
+    return {(key, digest): codec for key, _, digest, codec in manifest["sections"]}
+
+
+def _flatten_sections(path, sections):
+    flat = {}
+    for (key, digest), codec in sections.items():
+        flat.update(flatten_context({key: read_section(path, digest, codec)}))
+    return flat
+
+
+def context_changes(prev_path, path):
+    """
+    Flattened differences between two stored snapshots, as
+    [(key parts, change kind, old value, new value)] sorted by key.
+    """
+    old_sections = _sections(read_manifest(prev_path))
+    new_sections = _sections(read_manifest(path))
+    if old_sections is not None and new_sections is not None:
+        # A file path lives in exactly one chunk per snapshot, so a chunk both
+        # snapshots share can hold no change; only the rest need reading.
+        old = _flatten_sections(prev_path, {k: c for k, c in old_sections.items() if k not in new_sections})
+        new = _flatten_sections(path, {k: c for k, c in new_sections.items() if k not in old_sections})
+    else:
+        old = flatten_snapshot(load_snapshot(prev_path, compact=True))
+        new = flatten_snapshot(load_snapshot(path, compact=True))
+
+    changes = []
+    for key, old_value in old.items():
+        new_value = new.get(key, _ABSENT)
+        if new_value is _ABSENT:
+            changes.append((key, "removed", old_value, None))
+        elif new_value != old_value:
+            changes.append((key, "changed", old_value, new_value))
+    for key, new_value in new.items():
+        if key not in old:
+            changes.append((key, "added", None, new_value))
+    changes.sort(key=lambda change: render_key(change[0]))
+    return changes
+
+
+def _encode(value):
+    return None if value is None else json.dumps(render_value(value), ensure_ascii=False)
+
+
+def compute_link(snapshot_dir, prev_name, name):
+    """
+    Change rows for `name` against `prev_name` (none for the first snapshot
+    of a host). Module-level so it can run in a worker process.
+    """
+    if prev_name is None:
+        return []
+    snapshot_dir = Path(snapshot_dir)
+    return [
+        (parts[0], str(parts[1]) if len(parts) > 1 else None, render_key(parts), kind, _encode(old), _encode(new))
+        for parts, kind, old, new in context_changes(snapshot_dir / prev_name, snapshot_dir / name)
+    ]
+
+
+def _compute_link_task(args):
+    """compute_link, or None (logged) if either snapshot can't be read; it's retried on the next rebuild."""
+    try:
+        return compute_link(*args)
+    except SNAPSHOT_READ_ERRORS as e:
+        print(f"⚠️ Skipping timeline link {args[1]} -> {args[2]}: {type(e).__name__}: {e}")
+        return None
+
+
+class DriftTimeline:
+    """
+    Consecutive-snapshot changes per (host, app), kept in the catalog
+    database and in step with it.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.snapshot_dir = catalog.snapshot_dir
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(catalog.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS timeline_links (
+                name TEXT PRIMARY KEY,
+                prev_name TEXT,
+                host TEXT,
+                app TEXT,
+                collected_at REAL,
+                changes INTEGER,
+                sections TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_timeline_links_host ON timeline_links (host, app, collected_at);
+            CREATE INDEX IF NOT EXISTS idx_timeline_links_prev ON timeline_links (prev_name);
+            CREATE TABLE IF NOT EXISTS timeline_changes (
+                name TEXT,
+                host TEXT,
+                app TEXT,
+                collected_at REAL,
+                section TEXT,
+                item TEXT,
+                path TEXT,
+                change TEXT,
+                old_value TEXT,
+                new_value TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_timeline_changes_name ON timeline_changes (name);
+            CREATE INDEX IF NOT EXISTS idx_timeline_changes_host ON timeline_changes (host, app, collected_at);
+            CREATE INDEX IF NOT EXISTS idx_timeline_changes_item ON timeline_changes (host, app, section, item, collected_at);
+        """)
+        self._conn.commit()
+
+    def _store(self, links):
+        """links: [(catalog row, prev_name, change rows)]"""
+        with self._lock:
+            for row, prev_name, changes in links:
+                sections = {}
+                for change in changes:
+                    sections[change[0]] = sections.get(change[0], 0) + 1
+                self._conn.execute("DELETE FROM timeline_changes WHERE name = ?", (row["name"],))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO timeline_links (name, prev_name, host, app, collected_at, changes, sections) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (row["name"], prev_name, row["host"], row["app"], row["collected_at"], len(changes), json.dumps(sections)),
+                )
+                self._conn.executemany(
+                    "INSERT INTO timeline_changes (name, host, app, collected_at, section, item, path, change, old_value, new_value) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(row["name"], row["host"], row["app"], row["collected_at"], *change) for change in changes],
+                )
+            self._conn.commit()
+
+    def _link(self, name):
+        position = self.catalog.position(name)
+        if position is None:
+            return None
+        changes = compute_link(self.snapshot_dir, position["previous"], name)
+        self._store([(position, position["previous"], changes)])
+        return position
+
+    def record(self, name):
+        """
+        Diff a newly catalogued snapshot against its predecessor. If it landed
+        between two existing snapshots, the next one is re-linked to it.
+        """
+        position = self._link(name)
+        if position and position["next"]:
+            with self._lock:
+                link = self._conn.execute("SELECT prev_name FROM timeline_links WHERE name = ?", (position["next"],)).fetchone()
+            if link is None or link[0] != name:
+                self._link(position["next"])
+
+    def remove(self, name):
+        """Forget `name` (already removed from the catalog) and re-link its successor."""
+        with self._lock:
+            successors = [r[0] for r in self._conn.execute("SELECT name FROM timeline_links WHERE prev_name = ?", (name,))]
+            self._conn.execute("DELETE FROM timeline_links WHERE name = ?", (name,))
+            self._conn.execute("DELETE FROM timeline_changes WHERE name = ?", (name,))
+            self._conn.commit()
+        for successor in successors:
+            self._link(successor)
+
+    def rebuild(self, full=False, max_workers=None):
+        """
+        Bring the timeline in line with the catalog: drop links for snapshots
+        that are gone and (re)compute, in parallel, every link whose
+        predecessor is missing or has changed. With `full=True` every link is
+        recomputed.
+        """
+        started = time.time()
+        expected = self.catalog.successions()
+        with self._lock:
+            known = {r["name"]: r["prev_name"] for r in self._conn.execute("SELECT name, prev_name FROM timeline_links")}
+
+        names = {row["name"] for row in expected}
+        gone = [name for name in known if name not in names]
+        stale = [row for row in expected if full or row["name"] not in known or known[row["name"]] != row["previous"]]
+
+        linked = []
+        if stale:
+            tasks = [(str(self.snapshot_dir), row["previous"], row["name"]) for row in stale]
+            if len(tasks) == 1 or max_workers == 1:
+                results = [_compute_link_task(t) for t in tasks]
+            else:
+                with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                    results = list(pool.map(_compute_link_task, tasks, chunksize=max(1, len(tasks) // 64)))
+            linked = [(row, row["previous"], changes) for row, changes in zip(stale, results) if changes is not None]
+            self._store(linked)
+
+        if gone:
+            with self._lock:
+                self._conn.executemany("DELETE FROM timeline_links WHERE name = ?", [(n,) for n in gone])
+                self._conn.executemany("DELETE FROM timeline_changes WHERE name = ?", [(n,) for n in gone])
+                self._conn.commit()
+
+        return {"snapshots": len(expected), "linked": len(linked),
+                "skipped": len(stale) - len(linked), "removed": len(gone), "seconds": round(time.time() - started, 3)}
+
+    @staticmethod
+    def _time_filters(since, until, clauses, params):
+        for op, value in ((">=", since), ("<=", until)):
+            ts = parse_timestamp(value)
+            if ts is not None:
+                clauses.append(f"collected_at {op} ?")
+                params.append(ts)
+
+    @staticmethod
+    def _page(limit, offset):
+        return max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE)), max(0, int(offset or 0))
+
+    @staticmethod
+    def _iso(ts):
+        return datetime.fromtimestamp(ts).isoformat(timespec="seconds") if ts is not None else None
+
+    def timeline(self, host, app=None, since=None, until=None, limit=DEFAULT_PAGE_SIZE, offset=0, changed_only=False):
+        """
+        Oldest-first page of a host's snapshots with how many keys changed
+        since the previous one, per section.
+        """
+        clauses, params = ["host = ?"], [host]
+        if app:
+            clauses.append("app = ?")
+            params.append(app)
+        if changed_only:
+            clauses.append("changes > 0")
+        self._time_filters(since, until, clauses, params)
+        where = " AND ".join(clauses)
+        limit, offset = self._page(limit, offset)
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM timeline_links WHERE {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT * FROM timeline_links WHERE {where} ORDER BY collected_at, name LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        items = [
+            {
+                "name": r["name"],
+                "previous": r["prev_name"],
+                "app": r["app"],
+                "collected_at": self._iso(r["collected_at"]),
+                "changes": r["changes"],
+                "sections": json.loads(r["sections"] or "{}"),
+            }
+            for r in rows
+        ]
+        return {"total": total, "limit": limit, "offset": offset, "items": items}
+
+    def changes(self, host, app=None, section=None, item=None, change=None, since=None, until=None,
+                limit=DEFAULT_PAGE_SIZE, offset=0):
+        """
+        Oldest-first page of individual key changes on a host, e.g. every
+        change to one file (section="app_folder_files", item=<path>) or every
+        service status flip (section="required_services_status", change="changed").
+        """
+        clauses, params = ["host = ?"], [host]
+        for column, value in (("app", app), ("section", section), ("item", item), ("change", change)):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        self._time_filters(since, until, clauses, params)
+        where = " AND ".join(clauses)
+        limit, offset = self._page(limit, offset)
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM timeline_changes WHERE {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT * FROM timeline_changes WHERE {where} ORDER BY collected_at, name, path LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        items = [
+            {
+                "name": r["name"],
+                "app": r["app"],
+                "collected_at": self._iso(r["collected_at"]),
+                "section": r["section"],
+                "item": r["item"],
+                "path": r["path"],
+                "change": r["change"],
+                "old_value": json.loads(r["old_value"]) if r["old_value"] is not None else None,
+                "new_value": json.loads(r["new_value"]) if r["new_value"] is not None else None,
+            }
+            for r in rows
+        ]
+        return {"total": total, "limit": limit, "offset": offset, "items": items}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the drift timeline for a snapshot directory.")
+    parser.add_argument("snapshot_dir", type=Path)
+    parser.add_argument("--db", type=Path, default=Path(__file__).resolve().parent / "snapshot_catalog.sqlite3")
+    parser.add_argument("--full", action="store_true", help="Recompute every link, not only new or stale ones")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    catalog = SnapshotCatalog(args.db, args.snapshot_dir)
+    catalog.rebuild(max_workers=args.workers)
+    print(json.dumps(DriftTimeline(catalog).rebuild(full=args.full, max_workers=args.workers), indent=2))
@@ -1,30 +1,43 @@
-from fastapi import FastAPI, UploadFile, File, Request
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, Request, Query
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from deepdiff import DeepDiff
-import google.generativeai as genai
-import winrm
+from starlette.concurrency import run_in_threadpool
+import asyncio
+import functools
+import hashlib
 import json
 import os
+import time
 import concurrent.futures
 import traceback
-from pathlib import Path
+from pathlib import Path, PureWindowsPath
 from datetime import datetime
-import base64
 from fastapi import Body
-from PIL import Image
-import pytesseract
-import base64
-import io
-import re
-import unicodedata
-from ai_provider import send_prompt
-from tiktoken import get_encoding
-from uuid import uuid4
-import paramiko
-import time
+from ai_provider import warm_up as warm_up_ai
+from ai_router import AIRouter
 from config_loader import CONFIG
+from snapshot_diff import build_report, iter_changes
+from diff_pages import DiffFilter, iter_ndjson, page_changes
+from diff_digest import DigestRules, digest_report
+from fleet_compare import compare_fleet
+from snapshot_cache import SnapshotCache, SnapshotNotFound
+from snapshot_catalog import SnapshotCatalog
+from drift_timeline import CHANGE_KINDS, DriftTimeline
+from snapshot_index import SnapshotIndex, term_query
+from snapshot_ingest import InvalidSnapshot, read_compact_snapshot, scan_snapshot_file, spool_upload
+from snapshot_store import DeltaBaseNotFound, is_delta_document, iter_snapshot_json, open_store
+from log_reader import read_tail
+from ocr_service import OCRBusy, OCRService, decode_image_payload
+from log_blocks import extract_important_log_blocks
+from log_index import LogIndex
+from ai_cache import AIResponseCache, prompt_cache_keys
+from session_store import open_session_store
+from conversation_context import ConversationContext
+from remote_collector import CollectionError, collect_ssh_based, collect_windows, connection_pool, snapshot_filename_for
+from connection_pool import load_transports
+from remote_jobs import CollectionJobManager
+from token_budget import context_budget, count_tokens, fits_budget, get_encoder, pack_log_content, pack_prompt_inputs
 import sys
 sys.path.append(str(Path(__file__).resolve().parent))
 
@@ -55,8 +68,116 @@ BASE_DIR = Path(__file__).resolve().parent
 SNAPSHOT_DIR = BASE_DIR / "snapshots"/username
 SNAPSHOT_DIR.mkdir(exist_ok=True)
 
-# --- Mount Snapshots as Static ---
-app.mount("/snapshots", StaticFiles(directory=SNAPSHOT_DIR), name="snapshots")
+# --- Parsed snapshot / compare result cache ---
+CACHE_CONFIG = CONFIG.get("cache", {})
+snapshot_cache = SnapshotCache(
+    SNAPSHOT_DIR,
+    max_snapshots=CACHE_CONFIG.get("max_snapshots", 32),
+    max_results=CACHE_CONFIG.get("max_compare_results", 256),
+)
+
+# --- Snapshot storage (content-addressed sections, or plain files) ---
+snapshot_store = open_store(SNAPSHOT_DIR, CONFIG.get("storage"))
+
+# --- Snapshot catalog (metadata index for listing / filtering) ---
+CATALOG_CONFIG = CONFIG.get("catalog", {})
+snapshot_catalog = SnapshotCatalog(BASE_DIR / CATALOG_CONFIG.get("db_file", "snapshot_catalog.sqlite3"), SNAPSHOT_DIR)
+
+# --- Drift timeline (consecutive diffs per host, computed at ingest) ---
+drift_timeline = DriftTimeline(snapshot_catalog)
+
+# --- Inverted index (which snapshots have file X / hash Y / service state Z) ---
+INDEX_CONFIG = CONFIG.get("index", {})
+snapshot_index = SnapshotIndex(snapshot_catalog)
+
+def sync_catalog_and_indexes():
+    snapshot_catalog.rebuild()
+    drift_timeline.rebuild()
+    snapshot_index.rebuild(max_workers=INDEX_CONFIG.get("max_workers"))
+
+@app.on_event("startup")
+async def sync_snapshot_catalog():
+    # Pick up snapshots written while the server was down, without blocking startup.
+    loop = asyncio.get_running_loop()
+    loop.run_in_executor(None, sync_catalog_and_indexes).add_done_callback(log_sync_failure)
+
+def log_sync_failure(future):
+    error = None if future.cancelled() else future.exception()
+    if error is not None:
+        print(f"❌ Snapshot catalog / index sync failed: {type(error).__name__}: {error}")
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+# --- Optional warm-up of lazily loaded subsystems (config "startup.warm_up") ---
+WARM_UPS = {
+    "ai": lambda: warm_up_ai_routes(),
+    "tokenizer": get_encoder,
+    "ocr": lambda: ocr_service.warm_up(),
+    "remote": load_transports,
+}
+
+def warm_up(names):
+    for name in names:
+        if name not in WARM_UPS:
+            print(f"\u26A0\uFE0F Unknown warm-up '{name}' (expected one of {', '.join(WARM_UPS)})")
+            continue
+        started = time.perf_counter()
+        try:
+            WARM_UPS[name]()
+            print(f"\u2705 Warmed up {name} in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            print(f"\u26A0\uFE0F Warm-up of {name} failed: {e}")
+
+@app.on_event("startup")
+async def warm_up_subsystems():
+    names = CONFIG.get("startup", {}).get("warm_up", [])
+    if names:
+        asyncio.get_running_loop().run_in_executor(None, warm_up, names)
+
+def catalog_snapshot(path, snapshot=None, **metadata):
+    """Catalog a newly stored snapshot, diff it into its host's drift timeline and index its contents."""
+    row = snapshot_catalog.record(path, snapshot, **metadata)
+    drift_timeline.record(row["name"])
+    snapshot_index.record(row["name"])
+    return row
+
+def store_collected_snapshot(path, host=None, label=None):
+    """Move a snapshot (or delta) a collector just wrote into the store and catalog it."""
+    try:
+        snapshot = snapshot_store.ingest(path)
+    except DeltaBaseNotFound:
+        path.unlink(missing_ok=True)
+        raise
+    return catalog_snapshot(path, snapshot, host=host, label=label)
+
+def delta_base_for(vm_ip, app_folder):
+    """
+    Newest snapshot remotely collected from this host and app. The agent kept
+    its own copy under the same name, so it can send a delta against it.
+    """
+    if not CONFIG.get("storage", {}).get("remote_deltas", True) or not vm_ip or not app_folder:
+        return None
+    prefix = vm_ip.replace('.', '-') + "_"
+    # Windows agents report the app under its Windows basename; PureWindowsPath splits on / and \ alike.
+    page = snapshot_catalog.query(host=vm_ip, app=PureWindowsPath(app_folder.rstrip("\\/")).name, limit=5)
+    for item in page["items"]:
+        if item["name"].startswith(prefix):
+            return item["name"]
+    return None
+
+def resolve_delta_base(delta, hostname):
+    """
+    Find the stored snapshot an uploaded delta is based on: by name if it
+    exists here, otherwise by host, app and the base's own timestamp.
+    """
+    base = delta.get("base")
+    if base and Path(base).name == base and (SNAPSHOT_DIR / base).is_file():
+        return base
+    if delta.get("base_timestamp"):
+        page = snapshot_catalog.query(host=hostname, app=delta.get("application_name"),
+                                      since=delta["base_timestamp"], until=delta["base_timestamp"], limit=1)
+        if page["items"]:
+            return page["items"][0]["name"]
+    return None
 
 
 @app.get("/")
@@ -78,6 +199,35 @@ async def get_config():
 
 
 # --- Upload Snapshot API ---
+STORAGE_CONFIG = CONFIG.get("storage", {})
+UPLOAD_CHUNK_BYTES = STORAGE_CONFIG.get("upload_chunk_bytes", 1024 * 1024)
+# "background" (default), "inline" or "off": when to convert a plain upload to the store's layout
+REENCODE_UPLOADS = STORAGE_CONFIG.get("reencode_uploads", "background")
+# Uploads get their own small pools so large ingests can't tie up the threadpool other endpoints use.
+upload_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=STORAGE_CONFIG.get("upload_workers", 4), thread_name_prefix="upload-ingest")
+reencode_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot-reencode")
+
+async def run_in_upload_pool(fn, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(upload_executor, functools.partial(fn, *args, **kwargs))
+
+def reencode_snapshot(path, hostname):
+    """Convert a stored plain upload into the store's layout and refresh its catalog row."""
+    try:
+        snapshot = snapshot_store.ingest(path)
+        if snapshot is not None:
+            snapshot_catalog.record(path, snapshot, host=hostname)
+            snapshot_index.record(path.name)
+    except Exception as e:
+        print(f"⚠️ Re-encoding {path.name} failed, keeping the plain file: {e}")
+
+def ingest_delta_upload(part_path, filename, hostname):
+    with open(part_path, "rb") as f:
+        delta = json.load(f)
+    delta["base"] = resolve_delta_base(delta, hostname)
+    snapshot = snapshot_store.write_delta(filename, delta)
+    catalog_snapshot(filename, snapshot, host=hostname)
+
 @app.post("/upload_snapshot")
 async def upload_snapshot(request: Request, snapshot: UploadFile = File(...)):
     try:
@@ -89,40 +239,140 @@ async def upload_snapshot(request: Request, snapshot: UploadFile = File(...)):
         
         print(f"app name:{app_name}")
 
-        content = await snapshot.read()
-        parsed_content = json.loads(content)
-
         filename = SNAPSHOT_DIR / f"{hostname}_{app_name}_{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
 
-        with open(filename, "w") as f:
-            f.write(json.dumps(parsed_content, indent=4))
+        # Stream to disk and validate incrementally; the document is never held in memory here.
+        part_path = await run_in_upload_pool(spool_upload, snapshot.file, SNAPSHOT_DIR, UPLOAD_CHUNK_BYTES)
+        try:
+            metadata = await run_in_upload_pool(scan_snapshot_file, part_path, UPLOAD_CHUNK_BYTES)
+            if is_delta_document(metadata):
+                await run_in_upload_pool(ingest_delta_upload, part_path, filename, hostname)
+            else:
+                os.replace(part_path, filename)
+                await run_in_upload_pool(catalog_snapshot, filename, metadata, host=hostname)
+                if snapshot_store.converts_plain_files and REENCODE_UPLOADS == "inline":
+                    await run_in_upload_pool(reencode_snapshot, filename, hostname)
+                elif snapshot_store.converts_plain_files and REENCODE_UPLOADS == "background":
+                    reencode_executor.submit(reencode_snapshot, filename, hostname)
+        finally:
+            part_path.unlink(missing_ok=True)
 
         print(f"\u2705 Snapshot received and saved: {filename}")
 
         return {"message": f"Snapshot from {hostname} collected successfully!"}
 
+    except InvalidSnapshot as e:
+        return JSONResponse(content={"error": f"Invalid snapshot JSON: {e}"}, status_code=400)
+    except DeltaBaseNotFound as e:
+        return JSONResponse(content={"error": f"Base snapshot for delta not found ({e}); upload a full snapshot."}, status_code=409)
     except Exception as e:
         print(f"\u274C Error while saving snapshot: {e}")
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 # --- Compare Snapshots API ---
+def diff_view(changes, diff_filter, limit, cursor):
+    """A page of change records if asked for one, otherwise the (filtered) DeepDiff-style report."""
+    if limit or cursor:
+        return page_changes(changes, diff_filter, limit=limit, cursor=cursor)
+    return {"differences": build_report(filter(diff_filter, changes) if diff_filter else changes)}
+
 @app.post("/compare")
-async def compare_snapshots(file1: UploadFile = File(...), file2: UploadFile = File(...)):
+async def compare_snapshots(file1: UploadFile = File(...), file2: UploadFile = File(...),
+                            sections: str = None, types: str = None, include: str = None, exclude: str = None,
+                            limit: int = None, cursor: str = None, stream: bool = False):
+    """
+    Diff two uploaded snapshots. By default the whole report; sections/types/
+    include/exclude filter it (see diff_pages.py), limit/cursor page through the
+    change records (re-send the same files with the cursor for the next page)
+    and stream=true streams them as NDJSON while the diff is computed.
+    """
     try:
-        file1_content = await file1.read()
-        file2_content = await file2.read()
+        diff_filter = DiffFilter.from_params(sections, types, include, exclude)
+        # Parsed straight from the uploaded files, app_folder_files as FileTables.
+        data1 = await run_in_threadpool(read_compact_snapshot, file1.file)
+        data2 = await run_in_threadpool(read_compact_snapshot, file2.file)
 
-        data1 = json.loads(file1_content)
-        data2 = json.loads(file2_content)
+        changes = iter_changes(data1, data2)
+        if stream:
+            return StreamingResponse(iter_ndjson(changes, diff_filter), media_type="application/x-ndjson")
+        return JSONResponse(content=await run_in_threadpool(diff_view, changes, diff_filter, limit, cursor))
 
-        diff = DeepDiff(data1.get('environment_context', {}), data2.get('environment_context', {}), view='tree')
+    except Exception as e:
+        print(f"\u274C Exception during /compare: {e}")
+        return JSONResponse(content={"error": str(e)}, status_code=400)
 
-        return JSONResponse(content={"differences": json.loads(diff.to_json())})
+# --- Compare Stored Snapshots API ---
+@app.post("/compare_stored")
+async def compare_stored_snapshots(payload: dict = Body(...)):
+    """
+    Diff two stored snapshots ("left", "right"). Takes the same optional
+    "sections", "types", "include", "exclude", "limit", "cursor" and "stream"
+    fields as /compare's parameters; pages are served from the cached diff.
+    """
+    left = payload.get("left")
+    right = payload.get("right")
+    if not left or not right:
+        return JSONResponse(content={"error": "Both 'left' and 'right' snapshot names are required."}, status_code=400)
 
+    try:
+        diff_filter = DiffFilter.from_params(*(payload.get(f) for f in ("sections", "types", "include", "exclude")))
+        limit, cursor, stream = payload.get("limit"), payload.get("cursor"), bool(payload.get("stream"))
+        changes = await run_in_threadpool(snapshot_cache.changes, left, right)
+        if stream:
+            return StreamingResponse(iter_ndjson(changes, diff_filter), media_type="application/x-ndjson")
+        return JSONResponse(content=await run_in_threadpool(diff_view, changes, diff_filter, limit, cursor))
+    except SnapshotNotFound as e:
+        return JSONResponse(content={"error": f"Snapshot not found: {e}"}, status_code=404)
     except Exception as e:
-        print(f"\u274C Exception during /compare: {e}")
+        print(f"\u274C Exception during /compare_stored: {e}")
         return JSONResponse(content={"error": str(e)}, status_code=400)
 
+# --- Fleet Compare API ---
+FLEET_CONFIG = CONFIG.get("fleet_compare", {})
+
+def fleet_snapshot_names(filters, limit):
+    names, offset = [], 0
+    while len(names) < limit:
+        page = snapshot_catalog.query(**filters, limit=limit - len(names), offset=offset)
+        names.extend(item["name"] for item in page["items"])
+        offset += len(page["items"])
+        if not page["items"] or offset >= page["total"]:
+            break
+    return names
+
+def run_fleet_compare(payload):
+    limit = FLEET_CONFIG.get("max_snapshots", 5000)
+    names = payload.get("snapshots")
+    if not names:
+        filters = {f: payload.get(f) for f in ("host", "app", "os", "label", "since", "until") if payload.get(f)}
+        names = fleet_snapshot_names(filters, limit + 1)
+    if len(names) > limit:
+        raise ValueError(f"Fleet compare is limited to {limit} snapshots; narrow the selection.")
+    paths = [snapshot_cache.resolve(name) for name in names]
+    baseline = payload.get("baseline")
+    baseline_path = snapshot_cache.resolve(baseline) if baseline else None
+    return compare_fleet(paths, baseline_path, max_workers=FLEET_CONFIG.get("max_workers"))
+
+@app.post("/compare_fleet")
+async def compare_fleet_endpoint(payload: dict = Body(...)):
+    """
+    N-way drift report. Snapshots are given by name ("snapshots") or by
+    catalog filters (host/app/os/label/since/until); "baseline" names the
+    reference snapshot, otherwise the fleet majority is used.
+    """
+    try:
+        result = await run_in_threadpool(run_fleet_compare, payload)
+        return JSONResponse(content=result)
+    except SnapshotNotFound as e:
+        return JSONResponse(content={"error": f"Snapshot not found: {e}"}, status_code=404)
+    except Exception as e:
+        print(f"\u274C Exception during /compare_fleet: {e}")
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+
+@app.get("/cache_stats")
+async def cache_stats():
+    return snapshot_cache.stats()
+
 # --- Explain Differences API (Depreciated) ---
 @app.post("/explain")
 async def explain_diff(payload: dict = Body(...)):
@@ -135,16 +385,16 @@ async def explain_diff(payload: dict = Body(...)):
         # Extract log content
         log_content = ""
         if log_path:
-            full_log = read_log_file_safely(log_path)
-            log_content = extract_important_log_blocks(full_log, max_blocks=30)
+            log_content = await run_in_threadpool(extract_log_blocks, log_path, 30)
             
-            if estimate_token_count(log_content) > 10000:
-                log_content = log_content[:2000] + "\n\n[Log truncated due to size]"
+            if not fits_budget(log_content, 10000):
+                log_content, _ = pack_log_content(log_content, 10000)
+                log_content += "\n\n[Log truncated due to size]"
 
         # Extract text from image if present
         screenshot_text = ""
         if error_screenshot:
-            screenshot_text = extract_text_from_screenshot(error_screenshot)
+            screenshot_text = await extract_text_from_screenshot(error_screenshot)
 
         # Construct the prompt
         prompt = f"""
@@ -194,37 +444,75 @@ Log Content (if any):
 
 
 #--- AI Diagnosis ---
+# --- AI routing (per-vendor latency stats, fallback, hedged requests) ---
+ai_router = AIRouter.from_config(CONFIG.get("ai", {}))
+
+def ai_prompt_budget():
+    """Prompt token budget that fits every routed vendor, so a fallback never gets an oversized prompt."""
+    return min(context_budget(vendor, model) for vendor, model in ai_router.vendors)
+
+def warm_up_ai_routes():
+    for vendor, _ in ai_router.vendors:
+        warm_up_ai(vendor)
+
+@app.get("/ai_stats")
+async def ai_stats():
+    return ai_router.stats()
+
 # --- Diagnosis Session Management ---
-sessions = {}
-
-class DiagnosisSession:
-    def __init__(self, initial_input):
-        self.session_id = str(uuid4())
-        self.created_at = datetime.utcnow().isoformat()
-        self.initial_input = initial_input
-        self.ai_messages = []
-        self.user_followups = []
-        self.status = "active"
-
-    def to_dict(self):
-        return {
-            "session_id": self.session_id,
-            "created_at": self.created_at,
-            "initial_input": self.initial_input,
-            "ai_messages": self.ai_messages,
-            "user_followups": self.user_followups,
-            "status": self.status
-        }
+sessions = open_session_store(CONFIG.get("sessions"), BASE_DIR)
+
+@app.get("/session_stats")
+async def session_stats():
+    return {**await run_in_threadpool(sessions.stats), "context": conversation.stats()}
+
+# --- AI response cache ---
+AI_CACHE_CONFIG = CONFIG.get("ai_cache", {})
+ai_cache = AIResponseCache(
+    BASE_DIR / AI_CACHE_CONFIG.get("db_file", "ai_cache.sqlite3"),
+    ttl_seconds=AI_CACHE_CONFIG.get("ttl_seconds", 86400),
+    max_memory_entries=AI_CACHE_CONFIG.get("max_memory_entries", 512),
+) if AI_CACHE_CONFIG.get("enabled", True) else None
+
+def diagnosis_cache_keys(payload):
+    """
+    {(vendor, model): cache key} of an initial diagnosis per AI route, or None
+    if caching is off for this request. Blocking (hashes the payload, reads
+    SQLite further on): run these helpers in the threadpool.
+    """
+    if ai_cache is None or payload.get("use_cache") is False:
+        return None
+    return prompt_cache_keys(ai_router.vendors, payload, prompt_version())
+
+def cached_diagnosis(cache_keys):
+    """A cached answer from any route, looked up in the order the router would try them."""
+    if not cache_keys:
+        return None
+    return ai_cache.get(*(cache_keys[(route.vendor, route.model)] for route in ai_router.candidates()))
+
+def cache_diagnosis(cache_keys, route, response_text):
+    """Store an answer under the key and label of the route that gave it."""
+    if cache_keys and route is not None:
+        ai_cache.put(cache_keys[(route.vendor, route.model)], route.vendor, route.model, response_text)
+
+@app.get("/ai_cache_stats")
+async def ai_cache_stats():
+    if ai_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **await run_in_threadpool(ai_cache.stats)}
 
 @app.post("/start_diagnosis")
 async def start_diagnosis(payload: dict = Body(...)):
-    session = DiagnosisSession(payload)
+    cache_keys = await run_in_threadpool(diagnosis_cache_keys, payload)
+    response_text = await run_in_threadpool(cached_diagnosis, cache_keys)
+    if response_text is None:
+        prompt = await run_in_threadpool(generate_initial_prompt, payload)
+        winner = []
+        response_text = await ai_router.send(prompt, on_route=winner.append)
+        await run_in_threadpool(cache_diagnosis, cache_keys, winner[0], response_text)
 
-    prompt = generate_initial_prompt(payload)
-    response_text = send_prompt(prompt)
-
-    session.ai_messages.append({"role": "assistant", "content": response_text})
-    sessions[session.session_id] = session
+    session = await run_in_threadpool(sessions.create, payload)
+    await run_in_threadpool(sessions.add_ai_message, session, response_text)
 
     return {
         "session_id": session.session_id,
@@ -236,54 +524,78 @@ async def followup(payload: dict = Body(...)):
     session_id = payload.get("session_id")
     followup_text = payload.get("followup_text")
 
-    session = sessions.get(session_id)
+    session = await run_in_threadpool(sessions.get, session_id)
     if not session:
         return JSONResponse(content={"error": "Invalid session"}, status_code=404)
 
-    session.user_followups.append({"type": "text", "content": followup_text})
-    full_prompt = compile_session_prompt(session)
-    ai_response = send_prompt(full_prompt)
-    session.ai_messages.append({"role": "assistant", "content": ai_response})
+    await run_in_threadpool(sessions.add_followup, session, followup_text)
+    full_prompt = await run_in_threadpool(compile_session_prompt, session)
+    conversation.schedule_summary(session)
+    ai_response = await ai_router.send(full_prompt)
+    await run_in_threadpool(sessions.add_ai_message, session, ai_response)
 
     return {"session_id": session_id, "ai_response": ai_response}
 
+# --- Streaming (SSE) variants ---
+def sse_event(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+async def stream_ai_response(session, prompt, cache_keys=None, cached=None):
+    """Relay AI chunks as server-sent events and store the full reply on the session."""
+    yield sse_event({"session_id": session.session_id}, event="session")
+    if cached is not None:
+        await run_in_threadpool(sessions.add_ai_message, session, cached)
+        yield sse_event({"delta": cached})
+        yield sse_event({"session_id": session.session_id, "ai_response": cached, "cached": True}, event="done")
+        return
+
+    chunks, winner = [], []
+    try:
+        async for chunk in ai_router.stream(prompt, on_route=winner.append):
+            chunks.append(chunk)
+            yield sse_event({"delta": chunk})
+    except Exception as e:
+        print(f"❌ AI streaming error: {e}")
+        yield sse_event({"error": str(e)}, event="error")
+        return
+    response_text = "".join(chunks).strip()
+    await run_in_threadpool(sessions.add_ai_message, session, response_text)
+    await run_in_threadpool(cache_diagnosis, cache_keys, winner[0] if winner else None, response_text)
+    yield sse_event({"session_id": session.session_id, "ai_response": response_text}, event="done")
+
+@app.post("/start_diagnosis_stream")
+async def start_diagnosis_stream(payload: dict = Body(...)):
+    session = await run_in_threadpool(sessions.create, payload)
+    cache_keys = await run_in_threadpool(diagnosis_cache_keys, payload)
+    cached = await run_in_threadpool(cached_diagnosis, cache_keys)
+    prompt = None if cached is not None else await run_in_threadpool(generate_initial_prompt, payload)
+    return StreamingResponse(stream_ai_response(session, prompt, cache_keys, cached), media_type="text/event-stream")
+
+@app.post("/followup_stream")
+async def followup_stream(payload: dict = Body(...)):
+    session = await run_in_threadpool(sessions.get, payload.get("session_id"))
+    if not session:
+        return JSONResponse(content={"error": "Invalid session"}, status_code=404)
+
+    await run_in_threadpool(sessions.add_followup, session, payload.get("followup_text"))
+    full_prompt = await run_in_threadpool(compile_session_prompt, session)
+    conversation.schedule_summary(session)
+    return StreamingResponse(stream_ai_response(session, full_prompt), media_type="text/event-stream")
+
 @app.get("/session/{session_id}")
 async def view_session(session_id: str):
-    session = sessions.get(session_id)
+    session = await run_in_threadpool(sessions.get, session_id)
     if not session:
         return JSONResponse(content={"error": "Not found"}, status_code=404)
     return session.to_dict()
 
 @app.post("/session/{session_id}/close")
 async def close_session(session_id: str):
-    session = sessions.get(session_id)
+    session = await run_in_threadpool(sessions.get, session_id)
     if session:
-        session.status = "resolved"
+        await run_in_threadpool(sessions.set_status, session, "resolved")
     return {"message": f"Session {session_id} marked as resolved"}
-    
-@app.post("/followup")
-async def followup(payload: dict = Body(...)):
-    session_id = payload.get("session_id")
-    followup_text = payload.get("followup_text")
-
-    session = sessions.get(session_id)
-    if not session:
-        return JSONResponse(content={"error": "Invalid session"}, status_code=404)
-
-    session.user_followups.append({
-        "type": "text",
-        "content": followup_text
-    })
-
-    # Compile a conversation prompt from history
-    full_prompt = compile_session_prompt(session)
-    ai_response = send_prompt(full_prompt)
-
-    session.ai_messages.append({"role": "assistant", "content": ai_response})
-    return {
-        "session_id": session_id,
-        "ai_response": ai_response
-    }
 
 
 @app.post("/flag")
@@ -320,15 +632,13 @@ async def remote_collect(request: Request):
         vm_type = body.get("vm_type", "windows").lower()
         snapshot_label = body.get("label", "").strip()
 
-        hostname = vm_ip.replace('.', '-')
-        app_name = os.path.basename(app_folder).replace(" ", "").replace(".", "_")
-        timestamp = datetime.now().strftime('%Y%m%dT%H%M%S')
-        snapshot_filename = f"{hostname}_{app_name}_{vm_type.upper()}_{timestamp}_{snapshot_label}.json"
+        snapshot_filename = snapshot_filename_for(vm_ip, app_folder, vm_type, snapshot_label)
+        base_snapshot = await run_in_threadpool(delta_base_for, vm_ip, app_folder)
 
         if vm_type == "windows":
-            return await handle_windows(vm_ip, username, password, app_folder, app_type, snapshot_label, snapshot_filename)
+            return await handle_windows(vm_ip, username, password, app_folder, app_type, snapshot_label, snapshot_filename, base_snapshot)
         elif vm_type in ["linux", "macos", "mac"]:
-            return await handle_ssh_based(vm_ip, username, password, app_folder, app_type, snapshot_label, snapshot_filename)
+            return await handle_ssh_based(vm_ip, username, password, app_folder, app_type, snapshot_label, snapshot_filename, base_snapshot)
         else:
             return JSONResponse(content={"error": f"Unsupported VM type: {vm_type}"}, status_code=400)
 
@@ -340,167 +650,185 @@ async def remote_collect(request: Request):
         
         
 # for remote colection in Windows VM
-async def handle_windows(vm_ip, username, password, app_folder, app_type, snapshot_label, snapshot_filename):
-    remote_agent = CONFIG["agent_paths"]["windows"]
-    snapshot_dir = os.path.dirname(remote_agent)
-    remote_snapshot_path = f"{snapshot_dir}\\{snapshot_filename}"
-
+async def handle_windows(vm_ip, username, password, app_folder, app_type, snapshot_label, snapshot_filename, base_snapshot=None):
     try:
-        session = winrm.Session(
-            f'http://{vm_ip}:5985/wsman',
-            auth=(username, password),
-            transport='ntlm'
-        )
-
-        arg_parts = [
-            f'--app-folder "{app_folder}"',
-            f'--app-type {app_type}',
-            f'--output {snapshot_filename}'
-        ]
-        if snapshot_label:
-            arg_parts.append(f'--label {snapshot_label}')
-        arg_string = " ".join(arg_parts)
-
-        ps_cmd = f"""
-        Start-Process -FilePath '{remote_agent}' -ArgumentList '{arg_string}' -Wait -NoNewWindow
-        """
-
-        print("🚀 Executing agent remotely on Windows...")
-        print("🧪 PowerShell Command:\n", ps_cmd)
-
-        exec_result = session.run_ps(ps_cmd)
-        print("✅ Remote agent launched.")
-        print("STDOUT:", exec_result.std_out.decode())
-        print("STDERR:", exec_result.std_err.decode())
-
-        # Wait for snapshot file to appear
-        for _ in range(30):
-            check_cmd = f"Test-Path '{remote_snapshot_path}'"
-            poll_result = session.run_ps(check_cmd)
-            if "True" in poll_result.std_out.decode():
-                print("📁 Snapshot file detected.")
-                break
-            time.sleep(1)
-        else:
-            return JSONResponse(content={"error": "Snapshot file not found after waiting."}, status_code=500)
-
-        # Read and base64-encode the snapshot file
-        read_cmd = f"$b = Get-Content -Path '{remote_snapshot_path}' -Raw; [Convert]::ToBase64String([Text.Encoding]::UTF8.GetBytes($b))"
-        read_result = session.run_ps(read_cmd)
-        encoded_data = read_result.std_out.decode().strip()
-
-        if not encoded_data or "Exception" in encoded_data:
-            return JSONResponse(content={"error": "Failed to retrieve snapshot file content."}, status_code=500)
-
-        # Decode and save to local file
-        decoded_bytes = base64.b64decode(encoded_data)
-        local_file_path = SNAPSHOT_DIR / snapshot_filename
-        with open(local_file_path, "wb") as f:
-            f.write(decoded_bytes)
-
-        print(f"✅ Snapshot pulled and saved to: {local_file_path}")
-        return {
-            "status": "success",
-            "message": f"Snapshot from {vm_ip} collected and uploaded!",
-            "vm_hostname": vm_ip
-        }
-
-    except Exception as e:
-        print("❌ FULL EXCEPTION in handle_windows")
-        print(traceback.format_exc())
+        local_path = await run_in_threadpool(collect_windows, SNAPSHOT_DIR, vm_ip, username, password, app_folder, app_type, snapshot_label, snapshot_filename, base_snapshot)
+        await run_in_threadpool(store_collected_snapshot, local_path, host=vm_ip, label=snapshot_label)
+    except (CollectionError, DeltaBaseNotFound) as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
+    return {
+        "status": "success",
+        "message": f"Snapshot from {vm_ip} collected and uploaded!",
+        "vm_hostname": vm_ip
+    }
 
 
         
 # for remote collection Linux and Mac VMs        
-async def handle_ssh_based(vm_ip, username, password, app_folder, app_type, snapshot_label, snapshot_filename):
-    remote_agent_path = CONFIG["agent_paths"]["linux"]
-    snapshot_dir = os.path.dirname(remote_agent_path)
-    remote_snapshot_path = f"{snapshot_dir}/{snapshot_filename}"
-
-    arg_parts = [
-        f'--app-folder "{app_folder}"',
-        f'--app-type {app_type}',
-        f'--output {remote_snapshot_path}'
-    ]
-    if snapshot_label:
-        arg_parts.append(f'--label {snapshot_label}')
-    arg_string = " ".join(arg_parts)
-
+async def handle_ssh_based(vm_ip, username, password, app_folder, app_type, snapshot_label, snapshot_filename, base_snapshot=None):
     try:
-        client = paramiko.SSHClient()
-        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        client.connect(vm_ip, username=username, password=password, look_for_keys=False)
-
-        # Ensure output directory exists
-        client.exec_command(f"mkdir -p {snapshot_dir}")
-
-        # Run agent
-        full_command = f"{remote_agent_path} {arg_string}"
-        print(f"🚀 Executing on Linux/macOS: {full_command}")
-        stdin, stdout, stderr = client.exec_command(full_command)
-        stdout.channel.recv_exit_status()  # Wait for completion
-
-        # Check if file exists
-        for _ in range(30):
-            stdin, stdout, _ = client.exec_command(f"test -f {remote_snapshot_path} && echo EXISTS")
-            if "EXISTS" in stdout.read().decode():
-                print("📁 Snapshot file detected.")
-                break
-            time.sleep(1)
-        else:
-            return JSONResponse(content={"error": "Snapshot not found after waiting."}, status_code=500)
-
-        # Read and transfer file
-        sftp = client.open_sftp()
-        with sftp.open(remote_snapshot_path, 'rb') as remote_file:
-            file_data = remote_file.read()
-
-        local_path = SNAPSHOT_DIR / snapshot_filename
-        with open(local_path, 'wb') as f:
-            f.write(file_data)
-
-        print(f"✅ Snapshot pulled and saved to: {local_path}")
-        return {
-            "status": "success",
-            "message": f"Snapshot from {vm_ip} collected and uploaded!",
-            "vm_hostname": vm_ip
-        }
+        local_path = await run_in_threadpool(collect_ssh_based, SNAPSHOT_DIR, vm_ip, username, password, app_folder, app_type, snapshot_label, snapshot_filename, base_snapshot)
+        await run_in_threadpool(store_collected_snapshot, local_path, host=vm_ip, label=snapshot_label)
+    except (CollectionError, DeltaBaseNotFound) as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+    return {
+        "status": "success",
+        "message": f"Snapshot from {vm_ip} collected and uploaded!",
+        "vm_hostname": vm_ip
+    }
 
-    except Exception as e:
-        print(traceback.format_exc())
-        return JSONResponse(content={"error": f"SSH collection failed: {str(e)}"}, status_code=500)
-    finally:
-        client.close()
+
+# --- Batch Remote Collection API ---
+REMOTE_CONFIG = CONFIG.get("remote_collection", {})
+collection_jobs = CollectionJobManager(
+    SNAPSHOT_DIR,
+    max_workers=REMOTE_CONFIG.get("max_workers", 16),
+    per_os_limits=REMOTE_CONFIG.get("per_os_limits", {}),
+    on_collected=lambda path, spec: store_collected_snapshot(path, host=spec.get("vm_ip"), label=spec.get("label")),
+    resolve_base=lambda spec: delta_base_for(spec.get("vm_ip"), spec.get("app_folder")),
+)
+
+@app.post("/remote_collect_batch")
+async def remote_collect_batch(payload: dict = Body(...)):
+    hosts = payload.get("hosts") or []
+    if not hosts:
+        return JSONResponse(content={"error": "No hosts provided"}, status_code=400)
+
+    job = collection_jobs.submit(hosts, defaults=payload.get("defaults"))
+    print(f"🚀 Batch collection job {job.job_id} queued for {len(hosts)} hosts")
+    return {"job_id": job.job_id, "total": len(hosts)}
+
+@app.get("/connection_pool_stats")
+async def connection_pool_stats():
+    return connection_pool.snapshot_stats()
+
+@app.get("/remote_jobs/{job_id}")
+async def remote_job_status(job_id: str):
+    job = collection_jobs.get(job_id)
+    if not job:
+        return JSONResponse(content={"error": "Job not found"}, status_code=404)
+    return job.to_dict()
 
 
         
         
 @app.get("/list_snapshots")
-async def list_snapshots():
+async def list_snapshots(host: str = None, app_name: str = Query(None, alias="app"), os_name: str = Query(None, alias="os"),
+                         label: str = None, since: str = None, until: str = None, limit: int = None, offset: int = 0):
     try:
-        snapshots = []
-        for file in SNAPSHOT_DIR.glob("*.json"):
-            snapshots.append(file.name)
-        return {"snapshots": snapshots}
+        page = await run_in_threadpool(
+            snapshot_catalog.query,
+            host=host, app=app_name, os=os_name, label=label, since=since, until=until,
+            limit=limit or CATALOG_CONFIG.get("page_size", 500), offset=offset,
+        )
+        return {"snapshots": [item["name"] for item in page["items"]], **page}
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+@app.get("/snapshot_facets")
+async def snapshot_facets():
+    return await run_in_threadpool(snapshot_catalog.facets)
+
+@app.post("/rebuild_catalog")
+async def rebuild_catalog(payload: dict = Body(default={})):
+    return await run_in_threadpool(snapshot_catalog.rebuild, bool(payload.get("full")))
+
+@app.get("/timeline")
+async def host_timeline(host: str, app_name: str = Query(None, alias="app"), since: str = None, until: str = None,
+                        changed_only: bool = False, limit: int = None, offset: int = 0):
+    """A host's snapshots in order, with per-section change counts against the previous one."""
+    return await run_in_threadpool(
+        drift_timeline.timeline, host, app=app_name, since=since, until=until,
+        limit=limit or CATALOG_CONFIG.get("page_size", 500), offset=offset, changed_only=changed_only,
+    )
+
+@app.get("/timeline/changes")
+async def host_timeline_changes(host: str, app_name: str = Query(None, alias="app"), section: str = None,
+                                item: str = None, change: str = None, since: str = None, until: str = None,
+                                limit: int = None, offset: int = 0):
+    """
+    Individual key changes on a host, oldest first. The first change to a file
+    is section=app_folder_files&item=<path>&limit=1; service status flips are
+    section=required_services_status&change=changed.
+    """
+    if change and change not in CHANGE_KINDS:
+        return JSONResponse(content={"error": f"'change' must be one of {', '.join(CHANGE_KINDS)}."}, status_code=400)
+    return await run_in_threadpool(
+        drift_timeline.changes, host, app=app_name, section=section, item=item, change=change,
+        since=since, until=until, limit=limit or CATALOG_CONFIG.get("page_size", 500), offset=offset,
+    )
+
+@app.post("/rebuild_timeline")
+async def rebuild_timeline(payload: dict = Body(default={})):
+    return await run_in_threadpool(drift_timeline.rebuild, bool(payload.get("full")))
+
+@app.get("/search_snapshots")
+async def search_snapshots(file: str = None, sha256: str = None, service: str = None, status: str = None,
+                           variable: str = None, value: str = None, section: str = None, item: str = None,
+                           host: str = None, app_name: str = Query(None, alias="app"), limit: int = None, offset: int = 0):
+    """
+    Snapshots containing a file (file=widevinecdm.dll, optionally &sha256=...),
+    a service state (service=W3SVC&status=Stopped), an environment variable
+    value (variable=APP_ENV&value=staging) or any raw section/item/value,
+    newest first, with the matching entries.
+    """
+    try:
+        query = term_query(file, sha256, service, status, variable, value, section, item)
+        return await run_in_threadpool(
+            snapshot_index.search, **query, host=host, app=app_name,
+            limit=limit or CATALOG_CONFIG.get("page_size", 500), offset=offset,
+        )
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+
+@app.post("/rebuild_index")
+async def rebuild_index(payload: dict = Body(default={})):
+    return await run_in_threadpool(snapshot_index.rebuild, bool(payload.get("full")), INDEX_CONFIG.get("max_workers"))
+
+@app.get("/index_stats")
+async def index_stats():
+    return await run_in_threadpool(snapshot_index.stats)
+
+
+def snapshot_response(filename, as_attachment):
+    try:
+        file_path = snapshot_cache.resolve(filename)
+    except SnapshotNotFound:
+        return JSONResponse(content={"error": "File not found."}, status_code=404)
+    # Stored snapshots may be section manifests; stream the reassembled JSON.
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'} if as_attachment else None
+    return StreamingResponse(iter_snapshot_json(file_path), media_type="application/json", headers=headers)
 
 @app.get("/download_snapshot/{filename}")
 async def download_snapshot(filename: str):
-    file_path = SNAPSHOT_DIR / filename
-    if file_path.exists():
-        return FileResponse(file_path, filename=filename, media_type='application/json')
-    else:
-        return JSONResponse(content={"error": "File not found."}, status_code=404)
+    return snapshot_response(filename, as_attachment=True)
+
+@app.get("/snapshots/{filename}")
+async def view_snapshot(filename: str):
+    return snapshot_response(filename, as_attachment=False)
+
+@app.get("/storage_stats")
+async def storage_stats():
+    return await run_in_threadpool(snapshot_store.stats)
+
+@app.post("/storage_gc")
+async def storage_gc():
+    return await run_in_threadpool(snapshot_store.collect_garbage)
         
 @app.delete("/delete_snapshot/{filename}")
 async def delete_snapshot(filename: str):
     file_path = SNAPSHOT_DIR / filename
     try:
         if file_path.exists():
-            file_path.unlink()
+            # Deltas based on this snapshot are rewritten in full first.
+            rebased = await run_in_threadpool(snapshot_store.delete, file_path)
+            for name in [filename, *rebased]:
+                snapshot_cache.evict(name)
+            snapshot_catalog.remove(filename)
+            await run_in_threadpool(drift_timeline.remove, filename)
+            await run_in_threadpool(snapshot_index.remove, filename)
+            for name in rebased:
+                await run_in_threadpool(snapshot_index.record, name)
             return {"message": f"Snapshot '{filename}' deleted successfully."}
         else:
             return JSONResponse(content={"error": "File not found."}, status_code=404)
@@ -518,6 +846,24 @@ async def flag_feedback(payload: dict = Body(...)):
         print("Feedback error:", e)
         return {"error": str(e)}
         
+# --- OCR (bounded worker pool, preprocessing, cache by image hash) ---
+OCR_CONFIG = CONFIG.get("ocr", {})
+ocr_service = OCRService(
+    max_workers=OCR_CONFIG.get("max_workers"),
+    executor=OCR_CONFIG.get("executor", "thread"),
+    max_queue=OCR_CONFIG.get("max_queue", 32),
+    cache_entries=OCR_CONFIG.get("cache_entries", 256),
+    options=OCR_CONFIG.get("preprocess"),
+)
+
+@app.on_event("shutdown")
+async def stop_ocr_pool():
+    ocr_service.shutdown()
+
+@app.get("/ocr_stats")
+async def ocr_stats():
+    return ocr_service.stats()
+
 @app.post("/ocr")
 async def ocr_image(payload: dict = Body(...)):
     base64_image = payload.get("base64_image")
@@ -525,23 +871,54 @@ async def ocr_image(payload: dict = Body(...)):
         return JSONResponse(status_code=400, content={"error": "No image provided"})
 
     try:
-        image_data = base64.b64decode(base64_image.split(",")[-1])
-        image = Image.open(io.BytesIO(image_data))
-        raw_text = pytesseract.image_to_string(image)
-        cleaned_text = clean_ocr_text(raw_text)
-        return {"text": cleaned_text}
+        return {"text": await ocr_service.extract_text(decode_image_payload(base64_image))}
+    except OCRBusy as e:
+        return JSONResponse(status_code=503, content={"error": f"OCR is busy, try again shortly ({e})"})
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
     except Exception as e:
         print("❌ OCR error:", e)
         return JSONResponse(status_code=500, content={"error": "OCR processing failed"})
         
         
+# --- Log index (error blocks per log path, updated from the appended bytes only) ---
+LOG_INDEX_CONFIG = CONFIG.get("log_index", {})
+log_index = LogIndex(
+    BASE_DIR / LOG_INDEX_CONFIG.get("db_file", "log_index.sqlite3"),
+    max_blocks=LOG_INDEX_CONFIG.get("max_blocks", 200),
+    initial_tail_lines=LOG_INDEX_CONFIG.get("initial_tail_lines", 200000),
+    chunk_bytes=LOG_INDEX_CONFIG.get("chunk_bytes", 8 * 1024 * 1024),
+    max_memory_entries=LOG_INDEX_CONFIG.get("max_memory_entries", 64),
+) if LOG_INDEX_CONFIG.get("enabled", True) else None
+
+def extract_log_blocks(path, max_blocks=30):
+    """The newest unique error blocks of a log, from the log index (or a full re-read if it's off)."""
+    if log_index is not None:
+        try:
+            return log_index.extract(path, max_blocks=max_blocks)
+        except Exception as e:
+            print(f"⚠️ Error indexing log file at {path}, re-reading it instead: {e}")
+    return extract_important_log_blocks(read_log_file_safely(path), max_blocks=max_blocks)
+
+@app.get("/log_index_stats")
+async def log_index_stats():
+    if log_index is None:
+        return {"enabled": False}
+    return {"enabled": True, **log_index.stats()}
+
 @app.post("/read_log")
 async def read_log_endpoint(payload: dict = Body(...)):
+    """
+    The tail of a log, or with "blocks": true only its newest unique error
+    blocks ("max_blocks", default 30), parsed incrementally by the log index.
+    """
     path = payload.get("path")
     if not path:
         return JSONResponse(status_code=400, content={"error": "No log path provided"})
 
     try:
+        if payload.get("blocks"):
+            return {"content": await run_in_threadpool(extract_log_blocks, path, payload.get("max_blocks", 30))}
         log_content = read_log_file_safely(path)
         return {"content": log_content}
     except Exception as e:
@@ -551,71 +928,29 @@ async def read_log_endpoint(payload: dict = Body(...)):
 
         
 # --- Utilities ---
-def read_log_file_safely(path, max_lines=200000):
+def read_log_file_safely(path, max_lines=200000, max_bytes=None):
     """
     Safely reads the last `max_lines` from a log file to avoid memory overload.
+    The file is read backwards from the end, so memory use depends on the size
+    of the tail only. Gzip-rotated logs (e.g. app.log.1.gz) are supported.
     
     Args:
         path (str): Path to the log file.
         max_lines (int): Number of lines to read from the end (default 200k).
+        max_bytes (int): Optional cap on the number of bytes returned.
 
     Returns:
         str: A string of the last N lines of the log.
     """
     try:
-        with open(path, "r", encoding="utf-8", errors="ignore") as f:
-            lines = f.readlines()
-            return ''.join(lines[-max_lines:])
+        return read_tail(path, max_lines=max_lines, max_bytes=max_bytes)
     except Exception as e:
         print(f"⚠️ Error reading log file at {path}: {e}")
         return ""
 
 
-def normalize_log_block(block):
-    # Remove timestamps and join for deduplication
-    clean = re.sub(r'\d{4}-\d{2}-\d{2}[\sT]\d{2}:\d{2}:\d{2}(?:[,\.]\d+)?', '', block)
-    clean = re.sub(r'\d{2}:\d{2}:\d{2}(?:[,\.]\d+)?', '', clean)
-    return clean.strip()
-
-def extract_important_log_blocks(log_text, keywords=None, max_blocks=30):
-    """
-    Extracts important log blocks, including multi-line stack traces,
-    filters by keyword, deduplicates by content (ignoring timestamps),
-    and limits output to the latest N unique blocks.
-    """
-    keywords = keywords or ['ERROR', 'Exception', 'Traceback', 'CRITICAL', 'Failed', 'Caused by']
-    lines = log_text.splitlines()
-
-    blocks = []
-    current_block = []
-    seen = set()
-
-    def commit_block():
-        if current_block:
-            full_block = "\n".join(current_block).strip()
-            norm = normalize_log_block(full_block)
-            if norm not in seen:
-                seen.add(norm)
-                blocks.append(full_block)
-            current_block.clear()
-
-    for line in lines:
-        if any(k in line for k in keywords):
-            commit_block()  # Save previous block before starting new one
-            current_block.append(line)
-        elif current_block and (line.startswith(" ") or line.startswith("\t") or line.strip() == ""):
-            # Likely a stack trace or continuation
-            current_block.append(line)
-        else:
-            commit_block()
-
-    commit_block()  # Final block
-
-    return "\n\n---\n\n".join(blocks[-max_blocks:])
-
 def estimate_token_count(text):
-    enc = get_encoding("cl100k_base")
-    return len(enc.encode(text))
+    return count_tokens(text)
 
 def read_log_file(path):
     try:
@@ -627,56 +962,99 @@ def read_log_file(path):
     return ""
 
 
-def extract_text_from_screenshot(base64_image):
+async def extract_text_from_screenshot(base64_image):
     try:
-        image_data = base64.b64decode(base64_image.split(",")[-1])
-        image = Image.open(io.BytesIO(image_data))
-        raw_text = pytesseract.image_to_string(image)
-        cleaned_text = clean_ocr_text(raw_text)
-        return cleaned_text
+        return await ocr_service.extract_text(decode_image_payload(base64_image))
     except Exception as e:
         print("Error extracting text from screenshot:", e)
         return ""
-        
-def clean_ocr_text(text):
-    # Normalize Unicode (e.g., accented characters)
-    text = unicodedata.normalize("NFKD", text)
-
-    # Remove non-printable characters (keep ASCII)
-    text = re.sub(r'[^\x20-\x7E]+', '', text)
-
-    # Collapse multiple spaces, remove leading/trailing whitespace
-    text = re.sub(r'\s+', ' ', text).strip()
-
-    return text
     
-def generate_initial_prompt(payload):
-    diff = payload.get("diff", {})
-    error_message = payload.get("error_message", "")
-    screenshot_text = payload.get("error_screenshot_text", "")
-    log_content = payload.get("log_content", "")
+# --- Diff digest: noise rules, severity ranking, directory collapsing ---
+DIFF_DIGEST_CONFIG = CONFIG.get("diff_digest", {})
+diff_digest_rules = DigestRules.from_config(DIFF_DIGEST_CONFIG)
+
+def prompt_diff(diff):
+    """The diff as it goes into the prompt: a DiffDigest, unless the digest is off or the diff isn't a report."""
+    if not DIFF_DIGEST_CONFIG.get("enabled", True) or not isinstance(diff, dict):
+        return diff
+    try:
+        return digest_report(diff, diff_digest_rules)
+    except (ValueError, SyntaxError) as e:
+        print(f"⚠️ Could not digest diff, sending it as is: {e}")
+        return diff
 
-    return f"""
+INITIAL_PROMPT_TEMPLATE = """
 You are an expert in diagnosing system and application configuration issues.
 
 Analyze the following:
-- DeepDiff data: {json.dumps(diff, indent=2)}
-- Error message (if any): {error_message or 'None'}
-- OCR from screenshot (if any): {screenshot_text or 'None'}
-- Relevant logs (if any): {log_content or 'None'}
-
+- {diff_label}: {diff_text}
+- Error message (if any): {error_message}
+- OCR from screenshot (if any): {screenshot_text}
+- Relevant logs (if any): {log_content}
+{notes}
 Please summarize what might have gone wrong, and guide what else should be collected if not enough information is available.
 """
 
+def prompt_version(budget=None):
+    """Hash of what shapes an initial prompt besides its inputs: the template, digest rules and token budget."""
+    budget = ai_prompt_budget() if budget is None else budget
+    canonical = json.dumps([INITIAL_PROMPT_TEMPLATE, DIFF_DIGEST_CONFIG, budget], sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def generate_initial_prompt(payload, budget=None):
+    """
+    Build the first diagnosis prompt. Inputs are packed into `budget` tokens
+    (default: the configured vendor's context budget), most relevant first;
+    the diff goes in as a ranked digest (see diff_digest.py).
+    """
+    if budget is None:
+        budget = ai_prompt_budget()
+    raw_diff = payload.get("diff", {})
+    diff = prompt_diff(raw_diff)
+    digested = diff is not raw_diff
+    packed = pack_prompt_inputs({
+        "diff": diff,
+        "error_message": payload.get("error_message", ""),
+        "screenshot_text": payload.get("error_screenshot_text", ""),
+        "log_content": payload.get("log_content", ""),
+    }, budget)
+    diff_text = "\n" + packed["diff"] if digested else json.dumps(packed["diff"], indent=2)
+    error_message = packed["error_message"]
+    screenshot_text = packed["screenshot_text"]
+    log_content = packed["log_content"]
+
+    omitted = packed["omitted"]
+    notes = ""
+    if omitted.get("diff"):
+        notes += f"\n[{omitted['diff']} lower-priority diff entries omitted to fit the context budget]"
+    if omitted.get("log_content"):
+        notes += f"\n[{omitted['log_content']} older log blocks omitted to fit the context budget]"
+
+    return INITIAL_PROMPT_TEMPLATE.format(
+        diff_label="Snapshot differences, most severe first" if digested else "DeepDiff data",
+        diff_text=diff_text,
+        error_message=error_message or "None",
+        screenshot_text=screenshot_text or "None",
+        log_content=log_content or "None",
+        notes=notes,
+    )
+
+# --- Follow-up context: cached initial prompt, recent turns, background summary ---
+CONVERSATION_CONFIG = CONFIG.get("conversation", {})
+conversation = ConversationContext(
+    sessions,
+    generate_initial_prompt,
+    ai_router.send,
+    ai_prompt_budget(),
+    window_turns=CONVERSATION_CONFIG.get("window_turns", 6),
+    initial_share=CONVERSATION_CONFIG.get("initial_share", 0.5),
+    summarize_after_tokens=CONVERSATION_CONFIG.get("summarize_after_tokens", 1500),
+    summary_tokens=CONVERSATION_CONFIG.get("summary_tokens", 400),
+    cache_entries=CONVERSATION_CONFIG.get("initial_prompt_cache_entries", 128),
+)
+
 def compile_session_prompt(session):
-    messages = [
-        {"role": "system", "content": "You are a highly skilled IT troubleshooting assistant helping diagnose configuration issues across systems."},
-        {"role": "user", "content": generate_initial_prompt(session.initial_input)}
-    ]
-    for ai_msg, user_msg in zip(session.ai_messages, session.user_followups):
-        messages.append({"role": "assistant", "content": ai_msg["content"]})
-        messages.append({"role": "user", "content": user_msg["content"]})
-    return messages
+    return conversation.build(session)
     
 """
 def call_openai_with_prompt(messages):
@@ -0,0 +1,345 @@
+"""
+Columnar, array-backed form of a snapshot's `app_folder_files`.
+
+As plain dicts, a snapshot's file map takes up most of its memory. Each file
+costs a dict plus three more objects: the 64-character sha256 string, the
+size and the RFC 3339 `modified` string. FileTable keeps the same data in a
+handful of flat buffers instead:
+
+- the paths, sorted and interned (so cached tables of the same host share them),
+- the sha256 digests as raw 32-byte values in one bytes buffer,
+- the sizes, the modification times (epoch seconds) and their UTC offsets
+  (minutes) in typed arrays.
+
+That is several times smaller than the dicts.
+
+Some entries don't fit that shape exactly: an "error: ..." hash, a missing or
+extra field, a timestamp that wouldn't render back to the same string, or the
+agent's `error` entry. Those are kept as they were. The original path order
+is recorded when it isn't sorted. So iterating the table, or calling
+to_dict(), gives back exactly the mapping it was built from, down to key
+order. JSON written from it is byte-identical.
+
+FileTable is a read-only Mapping, so code written for the dict keeps working.
+diff_rows() compares two tables by walking both in path order (a sorted
+merge), comparing whole runs of rows at once and skipping the identical ones.
+"""
+import re
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from datetime import datetime, timedelta, timezone
+
+SECTIONED_KEY = "environment_context"
+FILES_KEY = "app_folder_files"
+# The agent's entry keys, in the (sorted) order it writes them
+ENTRY_FIELDS = ("modified", "sha256", "size_bytes")
+DIGEST_BYTES = 32
+# Longest run of paths diff_rows() tries to align at once
+BLOCK_ROWS = 256
+
+_RFC3339 = re.compile(r"(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:Z|([+-])(\d\d):(\d\d))\Z")
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MINUTE = timedelta(minutes=1)
+_INT64 = (-(1 << 63), 1 << 63)
+_ZERO_DIGEST = bytes(DIGEST_BYTES)
+_IRREGULAR = object()
+
+
+def parse_modified(value):
+    """
+    (epoch seconds, UTC offset in minutes) of an RFC 3339 timestamp as the
+    agent writes it, or None if format_modified() wouldn't render it back
+    to exactly `value`.
+    """
+    match = _RFC3339.match(value) if isinstance(value, str) else None
+    if match is None or value.endswith(("+00:00", "-00:00")):  # those render as "Z"
+        return None
+    try:
+        parsed = datetime.fromisoformat(value[:-1] + "+00:00" if value[-1] == "Z" else value)
+    except ValueError:  # e.g. February 30th
+        return None
+    return int(parsed.timestamp()), parsed.utcoffset() // _MINUTE
+
+
+def format_modified(epoch, offset):
+    """Render parse_modified()'s output back to the RFC 3339 string."""
+    local = _EPOCH + timedelta(seconds=epoch + offset * 60)
+    text = (f"{local.year:04d}-{local.month:02d}-{local.day:02d}"
+            f"T{local.hour:02d}:{local.minute:02d}:{local.second:02d}")
+    if not offset:
+        return text + "Z"
+    sign = "-" if offset < 0 else "+"
+    return f"{text}{sign}{abs(offset) // 60:02d}:{abs(offset) % 60:02d}"
+
+
+def _pack(entry, parsed_times):
+    """
+    (digest, size, epoch, offset) for a regular entry, else None.
+    `parsed_times` memoizes parse_modified(); files often share a timestamp.
+    """
+    if type(entry) is not dict or tuple(entry) != ENTRY_FIELDS:
+        return None
+    sha256, size = entry["sha256"], entry["size_bytes"]
+    if type(size) is not int or not _INT64[0] <= size < _INT64[1]:
+        return None
+    if type(sha256) is not str or len(sha256) != 2 * DIGEST_BYTES:
+        return None
+    try:
+        digest = bytes.fromhex(sha256)
+    except ValueError:
+        return None
+    if digest.hex() != sha256:  # upper case or embedded whitespace
+        return None
+    modified = parsed_times.get(entry["modified"], _IRREGULAR) if type(entry["modified"]) is str else None
+    if modified is _IRREGULAR:
+        modified = parsed_times[entry["modified"]] = parse_modified(entry["modified"])
+    if modified is None:
+        return None
+    return digest, size, *modified
+
+
+class FileTable(Mapping):
+    """Read-only {path: entry} mapping backed by columns; see the module docstring."""
+
+    __slots__ = ("paths", "digests", "sizes", "mtimes", "offsets", "order", "extras", "extra_rows")
+
+    def __init__(self, paths, digests, sizes, mtimes, offsets, order=None, extras=None):
+        self.paths = paths        # sorted list of interned str
+        self.digests = digests    # bytes, DIGEST_BYTES per row
+        self.sizes = sizes        # array('q')
+        self.mtimes = mtimes      # array('q'), epoch seconds
+        self.offsets = offsets    # array('h'), UTC offset in minutes
+        self.order = order        # array('L') of rows in original order, or None if that is sorted
+        self.extras = extras or {}  # row -> entry kept as is
+        self.extra_rows = sorted(self.extras)
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Build a table from (path, entry) pairs in their original order, e.g.
+        a dict's items() or entries streaming out of a parser. Each entry is
+        packed as it arrives, so only the columns are held.
+        """
+        paths, digests = [], bytearray()
+        sizes, mtimes, offsets = array("q"), array("q"), array("h")
+        extras, parsed_times = {}, {}
+        intern = sys.intern
+        for path, entry in items:
+            packed = _pack(entry, parsed_times)
+            if packed is None:
+                extras[len(paths)] = entry
+                packed = (_ZERO_DIGEST, 0, 0, 0)
+            paths.append(intern(path))
+            digests += packed[0]
+            sizes.append(packed[1])
+            mtimes.append(packed[2])
+            offsets.append(packed[3])
+
+        if all(a < b for a, b in zip(paths, paths[1:])):
+            return cls(paths, bytes(digests), sizes, mtimes, offsets, None, extras)
+
+        rows = sorted(range(len(paths)), key=paths.__getitem__)
+        if any(paths[a] == paths[b] for a, b in zip(rows, rows[1:])):
+            # Repeated keys (only possible from a raw stream): the last value
+            # wins at the first position, as with json.loads.
+            merged = {}
+            for row, path in enumerate(paths):
+                merged[path] = extras[row] if row in extras else cls._entry_from(
+                    digests[row * DIGEST_BYTES:(row + 1) * DIGEST_BYTES], sizes[row], mtimes[row], offsets[row])
+            return cls.from_items(merged.items())
+
+        order = array("L", [0]) * len(rows)
+        for sorted_row, row in enumerate(rows):
+            order[row] = sorted_row
+        return cls(
+            [paths[row] for row in rows],
+            b"".join(digests[row * DIGEST_BYTES:(row + 1) * DIGEST_BYTES] for row in rows),
+            array("q", (sizes[row] for row in rows)),
+            array("q", (mtimes[row] for row in rows)),
+            array("h", (offsets[row] for row in rows)),
+            order,
+            {order[row]: entry for row, entry in extras.items()},
+        )
+
+    @classmethod
+    def from_mapping(cls, files):
+        return cls.from_items(files.items())
+
+    @staticmethod
+    def _entry_from(digest, size, mtime, offset):
+        return {"modified": format_modified(mtime, offset), "sha256": digest.hex(), "size_bytes": size}
+
+    def entry(self, row):
+        """The entry dict at `row` (a position in sorted path order)."""
+        extra = self.extras.get(row, _IRREGULAR)
+        if extra is not _IRREGULAR:
+            return extra
+        start = row * DIGEST_BYTES
+        return self._entry_from(self.digests[start:start + DIGEST_BYTES], self.sizes[row],
+                                self.mtimes[row], self.offsets[row])
+
+    def row_of(self, path):
+        """Row of `path`, or -1."""
+        row = bisect_left(self.paths, path) if isinstance(path, str) else len(self.paths)
+        return row if row < len(self.paths) and self.paths[row] == path else -1
+
+    def rows(self):
+        """Rows in the original order."""
+        return range(len(self.paths)) if self.order is None else self.order
+
+    def __getitem__(self, path):
+        row = self.row_of(path)
+        if row < 0:
+            raise KeyError(path)
+        return self.entry(row)
+
+    def __contains__(self, path):
+        return self.row_of(path) >= 0
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __iter__(self):
+        if self.order is None:
+            return iter(self.paths)
+        return (self.paths[row] for row in self.order)
+
+    def items(self):
+        """(path, entry) pairs in the original order (entries are built on the fly)."""
+        return ((self.paths[row], self.entry(row)) for row in self.rows())
+
+    def values(self):
+        return (self.entry(row) for row in self.rows())
+
+    def digest_items(self):
+        """
+        (path, sha256) per file in the original order, without building the
+        entries. An irregular entry gives its own "sha256" value, or itself
+        if it isn't a dict.
+        """
+        for row in self.rows():
+            extra = self.extras.get(row, _IRREGULAR)
+            if extra is _IRREGULAR:
+                yield self.paths[row], self.digests[row * DIGEST_BYTES:(row + 1) * DIGEST_BYTES].hex()
+            else:
+                yield self.paths[row], extra.get("sha256") if isinstance(extra, dict) else extra
+
+    def to_dict(self):
+        """The app_folder_files dict this table was built from."""
+        return dict(self.items())
+
+    def same_row(self, row, other, other_row):
+        """True if `row` here and `other_row` in `other` hold equal entries."""
+        if row in self.extras or other_row in other.extras:
+            return self.entry(row) == other.entry(other_row)
+        start, other_start = row * DIGEST_BYTES, other_row * DIGEST_BYTES
+        return (self.sizes[row] == other.sizes[other_row]
+                and self.mtimes[row] == other.mtimes[other_row]
+                and self.offsets[row] == other.offsets[other_row]
+                and self.digests[start:start + DIGEST_BYTES] == other.digests[other_start:other_start + DIGEST_BYTES])
+
+    def __eq__(self, other):
+        if isinstance(other, FileTable):
+            return self.paths == other.paths and next(diff_rows(self, other), None) is None
+        return super().__eq__(other)
+
+    __hash__ = None
+
+    def nbytes(self):
+        """Approximate memory held by the table (paths counted once even if shared)."""
+        return (sys.getsizeof(self.paths) + sum(sys.getsizeof(p) for p in self.paths)
+                + sys.getsizeof(self.digests) + sum(a.itemsize * len(a) for a in (self.sizes, self.mtimes, self.offsets))
+                + (self.order.itemsize * len(self.order) if self.order is not None else 0)
+                + sys.getsizeof(self.extras))
+
+    def __repr__(self):
+        return f"<FileTable {len(self)} files>"
+
+
+def _has_extras(table, start, end):
+    rows = table.extra_rows
+    index = bisect_left(rows, start)
+    return index < len(rows) and rows[index] < end
+
+
+def _values_equal(old, new, i, j, count):
+    """True if rows old[i:i+count] and new[j:j+count] (same paths) hold equal regular entries."""
+    if (old.extra_rows and _has_extras(old, i, i + count)) or (new.extra_rows and _has_extras(new, j, j + count)):
+        return False
+    return (old.digests[i * DIGEST_BYTES:(i + count) * DIGEST_BYTES]
+            == new.digests[j * DIGEST_BYTES:(j + count) * DIGEST_BYTES]
+            and old.sizes[i:i + count] == new.sizes[j:j + count]
+            and old.mtimes[i:i + count] == new.mtimes[j:j + count]
+            and old.offsets[i:i + count] == new.offsets[j:j + count])
+
+
+def _changed_rows(old, new, i, j, count):
+    """(path, old row, new row) for the rows that differ in aligned runs, halving down to them."""
+    if _values_equal(old, new, i, j, count):
+        return
+    if count <= 8:
+        for k in range(count):
+            if not old.same_row(i + k, new, j + k):
+                yield old.paths[i + k], i + k, j + k
+        return
+    half = count // 2
+    yield from _changed_rows(old, new, i, j, half)
+    yield from _changed_rows(old, new, i + half, j + half, count - half)
+
+
+def diff_rows(old, new):
+    """
+    Yield (path, old row, new row) for every path whose entry differs between
+    two tables, in path order. A row is None where the path is absent.
+
+    Runs of the same paths in both tables are compared a block at a time and
+    split in half only where they differ, so the cost follows the number of
+    changes rather than the number of files.
+    """
+    old_paths, new_paths = old.paths, new.paths
+    if old_paths == new_paths:  # same file set, the usual case
+        yield from _changed_rows(old, new, 0, 0, len(old_paths))
+        return
+
+    i = j = 0
+    run = BLOCK_ROWS
+    while i < len(old_paths) and j < len(new_paths):
+        # Gallop: try twice the last aligned run, halving until the paths match.
+        count = min(run, len(old_paths) - i, len(new_paths) - j)
+        while count and old_paths[i:i + count] != new_paths[j:j + count]:
+            count //= 2
+        if count:
+            yield from _changed_rows(old, new, i, j, count)
+            i += count
+            j += count
+            run = min(2 * count, BLOCK_ROWS)
+            continue
+        run = BLOCK_ROWS
+        if old_paths[i] < new_paths[j]:
+            yield old_paths[i], i, None
+            i += 1
+        else:
+            yield new_paths[j], None, j
+            j += 1
+    for i in range(i, len(old_paths)):
+        yield old_paths[i], i, None
+    for j in range(j, len(new_paths)):
+        yield new_paths[j], None, j
+
+
+def compact_snapshot(snapshot):
+    """Replace a snapshot dict's app_folder_files dict with a FileTable, in place; returns the snapshot."""
+    context = snapshot.get(SECTIONED_KEY) if isinstance(snapshot, dict) else None
+    if isinstance(context, dict) and type(context.get(FILES_KEY)) is dict:
+        context[FILES_KEY] = FileTable.from_mapping(context[FILES_KEY])
+    return snapshot
+
+
+def expand_snapshot(snapshot):
+    """The inverse of compact_snapshot(), on a shallow copy."""
+    context = snapshot.get(SECTIONED_KEY) if isinstance(snapshot, dict) else None
+    if isinstance(context, dict) and isinstance(context.get(FILES_KEY), FileTable):
+        return {**snapshot, SECTIONED_KEY: {**context, FILES_KEY: context[FILES_KEY].to_dict()}}
+    return snapshot
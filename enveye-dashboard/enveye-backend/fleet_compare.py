@@ -0,0 +1,234 @@
+"""
+N-way comparison of many stored snapshots against one baseline.
+
+Each snapshot's environment context is flattened to {key: value}: one key per
+file in `app_folder_files` (value: its sha256) and one per leaf of the other
+sections. Hosts are then diffed against either a baseline snapshot or the
+per-key majority value across the fleet.
+
+Snapshots in the sectioned store are first grouped by their section digests,
+read from the manifests alone: hosts with byte-identical environment contexts
+(usually most of a healthy fleet) are loaded and diffed once. The distinct
+contexts are loaded and diffed in a process pool.
+
+Hosts whose drift is identical (same keys with the same values) share a
+drift signature and are reported together, so the result is a compact
+matrix: the drifted keys once, the baseline value per key once, and per
+group the hosts plus their (key index, value) pairs.
+
+A value of None in a drift means the key is absent on those hosts.
+"""
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from file_table import FileTable
+from snapshot_diff import FILES_SECTION, format_key
+from snapshot_store import MANIFEST_FORMAT, load_snapshot, read_manifest
+
+# Below this many snapshots a process pool costs more than it saves.
+PARALLEL_THRESHOLD = 8
+
+
+class FrozenDict(tuple):
+    """
+    A dict leaf as a hashable tuple of its sorted items. Never equal to a
+    plain tuple (a frozen list), so [["a", 1]] and {"a": 1} stay apart.
+    """
+
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return isinstance(other, FrozenDict) and tuple.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(("FrozenDict", tuple(self)))
+
+
+def _leaf(value):
+    # Lists and other unhashable leaves are compared as whole values.
+    if isinstance(value, list):
+        return tuple(_leaf(v) for v in value)
+    if isinstance(value, dict):
+        return FrozenDict(sorted((k, _leaf(v)) for k, v in value.items()))
+    return value
+
+
+def _flatten_into(flat, value, parts):
+    if isinstance(value, dict) and value:
+        for key, child in value.items():
+            _flatten_into(flat, child, parts + (key,))
+    else:
+        flat[parts] = _leaf(value)
+
+
+def flatten_snapshot(snapshot):
+    """{key parts tuple: comparable value} for one snapshot's environment context."""
+    return flatten_context(snapshot.get("environment_context") or {})
+
+
+def flatten_context(context):
+    """flatten_snapshot() for an environment_context dict (or any subset of its sections)."""
+    flat = {}
+    for section, value in context.items():
+        if section == FILES_SECTION and isinstance(value, FileTable):
+            for path, sha256 in value.digest_items():
+                flat[(section, path)] = _leaf(sha256)
+        elif section == FILES_SECTION and isinstance(value, dict):
+            for path, entry in value.items():
+                flat[(section, path)] = entry.get("sha256") if isinstance(entry, dict) else _leaf(entry)
+        else:
+            _flatten_into(flat, value, (section,))
+    return flat
+
+
+def render_key(parts):
+    return "root" + "".join(format_key(part) for part in parts)
+
+
+def render_value(value):
+    """A flattened value back in its JSON shape."""
+    if isinstance(value, FrozenDict):
+        return {k: render_value(v) for k, v in value}
+    if isinstance(value, tuple):
+        return [render_value(v) for v in value]
+    return value
+
+
+_ABSENT = object()
+
+
+def drift_from(flat, baseline):
+    """Keys where `flat` differs from `baseline`, with this host's value (None = absent)."""
+    drift = {key: value for key, value in flat.items() if baseline.get(key, _ABSENT) != value}
+    for key in baseline.keys() - flat.keys():
+        drift[key] = None
+    return drift
+
+
+_worker_baseline = None
+
+
+def _init_worker(baseline):
+    global _worker_baseline
+    _worker_baseline = baseline
+
+
+def _drift_task(path):
+    return drift_from(flatten_snapshot(load_snapshot(path, compact=True)), _worker_baseline)
+
+
+def _count_task(weighted_paths):
+    counts = Counter()
+    for path, weight in weighted_paths:
+        for item in flatten_snapshot(load_snapshot(path, compact=True)).items():
+            counts[item] += weight
+    return counts
+
+
+def content_key(path):
+    """
+    Identity of a stored snapshot's environment context, without loading it:
+    its section digests if it is a sectioned manifest, otherwise its path.
+    """
+    manifest = read_manifest(path)
+    if manifest and manifest["format"] == MANIFEST_FORMAT and manifest["sectioned"]:
+        return tuple((key, kind, digest) for key, kind, digest, _ in manifest["sections"])
+    return str(path)
+
+
+def group_by_content(paths):
+    """{representative path: [paths with the same environment context]}"""
+    groups = {}
+    for path in paths:
+        groups.setdefault(content_key(path), []).append(path)
+    return {members[0]: members for members in groups.values()}
+
+
+def _chunks(items, n):
+    size = max(1, -(-len(items) // n))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def majority_baseline(paths, max_workers=None, groups=None):
+    """Per key, the value most hosts have (keys most hosts lack are left out)."""
+    groups = groups or group_by_content(paths)
+    weighted = [(path, len(members)) for path, members in groups.items()]
+    workers = max_workers or os.cpu_count() or 1
+    if len(weighted) < PARALLEL_THRESHOLD or workers == 1:
+        counts = _count_task(weighted)
+    else:
+        counts = Counter()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for partial in pool.map(_count_task, _chunks(weighted, workers * 4)):
+                counts.update(partial)
+
+    best, present = {}, Counter()
+    for (key, value), count in counts.items():
+        present[key] += count
+        if count > best.get(key, (None, 0))[1]:
+            best[key] = (value, count)
+    # A key most hosts lack is absent from the majority baseline.
+    return {key: value for key, (value, count) in best.items() if count >= len(paths) - present[key]}
+
+
+def compare_fleet(paths, baseline_path=None, max_workers=None):
+    """
+    Diff every snapshot in `paths` against `baseline_path`, or against the
+    fleet majority when no baseline is given, and group hosts by drift.
+    """
+    paths = [Path(p) for p in paths]
+    content_groups = group_by_content(paths)
+    if baseline_path is not None:
+        baseline = flatten_snapshot(load_snapshot(baseline_path, compact=True))
+        baseline_name = Path(baseline_path).name
+    else:
+        baseline = majority_baseline(paths, max_workers, content_groups)
+        baseline_name = None
+
+    representatives = list(content_groups)
+    workers = max_workers or os.cpu_count() or 1
+    if len(representatives) < PARALLEL_THRESHOLD or workers == 1:
+        drifts = [drift_from(flatten_snapshot(load_snapshot(p, compact=True)), baseline) for p in representatives]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(baseline,)) as pool:
+            drifts = list(pool.map(_drift_task, representatives,
+                                   chunksize=max(1, len(representatives) // (workers * 4))))
+
+    groups = {}
+    key_counts = Counter()
+    for representative, drift in zip(representatives, drifts):
+        members = content_groups[representative]
+        signature = frozenset(drift.items())
+        groups.setdefault(signature, []).extend(path.name for path in members)
+        for key in drift:
+            key_counts[key] += len(members)
+
+    keys = sorted(key_counts, key=lambda k: (-key_counts[k], render_key(k)))
+    index = {key: i for i, key in enumerate(keys)}
+    in_sync = groups.pop(frozenset(), [])
+    group_list = sorted(
+        (
+            {
+                "hosts": sorted(hosts),
+                "count": len(hosts),
+                "drift": sorted(([index[key], render_value(value)] for key, value in signature), key=lambda d: d[0]),
+            }
+            for signature, hosts in groups.items()
+        ),
+        key=lambda g: (-g["count"], g["hosts"][0]),
+    )
+    return {
+        "baseline": baseline_name or "majority",
+        "total": len(paths),
+        "in_sync": sorted(in_sync),
+        "drifted": len(paths) - len(in_sync),
+        "keys": [render_key(key) for key in keys],
+        "key_counts": [key_counts[key] for key in keys],
+        "baseline_values": [render_value(baseline.get(key)) for key in keys],
+        "groups": group_list,
+    }
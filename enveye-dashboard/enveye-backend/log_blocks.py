@@ -0,0 +1,173 @@
+"""
+Streaming extraction of important blocks (errors, stack traces) from logs.
+
+Lines are consumed one at a time from any iterable, all keywords are matched
+with a single precompiled alternation, blocks are deduplicated on a hash of
+their normalized text, and only the newest `max_blocks` unique blocks are kept.
+"""
+import hashlib
+import re
+from collections import deque
+
+from log_reader import iter_lines
+
+DEFAULT_KEYWORDS = ('ERROR', 'Exception', 'Traceback', 'CRITICAL', 'Failed', 'Caused by')
+BLOCK_SEPARATOR = "\n\n---\n\n"
+
+_DATETIME_RE = re.compile(r'\d{4}-\d{2}-\d{2}[\sT]\d{2}:\d{2}:\d{2}(?:[,\.]\d+)?')
+_TIME_RE = re.compile(r'\d{2}:\d{2}:\d{2}(?:[,\.]\d+)?')
+# Line breaks other than "\n" that str.splitlines() would also split on.
+_OTHER_LINE_BREAKS = '\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+_matcher_cache = {}
+
+
+def compile_keywords(keywords):
+    """One regex matching any of `keywords` as a plain substring (cached per keyword set)."""
+    keywords = tuple(keywords)
+    matcher = _matcher_cache.get(keywords)
+    if matcher is None:
+        matcher = re.compile("|".join(re.escape(k) for k in keywords))
+        _matcher_cache[keywords] = matcher
+    return matcher
+
+
+def normalize_log_block(block):
+    # Remove timestamps and join for deduplication
+    clean = _DATETIME_RE.sub('', block)
+    clean = _TIME_RE.sub('', clean)
+    return clean.strip()
+
+
+def _block_key(block):
+    return hashlib.blake2b(normalize_log_block(block).encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+def is_continuation(line):
+    return line.startswith(" ") or line.startswith("\t") or line.strip() == ""
+
+
+def _next_hits(text, keywords):
+    """
+    Return `next_hit(pos)`: offset of the first keyword occurrence at or after
+    `pos`, or -1. Each keyword is located with str.find and its last position
+    is remembered, so the text is scanned once per keyword overall.
+    """
+    found = {k: -2 for k in keywords}
+
+    def next_hit(pos):
+        best = -1
+        for keyword, at in found.items():
+            if at == -1:
+                continue
+            if at < pos:
+                at = found[keyword] = text.find(keyword, pos)
+                if at == -1:
+                    continue
+            if best < 0 or at < best:
+                best = at
+        return best
+
+    return next_hit
+
+
+def _candidate_lines(text, keywords, search):
+    """
+    Yield only the lines of `text` that can affect block extraction: every
+    line from a keyword hit up to and including the first line that ends the
+    block. Stretches with no keyword are skipped with str.find without
+    splitting them into lines. `text` must only use "\n" line breaks.
+    """
+    next_hit = _next_hits(text, keywords)
+    size = len(text)
+    pos = 0
+    while pos < size:
+        hit = next_hit(pos)
+        if hit < 0:
+            return
+        newline = text.rfind("\n", pos, hit)
+        start = pos if newline < 0 else newline + 1
+        while start < size:
+            end = text.find("\n", start)
+            if end < 0:
+                end = size
+            line = text[start:end]
+            start = end + 1
+            yield line
+            if not search(line) and not is_continuation(line):
+                break
+        pos = start
+
+
+def iter_important_log_blocks(lines, keywords=None, seen=None):
+    """
+    Yield each new (not seen before) important block, in log order.
+
+    Args:
+        lines: Iterable of log lines; trailing newlines are ignored.
+        keywords: Substrings that start a new block.
+        seen: Set of block keys already yielded, e.g. by an earlier call over
+            the start of the same log; updated in place.
+    """
+    match = compile_keywords(keywords or DEFAULT_KEYWORDS).search
+    current_block = []
+    seen = set() if seen is None else seen
+
+    def commit_block():
+        full_block = "\n".join(current_block).strip()
+        current_block.clear()
+        key = _block_key(full_block)
+        if key not in seen:
+            seen.add(key)
+            return full_block
+        return None
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if match(line):
+            if current_block:
+                block = commit_block()  # Save previous block before starting new one
+                if block is not None:
+                    yield block
+            current_block.append(line)
+        elif current_block:
+            if is_continuation(line):
+                # Likely a stack trace or continuation
+                current_block.append(line)
+            else:
+                block = commit_block()
+                if block is not None:
+                    yield block
+
+    if current_block:
+        block = commit_block()  # Final block
+        if block is not None:
+            yield block
+
+
+def split_important_log_blocks(log_text, keywords=None, seen=None):
+    """
+    Yield every unique important block of `log_text` (a string or any
+    iterable of lines), oldest first; `seen` as in iter_important_log_blocks().
+    """
+    keywords = keywords or DEFAULT_KEYWORDS
+    if not isinstance(log_text, str):
+        lines = log_text
+    elif any(c in log_text for c in _OTHER_LINE_BREAKS) or any("\n" in k or not k for k in keywords):
+        lines = iter_lines(log_text)
+    else:
+        lines = _candidate_lines(log_text, keywords, compile_keywords(keywords).search)
+    return iter_important_log_blocks(lines, keywords, seen)
+
+
+def extract_important_log_blocks(log_text, keywords=None, max_blocks=30):
+    """
+    Extracts important log blocks, including multi-line stack traces,
+    filters by keyword, deduplicates by content (ignoring timestamps),
+    and limits output to the latest N unique blocks.
+
+    `log_text` may be a string or any iterable of lines (e.g. an open file).
+    """
+    blocks = split_important_log_blocks(log_text, keywords)
+    if max_blocks and max_blocks > 0:
+        return BLOCK_SEPARATOR.join(deque(blocks, maxlen=max_blocks))
+    return BLOCK_SEPARATOR.join(list(blocks)[-max_blocks:])
@@ -0,0 +1,280 @@
+"""
+Incremental error-block index over growing log files.
+
+/read_log (blocks mode) and /explain used to re-read the tail of a log and
+re-extract its error blocks on every call. The index keeps, per log path:
+
+- the byte offset up to which the log has been parsed,
+- the device / inode, size and a hash of the first bytes of the file, to
+  detect rotation (a new file under the same name) and truncation,
+- the keys of every block seen (for deduplication, as log_blocks does) and
+  the newest `max_blocks` unique blocks.
+
+A later call stats the file and parses only the bytes appended since. A block
+still open at the end of the parsed data (an error line whose stack trace may
+still be being written) is not committed: the offset stops at its first line
+and it is parsed again, whole, next time; until then it is reported from a
+separate `pending` list, as a full extraction would report it. A log seen for the first time is
+indexed from the start of its last `initial_tail_lines` lines, like
+read_log_file_safely reads it; from then on blocks are deduplicated over
+everything read since, not over a sliding tail window. Gzip-rotated logs don't grow; they are
+re-extracted only if their size or mtime changed.
+
+Entries live in an LRU backed by a local SQLite file, so offsets survive
+restarts.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from log_blocks import BLOCK_SEPARATOR, DEFAULT_KEYWORDS, compile_keywords, is_continuation, split_important_log_blocks
+from log_reader import decode_log, is_gzip_log, tail_bytes, tail_offset
+from snapshot_cache import LRUCache
+
+HEAD_BYTES = 4096
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+# Keys of blocks seen; past this, arbitrary old keys are forgotten (such a
+# block would be reported again as new if it recurs).
+MAX_SEEN_KEYS = 100_000
+KEY_BYTES = 16
+
+
+class LogIndexEntry:
+    """What the index knows about one log file."""
+
+    __slots__ = ("device", "inode", "size", "mtime", "offset", "head", "seen", "blocks", "pending")
+
+    def __init__(self, device, inode, size, mtime, offset, head, seen, blocks, pending=()):
+        self.device = device
+        self.inode = inode
+        self.size = size
+        self.mtime = mtime
+        self.offset = offset
+        self.head = head  # sha256 of the first min(HEAD_BYTES, size) bytes, and how many they were
+        self.seen = seen
+        self.blocks = blocks
+        self.pending = list(pending)  # blocks in the not yet committed bytes after `offset`
+
+
+def _head(f, size):
+    f.seek(0)
+    data = f.read(min(HEAD_BYTES, size))
+    return hashlib.sha256(data).hexdigest(), len(data)
+
+
+def safe_end(data, match):
+    """
+    Offset in `data` (whole lines, starting where no block is open) up to
+    which every block is closed: after its last line that ends a block, or at
+    its last line that starts one, whichever comes later.
+    """
+    end = len(data)
+    while end > 0:
+        start = data.rfind(b"\n", 0, end - 1) + 1
+        line = data[start:end].decode("utf-8", errors="ignore").rstrip("\r\n")
+        if match(line):
+            return start
+        if not is_continuation(line):
+            return end
+        end = start
+    # Only continuation lines, none of them inside a block.
+    return len(data)
+
+
+class LogIndex:
+    """
+    Error blocks of log files, updated incrementally.
+
+    Args:
+        db_path: SQLite file the entries are persisted to.
+        keywords: Substrings that start a block (log_blocks.DEFAULT_KEYWORDS).
+        max_blocks: Newest unique blocks kept per log.
+        initial_tail_lines: Lines from the end a new log is indexed from.
+        chunk_bytes: Appended data is read and parsed this much at a time.
+        max_memory_entries: Entries kept in memory.
+    """
+
+    def __init__(self, db_path, keywords=None, max_blocks=200, initial_tail_lines=200_000,
+                 chunk_bytes=DEFAULT_CHUNK_BYTES, max_memory_entries=64):
+        self.db_path = Path(db_path)
+        self.keywords = tuple(keywords or DEFAULT_KEYWORDS)
+        self.match = compile_keywords(self.keywords).search
+        self.max_blocks = max_blocks
+        self.initial_tail_lines = initial_tail_lines
+        self.chunk_bytes = chunk_bytes
+        self.memory = LRUCache(max_memory_entries)
+        self._lock = threading.Lock()
+        self._path_locks = {}
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS log_index (
+                path TEXT PRIMARY KEY,
+                keywords TEXT NOT NULL,
+                device INTEGER,
+                inode INTEGER,
+                size INTEGER,
+                mtime REAL,
+                byte_offset INTEGER,
+                head TEXT,
+                seen BLOB,
+                blocks TEXT,
+                pending TEXT,
+                updated_at REAL
+            )
+        """)
+        self._conn.commit()
+        self.metrics = {"unchanged": 0, "incremental": 0, "full": 0, "rotations": 0, "bytes_parsed": 0}
+
+    def _path_lock(self, path):
+        with self._lock:
+            lock = self._path_locks.get(path)
+            if lock is None:
+                lock = self._path_locks[path] = threading.Lock()
+            return lock
+
+    def _load(self, path):
+        entry = self.memory.get(path)
+        if entry is not None:
+            return entry
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT device, inode, size, mtime, byte_offset, head, seen, blocks, pending FROM log_index "
+                "WHERE path = ? AND keywords = ?",
+                (path, json.dumps(self.keywords)),
+            ).fetchone()
+        if row is None:
+            return None
+        device, inode, size, mtime, offset, head, seen, blocks, pending = row
+        seen = {seen[i:i + KEY_BYTES] for i in range(0, len(seen), KEY_BYTES)}
+        entry = LogIndexEntry(device, inode, size, mtime, offset, tuple(json.loads(head)), seen,
+                              deque(json.loads(blocks), maxlen=self.max_blocks), json.loads(pending))
+        self.memory.put(path, entry)
+        return entry
+
+    def _store(self, path, entry):
+        self.memory.put(path, entry)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO log_index VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, json.dumps(self.keywords), entry.device, entry.inode, entry.size, entry.mtime,
+                 entry.offset, json.dumps(entry.head), b"".join(entry.seen),
+                 json.dumps(list(entry.blocks), ensure_ascii=False), json.dumps(entry.pending, ensure_ascii=False),
+                 time.time()),
+            )
+            self._conn.commit()
+
+    def _add_blocks(self, entry, text):
+        for block in split_important_log_blocks(text, self.keywords, entry.seen):
+            entry.blocks.append(block)
+        while len(entry.seen) > MAX_SEEN_KEYS:
+            entry.seen.pop()
+
+    def _new_entry(self, stat, f):
+        return LogIndexEntry(stat.st_dev, stat.st_ino, 0, stat.st_mtime, 0, _head(f, stat.st_size),
+                             set(), deque(maxlen=self.max_blocks))
+
+    def _is_same_file(self, entry, stat, f):
+        if (entry.device, entry.inode) != (stat.st_dev, stat.st_ino) or stat.st_size < entry.size:
+            return False
+        digest, length = entry.head
+        f.seek(0)
+        return hashlib.sha256(f.read(length)).hexdigest() == digest
+
+    def _update_plain(self, path, entry):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if entry is not None and not self._is_same_file(entry, stat, f):
+                self.metrics["rotations"] += 1
+                entry = None
+            if entry is None:
+                entry = self._new_entry(stat, f)
+                entry.offset = tail_offset(path, self.initial_tail_lines) if self.initial_tail_lines else 0
+                self.metrics["full"] += 1
+            elif stat.st_size == entry.size:
+                self.metrics["unchanged"] += 1
+                return entry, False
+            else:
+                self.metrics["incremental"] += 1
+            if entry.head[1] < HEAD_BYTES and stat.st_size > entry.head[1]:
+                # The file was shorter than HEAD_BYTES; fingerprint more of it now.
+                entry.head = _head(f, stat.st_size)
+
+            f.seek(entry.offset)
+            while entry.offset < stat.st_size:
+                data = f.read(min(self.chunk_bytes, stat.st_size - entry.offset))
+                complete = data.rfind(b"\n") + 1
+                if complete == 0:
+                    break  # Only a partial last line; wait until it's written out.
+                end = safe_end(data[:complete], self.match)
+                if end == 0:
+                    if len(data) < self.chunk_bytes:
+                        break
+                    # One block spans the whole chunk; close it here rather than buffer more.
+                    end = complete
+                self._add_blocks(entry, decode_log(data[:end]))
+                self.metrics["bytes_parsed"] += end
+                entry.offset += end
+                f.seek(entry.offset)
+
+            # The held-back tail (an open block, a partial line) still counts,
+            # as it would at the end of a full extraction; it's re-parsed later.
+            f.seek(entry.offset)
+            rest = f.read(stat.st_size - entry.offset)
+            entry.pending = list(split_important_log_blocks(decode_log(rest), self.keywords, set(entry.seen)))
+            entry.size = stat.st_size
+            entry.mtime = stat.st_mtime
+        return entry, True
+
+    def _update_gzip(self, path, entry):
+        stat = os.stat(path)
+        if entry is not None and (entry.size, entry.mtime, entry.inode) == (stat.st_size, stat.st_mtime, stat.st_ino):
+            self.metrics["unchanged"] += 1
+            return entry, False
+        self.metrics["full"] += 1
+        entry = LogIndexEntry(stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime, stat.st_size, ("", 0),
+                              set(), deque(maxlen=self.max_blocks))
+        data = tail_bytes(path, max_lines=self.initial_tail_lines or None)
+        self._add_blocks(entry, decode_log(data))
+        self.metrics["bytes_parsed"] += len(data)
+        return entry, True
+
+    def update(self, path):
+        """Bring the entry for `path` up to date and return it."""
+        path = str(path)
+        with self._path_lock(path):
+            entry = self._load(path)
+            if is_gzip_log(path):
+                entry, changed = self._update_gzip(path, entry)
+            else:
+                entry, changed = self._update_plain(path, entry)
+            if changed:
+                self._store(path, entry)
+            return entry
+
+    def extract(self, path, max_blocks=30):
+        """
+        The newest `max_blocks` unique important blocks of the log, joined as
+        log_blocks.extract_important_log_blocks joins them.
+        """
+        entry = self.update(path)
+        blocks = list(entry.blocks) + entry.pending
+        if max_blocks and max_blocks > 0:
+            blocks = blocks[-max_blocks:]
+        return BLOCK_SEPARATOR.join(blocks)
+
+    def forget(self, path):
+        path = str(path)
+        self.memory.discard_where(lambda k: k == path)
+        with self._lock:
+            self._conn.execute("DELETE FROM log_index WHERE path = ?", (path,))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            disk_entries = self._conn.execute("SELECT COUNT(*) FROM log_index").fetchone()[0]
+        return {**self.metrics, "memory": self.memory.stats(), "disk_entries": disk_entries}
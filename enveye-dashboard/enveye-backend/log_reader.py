@@ -0,0 +1,165 @@
+"""
+Bounded-memory log tail reader.
+
+Reads the end of a log file without loading the whole file: plain files are
+scanned backwards block by block from EOF (or through an mmap), gzip-rotated
+logs (`app.log.1.gz`) are streamed through a bounded deque. Memory use is set
+by the size of the tail, not by the size of the file.
+"""
+import gzip
+import mmap
+import os
+import re
+from collections import deque
+
+BLOCK_SIZE = 64 * 1024
+
+# Line breaks of a byte stream read with universal newlines.
+_BREAK_RE = re.compile(rb"\r\n|\r|\n")
+# One line of a byte stream, with its break (if any).
+_LINE_BYTES_RE = re.compile(rb"[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+")
+
+# Line boundaries recognised by str.splitlines().
+_LINE_RE = re.compile(r'([^\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]*)(\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]|$)')
+
+
+def is_gzip_log(path):
+    return str(path).endswith(".gz")
+
+
+def decode_log(data):
+    # Match what open(..., "r", errors="ignore") used to return (universal newlines).
+    return data.decode("utf-8", errors="ignore").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _read_block(source, start, end):
+    if isinstance(source, mmap.mmap):
+        return source[start:end]
+    source.seek(start)
+    return source.read(end - start)
+
+
+def _tail_offset(source, size, max_lines, block_size):
+    """
+    Byte offset where the last `max_lines` lines of `source` start. Lines end
+    at LF, CRLF or a lone CR, as with universal newlines.
+    """
+    if size == 0 or max_lines is None:
+        return 0
+    # A trailing line break terminates the last line; it doesn't start a new one.
+    last = _read_block(source, max(0, size - 2), size)
+    search_end = size - (2 if last == b"\r\n" else 1 if last[-1:] in (b"\n", b"\r") else 0)
+    remaining = max_lines
+    pos = search_end
+    while pos > 0:
+        start = max(0, pos - block_size)
+        block = _read_block(source, start, pos)
+        if b"\r" not in block:
+            # Common case: every \n is one line break.
+            idx = len(block)
+            while True:
+                idx = block.rfind(b"\n", 0, idx)
+                if idx < 0:
+                    break
+                remaining -= 1
+                if remaining == 0:
+                    return start + idx + 1
+        else:
+            breaks = [m.end() for m in _BREAK_RE.finditer(block)]
+            if block.endswith(b"\r") and _read_block(source, pos, pos + 1) == b"\n":
+                breaks.pop()  # half of a \r\n whose \n starts the next block
+            for end in reversed(breaks):
+                remaining -= 1
+                if remaining == 0:
+                    return start + end
+        pos = start
+    return 0
+
+
+def _universal_lines(f):
+    """Lines of a binary file split at LF, CRLF or a lone CR, each with its break."""
+    for line in f:
+        if b"\r" in line:
+            # A \r\n can't straddle two \n-terminated lines.
+            yield from _LINE_BYTES_RE.findall(line)
+        else:
+            yield line
+
+
+def _gzip_tail(path, max_lines=None, max_bytes=None):
+    """gzip streams can't seek from the end; keep a rolling window instead."""
+    with gzip.open(path, "rb") as f:
+        if max_lines is not None:
+            window = deque(_universal_lines(f), maxlen=max_lines)
+            data = b"".join(window)
+        else:
+            chunks = deque()
+            buffered = 0
+            while True:
+                chunk = f.read(BLOCK_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                buffered += len(chunk)
+                while buffered - len(chunks[0]) >= max_bytes:
+                    buffered -= len(chunks.popleft())
+            data = b"".join(chunks)
+    if max_bytes is not None:
+        data = data[-max_bytes:]
+    return data
+
+
+def tail_bytes(path, max_lines=None, max_bytes=None, use_mmap=False, block_size=BLOCK_SIZE):
+    """
+    Return the raw bytes of the last `max_lines` lines and/or last `max_bytes`
+    bytes of a log (whichever is smaller). With neither limit, the whole file.
+    """
+    if is_gzip_log(path):
+        if max_lines is None and max_bytes is None:
+            with gzip.open(path, "rb") as f:
+                return f.read()
+        return _gzip_tail(path, max_lines=max_lines, max_bytes=max_bytes)
+
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return b""
+        if use_mmap:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset = _tail_offset(mm, size, max_lines, block_size)
+                if max_bytes is not None:
+                    offset = max(offset, size - max_bytes)
+                return mm[offset:size]
+
+        offset = _tail_offset(f, size, max_lines, block_size)
+        if max_bytes is not None:
+            offset = max(offset, size - max_bytes)
+        f.seek(offset)
+        return f.read(size - offset)
+
+
+def tail_offset(path, max_lines):
+    """Byte offset where the last `max_lines` lines of a plain (not gzip) log start."""
+    with open(path, "rb") as f:
+        return _tail_offset(f, os.fstat(f.fileno()).st_size, max_lines, BLOCK_SIZE)
+
+
+def read_tail(path, max_lines=None, max_bytes=None, use_mmap=False):
+    """Decoded text of the tail of a log file (see `tail_bytes`)."""
+    return decode_log(tail_bytes(path, max_lines=max_lines, max_bytes=max_bytes, use_mmap=use_mmap))
+
+
+def iter_lines(text):
+    """Lazy equivalent of `text.splitlines()`."""
+    for match in _LINE_RE.finditer(text):
+        line, terminator = match.groups()
+        if not terminator:
+            if line:
+                yield line
+            return
+        yield line
+
+
+def iter_tail_lines(path, max_lines=None, max_bytes=None, use_mmap=False):
+    """Yield the lines of the tail in file order, without line endings."""
+    yield from iter_lines(read_tail(path, max_lines=max_lines, max_bytes=max_bytes, use_mmap=use_mmap))
@@ -0,0 +1,206 @@
+"""
+OCR for pasted error screenshots.
+
+Tesseract runs in a bounded worker pool (threads by default, since the work
+happens in the tesseract subprocess; processes with `executor: "process"`),
+never on the event loop, and at most `max_queue` images wait for a worker
+before new requests are turned away with OCRBusy.
+
+Before OCR each image is
+- converted to grayscale,
+- cropped to the region that differs from the border colour (the text, on
+  the usual flat dialog / console background), skipping OCR entirely for a
+  blank image,
+- downscaled to `target_dpi` (HiDPI screenshots are 2-3x what tesseract
+  needs) and to at most `max_pixels`,
+and tesseract is told the resulting DPI instead of guessing it.
+
+Results are cached by the sha256 of the image bytes, and concurrent requests
+for the same image share one OCR run, so pasting the same screenshot twice
+costs nothing.
+
+PIL and pytesseract are imported on first use.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from snapshot_cache import LRUCache
+
+DEFAULT_SCREEN_DPI = 96
+DEFAULT_OPTIONS = {
+    "target_dpi": 120,
+    "max_pixels": 4_000_000,
+    "crop": True,
+    "crop_threshold": 24,
+    "crop_margin": 8,
+    "tesseract_config": "--psm 3",
+}
+
+
+class OCRBusy(Exception):
+    pass
+
+
+def clean_ocr_text(text):
+    # Normalize Unicode (e.g., accented characters)
+    text = unicodedata.normalize("NFKD", text)
+
+    # Remove non-printable characters (keep ASCII)
+    text = re.sub(r'[^\x20-\x7E]+', '', text)
+
+    # Collapse multiple spaces, remove leading/trailing whitespace
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text
+
+
+def decode_image_payload(base64_image):
+    """Raw image bytes from a base64 string or data: URL."""
+    try:
+        return base64.b64decode(base64_image.split(",")[-1], validate=False)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"Invalid base64 image: {e}") from e
+
+
+def _border_colour(gray):
+    width, height = gray.size
+    border = [gray.getpixel((x, y)) for x in range(0, width, max(1, width // 64)) for y in (0, height - 1)]
+    border += [gray.getpixel((x, y)) for y in range(0, height, max(1, height // 64)) for x in (0, width - 1)]
+    return max(set(border), key=border.count)
+
+
+def preprocess(image, options=None):
+    """
+    Grayscale, crop and downscale `image` for OCR.
+
+    Returns:
+        (PIL.Image or None, int): The image to OCR (None if it is blank) and its effective DPI.
+    """
+    from PIL import Image
+
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    dpi = image.info.get("dpi", (DEFAULT_SCREEN_DPI,))[0] or DEFAULT_SCREEN_DPI
+    gray = image.convert("L")
+
+    if options["crop"]:
+        background = _border_colour(gray)
+        threshold = options["crop_threshold"]
+        mask = gray.point(lambda p: 255 if abs(p - background) > threshold else 0)
+        box = mask.getbbox()
+        if box is None:
+            return None, dpi
+        margin = options["crop_margin"]
+        gray = gray.crop((max(0, box[0] - margin), max(0, box[1] - margin),
+                          min(gray.width, box[2] + margin), min(gray.height, box[3] + margin)))
+
+    scale = min(1.0, options["target_dpi"] / dpi, (options["max_pixels"] / (gray.width * gray.height)) ** 0.5)
+    if scale < 0.95:
+        size = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+        gray = gray.resize(size, Image.LANCZOS, reducing_gap=2.0)
+        dpi = round(dpi * scale)
+    return gray, int(dpi)
+
+
+def ocr_image_bytes(data, options=None):
+    """Decode, preprocess and OCR one image. Module-level so it can run in a worker process."""
+    from PIL import Image, UnidentifiedImageError
+    import pytesseract
+
+    options = {**DEFAULT_OPTIONS, **(options or {})}
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except UnidentifiedImageError as e:
+        raise ValueError(f"Unreadable image: {e}") from e
+    with image:
+        prepared, dpi = preprocess(image, options)
+    if prepared is None:
+        return ""
+    config = f"{options['tesseract_config']} --dpi {dpi}".strip()
+    return clean_ocr_text(pytesseract.image_to_string(prepared, config=config))
+
+
+class OCRService:
+    def __init__(self, max_workers=None, executor="thread", max_queue=32, cache_entries=256, options=None):
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.executor_kind = executor
+        self.max_queue = max_queue
+        self.options = {**DEFAULT_OPTIONS, **(options or {})}
+        self.cache = LRUCache(cache_entries)
+        self._executor = None
+        self._inflight = {}
+        self.metrics = {"requests": 0, "ocr_runs": 0, "shared": 0, "rejected": 0, "errors": 0,
+                        "ocr_seconds_total": 0.0, "ocr_seconds_max": 0.0}
+
+    def _pool(self):
+        if self._executor is None:
+            pool_class = ProcessPoolExecutor if self.executor_kind == "process" else ThreadPoolExecutor
+            self._executor = pool_class(max_workers=self.max_workers)
+        return self._executor
+
+    async def extract_text(self, data):
+        """
+        OCR text of the image in `data` (bytes).
+
+        Raises:
+            OCRBusy: If `max_queue` images are already waiting.
+            ValueError: If `data` isn't an image PIL can read.
+        """
+        self.metrics["requests"] += 1
+        key = hashlib.sha256(data).hexdigest()
+        text = self.cache.get(key)
+        if text is not None:
+            return text
+        if key in self._inflight:
+            self.metrics["shared"] += 1
+            return await asyncio.shield(self._inflight[key])
+        if len(self._inflight) >= self.max_workers + self.max_queue:
+            self.metrics["rejected"] += 1
+            raise OCRBusy(f"{len(self._inflight)} OCR requests already pending")
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._pool(), ocr_image_bytes, data, self.options)
+        self._inflight[key] = future
+        started = time.perf_counter()
+        try:
+            text = await future
+        except Exception:
+            self.metrics["errors"] += 1
+            raise
+        finally:
+            del self._inflight[key]
+        elapsed = time.perf_counter() - started
+        self.metrics["ocr_runs"] += 1
+        self.metrics["ocr_seconds_total"] += elapsed
+        self.metrics["ocr_seconds_max"] = max(self.metrics["ocr_seconds_max"], elapsed)
+        self.cache.put(key, text)
+        return text
+
+    def warm_up(self):
+        """Import PIL / pytesseract, start the pool and check tesseract is installed."""
+        import pytesseract
+
+        self._pool()
+        return str(pytesseract.get_tesseract_version())
+
+    def stats(self):
+        runs = self.metrics["ocr_runs"]
+        return {
+            **self.metrics,
+            "ocr_seconds_avg": round(self.metrics["ocr_seconds_total"] / runs, 3) if runs else 0.0,
+            "pending": len(self._inflight),
+            "max_workers": self.max_workers,
+            "executor": self.executor_kind,
+            "cache": self.cache.stats(),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
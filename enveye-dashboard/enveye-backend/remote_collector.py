@@ -0,0 +1,297 @@
+"""
+Remote snapshot collection over WinRM (Windows) and SSH (Linux/macOS).
+
+These functions are blocking (pywinrm / paramiko are synchronous); the API runs
+them in a worker thread so the event loop stays responsive.
+"""
+import base64
+import os
+import shlex
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from config_loader import CONFIG
+from connection_pool import ConnectionPool
+
+SSH_VM_TYPES = ("linux", "macos", "mac")
+
+POOL_CONFIG = CONFIG.get("remote_collection", {}).get("connection_pool", {})
+connection_pool = ConnectionPool(
+    max_size=POOL_CONFIG.get("max_size", 32),
+    idle_timeout=POOL_CONFIG.get("idle_timeout_seconds", 300),
+    connect_timeout=POOL_CONFIG.get("connect_timeout_seconds", 15),
+    ports=POOL_CONFIG.get("ports"),
+)
+
+RETRIEVAL_CONFIG = CONFIG.get("remote_collection", {}).get("retrieval", {})
+# "file": agent writes the snapshot remotely and we fetch it (SFTP / chunked WinRM reads).
+# "stdout": agent prints the snapshot and we capture the command output directly.
+RETRIEVAL_MODE = RETRIEVAL_CONFIG.get("mode", "file")
+WAIT_TIMEOUT = RETRIEVAL_CONFIG.get("wait_timeout_seconds", 30)
+BACKOFF_INITIAL = RETRIEVAL_CONFIG.get("backoff_initial_seconds", 0.1)
+BACKOFF_MAX = RETRIEVAL_CONFIG.get("backoff_max_seconds", 2.0)
+WINRM_CHUNK_BYTES = RETRIEVAL_CONFIG.get("winrm_chunk_bytes", 1024 * 1024)
+
+
+class CollectionError(Exception):
+    pass
+
+
+def snapshot_filename_for(vm_ip, app_folder, vm_type, snapshot_label=""):
+    hostname = vm_ip.replace('.', '-')
+    app_name = os.path.basename(app_folder).replace(" ", "").replace(".", "_")
+    timestamp = datetime.now().strftime('%Y%m%dT%H%M%S')
+    return f"{hostname}_{app_name}_{vm_type.upper()}_{timestamp}_{snapshot_label}.json"
+
+
+def collect_snapshot(snapshot_dir, vm_ip, username, password, app_folder, app_type, vm_type="windows", snapshot_label="", base_snapshot=None):
+    """
+    Run the agent on a remote VM and pull the snapshot into `snapshot_dir`.
+
+    If `base_snapshot` names an earlier snapshot collected from the same host
+    (so the agent still has it next to its binary), the agent diffs against it
+    and only the delta is transferred (file retrieval mode only). Callers
+    ingest the result through the snapshot store, which applies it.
+
+    Returns:
+        Path: Local path of the collected snapshot.
+
+    Raises:
+        CollectionError: If the VM type is unsupported or collection failed.
+    """
+    vm_type = vm_type.lower()
+    snapshot_filename = snapshot_filename_for(vm_ip, app_folder, vm_type, snapshot_label)
+    if vm_type == "windows":
+        return collect_windows(snapshot_dir, vm_ip, username, password, app_folder, app_type, snapshot_label, snapshot_filename, base_snapshot)
+    elif vm_type in SSH_VM_TYPES:
+        return collect_ssh_based(snapshot_dir, vm_ip, username, password, app_folder, app_type, snapshot_label, snapshot_filename, base_snapshot)
+    else:
+        raise CollectionError(f"Unsupported VM type: {vm_type}")
+
+
+def _agent_args(app_folder, app_type, output, snapshot_label, base=None):
+    arg_parts = [
+        f'--app-folder "{app_folder}"',
+        f'--app-type {app_type}',
+    ]
+    if output:
+        arg_parts.append(f'--output {output}')
+    else:
+        arg_parts.append('--stdout')
+    if snapshot_label:
+        arg_parts.append(f'--label {snapshot_label}')
+    if base:
+        arg_parts.append(f'--base "{base}"')
+    return " ".join(arg_parts)
+
+
+def wait_for(check, timeout=None, initial=None, max_interval=None):
+    """
+    Call `check` until it returns truthy, sleeping with exponential backoff.
+    Only used when the agent's exit status can't tell us the snapshot is ready.
+
+    Returns:
+        bool: True if `check` succeeded before `timeout` seconds elapsed.
+    """
+    timeout = WAIT_TIMEOUT if timeout is None else timeout
+    interval = BACKOFF_INITIAL if initial is None else initial
+    max_interval = BACKOFF_MAX if max_interval is None else max_interval
+    deadline = time.monotonic() + timeout
+    while True:
+        if check():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+
+
+def _write_snapshot_bytes(local_path, data):
+    data = data.strip()
+    if not data.startswith(b"{"):
+        raise CollectionError("Agent did not print a JSON snapshot to stdout.")
+    with open(local_path, "wb") as f:
+        f.write(data)
+
+
+# for remote colection in Windows VM
+def collect_windows(snapshot_dir, vm_ip, username, password, app_folder, app_type, snapshot_label, snapshot_filename, base_snapshot=None):
+    remote_agent = CONFIG["agent_paths"]["windows"]
+    remote_dir = os.path.dirname(remote_agent)
+    remote_snapshot_path = f"{remote_dir}\\{snapshot_filename}"
+    local_file_path = snapshot_dir / snapshot_filename
+
+    try:
+        # A CollectionError is the agent or its output failing; the connection is still good.
+        with connection_pool.winrm(vm_ip, username, password, keep_on=(CollectionError,)) as connection:
+            session = connection.session
+
+            if RETRIEVAL_MODE == "stdout":
+                # run_cmd hands back the agent's raw stdout bytes, no PowerShell re-encoding.
+                arg_string = _agent_args(app_folder, app_type, None, snapshot_label)
+                print(f"🚀 Executing agent remotely on Windows (stdout): {remote_agent} {arg_string}")
+                exec_result = session.run_cmd(f'"{remote_agent}" {arg_string}')
+                if exec_result.status_code != 0:
+                    raise CollectionError(
+                        f"Agent exited with status {exec_result.status_code}: {exec_result.std_err.decode(errors='replace')}"
+                    )
+                _write_snapshot_bytes(local_file_path, exec_result.std_out)
+                print(f"✅ Snapshot streamed and saved to: {local_file_path}")
+                return local_file_path
+
+            # With a base the agent still writes the full snapshot (the next
+            # base) but we only fetch the delta it writes alongside.
+            base_path = f"{remote_dir}\\{base_snapshot}" if base_snapshot else None
+            arg_string = _agent_args(app_folder, app_type, snapshot_filename, snapshot_label, base_path)
+            fetch_path = f"{remote_snapshot_path}.delta" if base_snapshot else remote_snapshot_path
+            ps_cmd = f"""
+            $p = Start-Process -FilePath '{remote_agent}' -ArgumentList '{arg_string}' -Wait -NoNewWindow -PassThru
+            if ($p.ExitCode -ne $null) {{ exit $p.ExitCode }}
+            exit 259
+            """
+
+            print("🚀 Executing agent remotely on Windows...")
+            print("🧪 PowerShell Command:\n", ps_cmd)
+
+            exec_result = session.run_ps(ps_cmd)
+            print("✅ Remote agent finished with status", exec_result.status_code)
+            print("STDOUT:", exec_result.std_out.decode(errors="replace"))
+            print("STDERR:", exec_result.std_err.decode(errors="replace"))
+
+            def snapshot_exists():
+                poll_result = session.run_ps(f"Test-Path -LiteralPath '{fetch_path}'")
+                return "True" in poll_result.std_out.decode()
+
+            # 259 (STILL_ACTIVE) means no exit code came back; only then poll for the file.
+            if exec_result.status_code == 259:
+                if not wait_for(snapshot_exists):
+                    raise CollectionError("Snapshot file not found after waiting.")
+            elif exec_result.status_code != 0:
+                raise CollectionError(f"Agent exited with status {exec_result.status_code}.")
+
+            _winrm_download(session, fetch_path, local_file_path)
+
+        print(f"✅ Snapshot pulled and saved to: {local_file_path}")
+        return local_file_path
+
+    except CollectionError:
+        raise
+    except Exception as e:
+        print("❌ FULL EXCEPTION in collect_windows")
+        print(traceback.format_exc())
+        raise CollectionError(str(e)) from e
+
+
+def _winrm_download(session, remote_path, local_path, chunk_bytes=None):
+    """
+    Copy a remote file in fixed-size byte ranges, one run_ps per chunk, writing
+    each chunk as it arrives. WinRM output is text, so chunks are still base64
+    on the wire, but no single command or buffer has to hold the whole file.
+    """
+    chunk_bytes = chunk_bytes or WINRM_CHUNK_BYTES
+    size_result = session.run_ps(f"(Get-Item -LiteralPath '{remote_path}').Length")
+    try:
+        size = int(size_result.std_out.decode().strip())
+    except ValueError:
+        raise CollectionError("Failed to retrieve snapshot file content.")
+
+    with open(local_path, "wb") as f:
+        offset = 0
+        while offset < size:
+            read_cmd = (
+                f"$f = [IO.File]::OpenRead('{remote_path}'); "
+                f"try {{ $null = $f.Seek({offset}, 'Begin'); $buf = New-Object byte[] {chunk_bytes}; "
+                f"$n = $f.Read($buf, 0, {chunk_bytes}); [Convert]::ToBase64String($buf, 0, $n) }} "
+                f"finally {{ $f.Close() }}"
+            )
+            read_result = session.run_ps(read_cmd)
+            encoded = read_result.std_out.decode().strip()
+            if read_result.status_code != 0 or not encoded:
+                raise CollectionError("Failed to retrieve snapshot file content.")
+            chunk = base64.b64decode(encoded)
+            f.write(chunk)
+            offset += len(chunk)
+
+
+def _ssh_exec(client, command, out=None):
+    """
+    Run `command` over SSH and wait for it. stdout (written to `out` if given)
+    and stderr (in a thread) are drained while it runs, so neither can fill
+    its channel window and stall the agent.
+
+    Returns:
+        tuple: (exit status, stderr bytes)
+    """
+    _, stdout, stderr = client.exec_command(command)
+    errors = []
+    drain = threading.Thread(target=lambda: errors.extend(iter(lambda: stderr.read(64 * 1024), b"")), daemon=True)
+    drain.start()
+    for chunk in iter(lambda: stdout.read(64 * 1024), b""):
+        if out is not None:
+            out.write(chunk)
+    exit_status = stdout.channel.recv_exit_status()
+    drain.join()
+    return exit_status, b"".join(errors)
+
+
+# for remote collection Linux and Mac VMs
+def collect_ssh_based(snapshot_dir, vm_ip, username, password, app_folder, app_type, snapshot_label, snapshot_filename, base_snapshot=None):
+    remote_agent_path = CONFIG["agent_paths"]["linux"]
+    remote_dir = os.path.dirname(remote_agent_path)
+    remote_snapshot_path = f"{remote_dir}/{snapshot_filename}"
+    local_path = snapshot_dir / snapshot_filename
+
+    try:
+        # A CollectionError is the agent or its output failing; the connection is still good.
+        with connection_pool.ssh(vm_ip, username, password, keep_on=(CollectionError,)) as connection:
+            client = connection.client
+
+            if RETRIEVAL_MODE == "stdout":
+                full_command = f"{remote_agent_path} {_agent_args(app_folder, app_type, None, snapshot_label)}"
+                print(f"🚀 Executing on Linux/macOS (stdout): {full_command}")
+                with open(local_path, "wb") as f:
+                    exit_status, errors = _ssh_exec(client, full_command, f)
+                if exit_status != 0:
+                    local_path.unlink(missing_ok=True)
+                    raise CollectionError(f"Agent exited with status {exit_status}: {errors.decode(errors='replace')}")
+                print(f"✅ Snapshot streamed and saved to: {local_path}")
+                return local_path
+
+            # Ensure output directory exists, then run the agent in the same command
+            base_path = f"{remote_dir}/{base_snapshot}" if base_snapshot else None
+            arg_string = _agent_args(app_folder, app_type, remote_snapshot_path, snapshot_label, base_path)
+            fetch_path = f"{remote_snapshot_path}.delta" if base_snapshot else remote_snapshot_path
+            full_command = f"mkdir -p {shlex.quote(remote_dir)} && {remote_agent_path} {arg_string}"
+            print(f"🚀 Executing on Linux/macOS: {full_command}")
+            exit_status, errors = _ssh_exec(client, full_command)  # Wait for completion
+            sftp = connection.sftp()
+
+            def snapshot_exists():
+                try:
+                    sftp.stat(fetch_path)
+                    return True
+                except FileNotFoundError:
+                    return False
+
+            # A zero exit status means the file is complete; -1 means the server
+            # sent no status, so fall back to polling for the file.
+            if exit_status == -1:
+                if not wait_for(snapshot_exists):
+                    raise CollectionError("Snapshot not found after waiting.")
+            elif exit_status != 0:
+                raise CollectionError(f"Agent exited with status {exit_status}: {errors.decode(errors='replace')}")
+
+            # Stream the file over the connection's (reused) SFTP channel
+            sftp.get(fetch_path, str(local_path))
+
+        print(f"✅ Snapshot pulled and saved to: {local_path}")
+        return local_path
+
+    except CollectionError:
+        raise
+    except Exception as e:
+        print(traceback.format_exc())
+        raise CollectionError(f"SSH collection failed: {str(e)}") from e
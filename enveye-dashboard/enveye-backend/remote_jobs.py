@@ -0,0 +1,130 @@
+"""
+Batch remote collection jobs.
+
+A job collects snapshots from many hosts on a bounded thread pool. OS types
+with a configured cap (e.g. fewer parallel WinRM sessions) get their own,
+smaller pool instead. Job and per-host progress are kept in memory and can be
+polled by job ID.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from remote_collector import CollectionError, collect_snapshot
+
+HOST_FIELDS = ("vm_ip", "username", "password", "app_folder", "app_type", "vm_type", "label")
+
+
+def _os_key(vm_type):
+    vm_type = (vm_type or "windows").lower()
+    return "macos" if vm_type == "mac" else vm_type
+
+
+class HostTask:
+    def __init__(self, spec):
+        self.spec = spec
+        self.status = "queued"
+        self.message = ""
+        self.snapshot = None
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "vm_ip": self.spec.get("vm_ip"),
+            "vm_type": self.spec.get("vm_type", "windows"),
+            "status": self.status,
+            "message": self.message,
+            "snapshot": self.snapshot,
+            "duration_seconds": round(self.finished_at - self.started_at, 2) if self.finished_at and self.started_at else None,
+        }
+
+
+class CollectionJob:
+    def __init__(self, hosts):
+        self.job_id = str(uuid4())
+        self.created_at = time.time()
+        self.hosts = [HostTask(spec) for spec in hosts]
+
+    def to_dict(self):
+        counts = {}
+        for host in self.hosts:
+            counts[host.status] = counts.get(host.status, 0) + 1
+        done = counts.get("success", 0) + counts.get("failed", 0)
+        return {
+            "job_id": self.job_id,
+            "created_at": self.created_at,
+            "total": len(self.hosts),
+            "done": done,
+            "progress": round(done / len(self.hosts), 3) if self.hosts else 1.0,
+            "status": "completed" if done == len(self.hosts) else "running",
+            "counts": counts,
+            "hosts": [host.to_dict() for host in self.hosts],
+        }
+
+
+class CollectionJobManager:
+    def __init__(self, snapshot_dir, max_workers=16, per_os_limits=None, max_jobs=100, on_collected=None, resolve_base=None):
+        self.snapshot_dir = snapshot_dir
+        self.on_collected = on_collected
+        self.resolve_base = resolve_base
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="remote-collect")
+        self.os_executors = {
+            _os_key(os_type): ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"remote-collect-{os_type}")
+            for os_type, limit in (per_os_limits or {}).items()
+        }
+        self.max_jobs = max_jobs
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, hosts, defaults=None):
+        """Queue a collection for every host spec; returns the new job."""
+        defaults = defaults or {}
+        specs = [{**defaults, **{k: v for k, v in host.items() if k in HOST_FIELDS}} for host in hosts]
+        job = CollectionJob(specs)
+        with self._lock:
+            self.jobs[job.job_id] = job
+            # Forget the oldest finished jobs beyond max_jobs.
+            for job_id in list(self.jobs)[:-self.max_jobs]:
+                if self.jobs[job_id].to_dict()["status"] == "completed":
+                    del self.jobs[job_id]
+        for task in job.hosts:
+            vm_type = task.spec.get("vm_type", "windows")
+            self.os_executors.get(_os_key(vm_type), self.executor).submit(self._run, task)
+        return job
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _run(self, task):
+        spec = task.spec
+        vm_type = spec.get("vm_type", "windows").lower()
+        try:
+            task.status = "running"
+            task.started_at = time.time()
+            local_path = collect_snapshot(
+                self.snapshot_dir,
+                spec.get("vm_ip"),
+                spec.get("username"),
+                spec.get("password"),
+                spec.get("app_folder"),
+                spec.get("app_type"),
+                vm_type,
+                spec.get("label", "").strip(),
+                self.resolve_base(spec) if self.resolve_base else None,
+            )
+            task.snapshot = local_path.name
+            if self.on_collected:
+                self.on_collected(local_path, spec)
+            task.message = f"Snapshot from {spec.get('vm_ip')} collected"
+            task.status = "success"
+        except CollectionError as e:
+            task.message = str(e)
+            task.status = "failed"
+        except Exception as e:
+            print(f"❌ Unexpected error collecting from {spec.get('vm_ip')}: {e}")
+            task.message = str(e)
+            task.status = "failed"
+        finally:
+            task.finished_at = time.time()
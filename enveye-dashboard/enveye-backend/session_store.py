@@ -0,0 +1,321 @@
+"""
+Diagnosis session storage.
+
+A session is its id, timestamps, status, the conversation so far, a rolling
+summary of its older turns (see conversation_context.py) and a reference to
+the payload it was opened with (the diff, error message, OCR text and logs).
+Payloads are stored once under the sha256 of their canonical JSON, so
+sessions opened on the same inputs share one copy, and the conversation is
+stored as appended messages rather than rewritten.
+
+Two backends, chosen with config.json "sessions.backend":
+
+- "memory": an LRU of at most `max_sessions` sessions, each expiring
+  `ttl_seconds` after its last use. Fast, but per process and lost on restart.
+- "sqlite": a local SQLite file (WAL), shared by every worker process on the
+  host and kept across restarts. Sessions expire after `ttl_seconds` without
+  use; payloads nobody references any more are dropped with them. Payloads are
+  zlib-compressed and the most recently used ones are cached in memory.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from uuid import uuid4
+
+from snapshot_cache import LRUCache
+
+DEFAULT_TTL_SECONDS = 7 * 86400
+PURGE_INTERVAL_SECONDS = 300
+
+
+def payload_key(payload):
+    """sha256 of a payload's canonical JSON, plus that JSON."""
+    data = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    return hashlib.sha256(data).hexdigest(), data
+
+
+class DiagnosisSession:
+    __slots__ = ("session_id", "created_at", "updated_at", "payload_key", "initial_input",
+                 "ai_messages", "user_followups", "status", "summary", "summarized_turns")
+
+    def __init__(self, initial_input, payload_key=None, session_id=None, created_at=None, updated_at=None,
+                 ai_messages=None, user_followups=None, status="active", summary="", summarized_turns=0):
+        self.session_id = session_id or str(uuid4())
+        self.created_at = created_at or datetime.utcnow().isoformat()
+        self.updated_at = updated_at or time.time()
+        self.payload_key = payload_key
+        self.initial_input = initial_input
+        self.ai_messages = ai_messages if ai_messages is not None else []
+        self.user_followups = user_followups if user_followups is not None else []
+        self.status = status
+        self.summary = summary
+        self.summarized_turns = summarized_turns
+
+    def to_dict(self):
+        return {
+            "session_id": self.session_id,
+            "created_at": self.created_at,
+            "initial_input": self.initial_input,
+            "ai_messages": self.ai_messages,
+            "user_followups": self.user_followups,
+            "status": self.status
+        }
+
+
+class MemorySessionStore:
+    """Per-process LRU of sessions with idle expiry; payloads shared by hash."""
+
+    def __init__(self, max_sessions=1000, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._sessions = OrderedDict()
+        self._payloads = {}  # key -> [payload, sessions referencing it]
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def _drop(self, session_id):
+        session = self._sessions.pop(session_id)
+        entry = self._payloads.get(session.payload_key)
+        if entry:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._payloads[session.payload_key]
+        self.evicted += 1
+
+    def _expire(self, now):
+        # Oldest use first, so stop at the first session still live.
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.updated_at < self.ttl_seconds and len(self._sessions) <= self.max_sessions:
+                break
+            self._drop(session_id)
+
+    def create(self, initial_input):
+        key, _ = payload_key(initial_input)
+        now = time.time()
+        with self._lock:
+            entry = self._payloads.setdefault(key, [initial_input, 0])
+            entry[1] += 1
+            session = DiagnosisSession(entry[0], payload_key=key, updated_at=now)
+            self._sessions[session.session_id] = session
+            self._expire(now)
+        return session
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            session.updated_at = now
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def add_ai_message(self, session, content):
+        session.ai_messages.append({"role": "assistant", "content": content})
+
+    def add_followup(self, session, content):
+        session.user_followups.append({"type": "text", "content": content})
+
+    def set_status(self, session, status):
+        session.status = status
+
+    def set_summary(self, session, summary, summarized_turns):
+        with self._lock:
+            stored = self._sessions.get(session.session_id, session)
+            if summarized_turns > stored.summarized_turns:
+                stored.summary, stored.summarized_turns = summary, summarized_turns
+
+    def purge_expired(self):
+        with self._lock:
+            before = self.evicted
+            self._expire(time.time())
+            return self.evicted - before
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "payloads": len(self._payloads),
+                "evicted": self.evicted,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+class SQLiteSessionStore:
+    """Sessions in a SQLite file, shared across worker processes and restarts."""
+
+    def __init__(self, db_path, ttl_seconds=DEFAULT_TTL_SECONDS, payload_cache_entries=64):
+        self.db_path = Path(db_path)
+        self.ttl_seconds = ttl_seconds
+        self.payloads = LRUCache(payload_cache_entries)
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS session_payloads (
+                key TEXT PRIMARY KEY,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                payload_key TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                status TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions (updated_at);
+            CREATE INDEX IF NOT EXISTS idx_sessions_payload ON sessions (payload_key);
+            CREATE TABLE IF NOT EXISTS session_messages (
+                session_id TEXT NOT NULL,
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_session_messages_session ON session_messages (session_id, seq);
+            CREATE TABLE IF NOT EXISTS session_summaries (
+                session_id TEXT PRIMARY KEY,
+                summary TEXT NOT NULL,
+                summarized_turns INTEGER NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def _payload(self, key):
+        payload = self.payloads.get(key)
+        if payload is None:
+            with self._lock:
+                row = self._conn.execute("SELECT data FROM session_payloads WHERE key = ?", (key,)).fetchone()
+            payload = json.loads(zlib.decompress(row[0])) if row else {}
+            self.payloads.put(key, payload)
+        return payload
+
+    def create(self, initial_input):
+        key, data = payload_key(initial_input)
+        session = DiagnosisSession(initial_input, payload_key=key)
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO session_payloads VALUES (?, ?)", (key, zlib.compress(data, 6)))
+            self._conn.execute(
+                "INSERT INTO sessions VALUES (?, ?, ?, ?, ?)",
+                (session.session_id, key, session.created_at, session.updated_at, session.status),
+            )
+            self._conn.commit()
+        self.payloads.put(key, initial_input)
+        if session.updated_at - self._last_purge > PURGE_INTERVAL_SECONDS:
+            self.purge_expired()
+        return session
+
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT s.payload_key, s.created_at, s.updated_at, s.status, m.summary, m.summarized_turns "
+                "FROM sessions s LEFT JOIN session_summaries m ON m.session_id = s.session_id WHERE s.session_id = ?",
+                (session_id,),
+            ).fetchone()
+            if row is None or now - row[2] >= self.ttl_seconds:
+                return None
+            messages = self._conn.execute(
+                "SELECT kind, content FROM session_messages WHERE session_id = ? ORDER BY seq", (session_id,)
+            ).fetchall()
+            self._conn.execute("UPDATE sessions SET updated_at = ? WHERE session_id = ?", (now, session_id))
+            self._conn.commit()
+        return DiagnosisSession(
+            self._payload(row[0]),
+            payload_key=row[0],
+            session_id=session_id,
+            created_at=row[1],
+            updated_at=now,
+            ai_messages=[{"role": "assistant", "content": c} for kind, c in messages if kind == "ai"],
+            user_followups=[{"type": "text", "content": c} for kind, c in messages if kind == "user"],
+            status=row[3],
+            summary=row[4] or "",
+            summarized_turns=row[5] or 0,
+        )
+
+    def _append(self, session, kind, content):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO session_messages (session_id, kind, content) VALUES (?, ?, ?)",
+                (session.session_id, kind, content),
+            )
+            self._conn.commit()
+
+    def add_ai_message(self, session, content):
+        session.ai_messages.append({"role": "assistant", "content": content})
+        self._append(session, "ai", content)
+
+    def add_followup(self, session, content):
+        session.user_followups.append({"type": "text", "content": content})
+        self._append(session, "user", content)
+
+    def set_status(self, session, status):
+        session.status = status
+        with self._lock:
+            self._conn.execute("UPDATE sessions SET status = ? WHERE session_id = ?", (status, session.session_id))
+            self._conn.commit()
+
+    def set_summary(self, session, summary, summarized_turns):
+        """Store a summary of the first `summarized_turns` turns, unless a longer one is already stored."""
+        session.summary, session.summarized_turns = summary, summarized_turns
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO session_summaries VALUES (?, ?, ?) ON CONFLICT(session_id) DO UPDATE SET "
+                "summary = excluded.summary, summarized_turns = excluded.summarized_turns "
+                "WHERE excluded.summarized_turns > session_summaries.summarized_turns",
+                (session.session_id, summary, summarized_turns),
+            )
+            self._conn.commit()
+
+    def purge_expired(self):
+        """Delete sessions idle for longer than the TTL, then payloads no session uses."""
+        self._last_purge = time.time()
+        cutoff = self._last_purge - self.ttl_seconds
+        with self._lock:
+            expired = [r[0] for r in self._conn.execute("SELECT session_id FROM sessions WHERE updated_at <= ?", (cutoff,))]
+            self._conn.executemany("DELETE FROM session_messages WHERE session_id = ?", [(s,) for s in expired])
+            self._conn.executemany("DELETE FROM session_summaries WHERE session_id = ?", [(s,) for s in expired])
+            self._conn.execute("DELETE FROM sessions WHERE updated_at <= ?", (cutoff,))
+            self._conn.execute(
+                "DELETE FROM session_payloads WHERE key NOT IN (SELECT DISTINCT payload_key FROM sessions)"
+            )
+            self._conn.commit()
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            payloads, payload_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM session_payloads"
+            ).fetchone()
+        return {
+            "backend": "sqlite",
+            "sessions": sessions,
+            "payloads": payloads,
+            "payload_bytes": payload_bytes,
+            "payload_cache": self.payloads.stats(),
+            "ttl_seconds": self.ttl_seconds,
+        }
+
+
+def open_session_store(config, base_dir):
+    """Build the session store described by config.json "sessions"."""
+    config = config or {}
+    ttl_seconds = config.get("ttl_seconds", DEFAULT_TTL_SECONDS)
+    if config.get("backend", "sqlite") == "memory":
+        return MemorySessionStore(config.get("max_sessions", 1000), ttl_seconds)
+    return SQLiteSessionStore(
+        Path(base_dir) / config.get("db_file", "sessions.sqlite3"),
+        ttl_seconds,
+        config.get("payload_cache_entries", 64),
+    )
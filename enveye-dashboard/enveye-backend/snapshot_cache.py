@@ -0,0 +1,120 @@
+"""
+In-process caches for stored snapshots and their comparisons.
+
+Parsed snapshots are kept in a bounded LRU keyed by (filename, mtime), so a
+file that is rewritten on disk is transparently reloaded. They are loaded
+compact (app_folder_files as a FileTable), which keeps a cached snapshot a
+fraction of its dict size and lets compare() use the columnar diff. Compare results
+(the change stream, from which reports and pages are built) are kept in a second
+LRU keyed by both (filename, mtime) pairs, which makes repeat comparisons against
+a "golden" baseline essentially free.
+"""
+import threading
+from collections import OrderedDict
+
+from snapshot_diff import build_report, iter_changes
+from snapshot_store import load_snapshot
+
+
+class LRUCache:
+    """Small thread-safe LRU with hit/miss counters."""
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard_where(self, predicate):
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+class SnapshotNotFound(Exception):
+    pass
+
+
+class SnapshotCache:
+    """Loads snapshots from `snapshot_dir` by filename and caches parses and diffs."""
+
+    def __init__(self, snapshot_dir, max_snapshots=32, max_results=256):
+        self.snapshot_dir = snapshot_dir
+        self.snapshots = LRUCache(max_snapshots)
+        self.results = LRUCache(max_results)
+
+    def resolve(self, name):
+        """Map a snapshot filename to its path, refusing anything outside the store."""
+        path = (self.snapshot_dir / name).resolve()
+        if path.parent != self.snapshot_dir.resolve() or not path.is_file():
+            raise SnapshotNotFound(name)
+        return path
+
+    def _key(self, name):
+        path = self.resolve(name)
+        return (name, path.stat().st_mtime_ns), path
+
+    def load(self, name):
+        """Return the parsed snapshot `name`, reading it from disk on a cache miss."""
+        key, path = self._key(name)
+        snapshot = self.snapshots.get(key)
+        if snapshot is None:
+            snapshot = load_snapshot(path, compact=True)
+            self.snapshots.put(key, snapshot)
+        return snapshot
+
+    def changes(self, left, right):
+        """
+        The changes between two stored snapshots by filename (see
+        snapshot_diff.iter_changes), as a tuple; cached per file version.
+        """
+        left_key, _ = self._key(left)
+        right_key, _ = self._key(right)
+        result_key = (left_key, right_key)
+
+        changes = self.results.get(result_key)
+        if changes is None:
+            changes = tuple(iter_changes(self.load(left), self.load(right)))
+            self.results.put(result_key, changes)
+        return changes
+
+    def compare(self, left, right):
+        """Diff two stored snapshots by filename, as a DeepDiff-style report."""
+        return build_report(self.changes(left, right))
+
+    def evict(self, name):
+        """Forget everything cached for `name` (e.g. after it was deleted)."""
+        self.snapshots.discard_where(lambda key: key[0] == name)
+        self.results.discard_where(lambda key: key[0][0] == name or key[1][0] == name)
+
+    def stats(self):
+        return {"snapshots": self.snapshots.stats(), "results": self.results.stats()}
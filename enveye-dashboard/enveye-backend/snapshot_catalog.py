@@ -0,0 +1,375 @@
+"""
+Persistent catalog of stored snapshots.
+
+Every snapshot written to the store gets a row in a local SQLite database with
+its host, app, OS, label, collection time, size and content hash, so listing
+and filtering no longer has to glob (and parse the names of) every file in the
+directory. Metadata comes from the snapshot body where it is recorded there
+(app name, OS, timestamp) and from the filename conventions otherwise; the
+writer can also pass it in explicitly.
+
+`rebuild` indexes an existing directory in parallel and only re-reads files
+whose size or mtime changed since they were last indexed:
+
+    python snapshot_catalog.py snapshots/<user> [--db snapshot_catalog.sqlite3] [--full]
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from snapshot_store import SNAPSHOT_READ_ERRORS, load_snapshot, snapshot_digest
+
+# Filenames look like one of
+#   {host}_{app}_{YYYYmmddHHMMSS}.json                   (/upload_snapshot)
+#   {host}_{app}_{VMTYPE}_{YYYYmmddTHHMMSS}_{label}.json (/remote_collect)
+#   {host}_{app}_{WIN|LIN|MAC}_{YYYYmmddTHHMMSS}_{LABEL}.json (agent default)
+_FILENAME_RE = re.compile(r"^(?P<prefix>.+?)_(?P<ts>\d{8}T?\d{6})(?:_(?P<label>[^.]*))?\.json$")
+_FILENAME_TS_RE = re.compile(r"^\d{8}T?\d{6}$")
+# /remote_collect writes IPs with dashes (10-0-0-5)
+_DASHED_IP_RE = re.compile(r"^\d{1,3}(?:-\d{1,3}){3}$")
+
+OS_ALIASES = {
+    "windows": "windows", "win": "windows",
+    "linux": "linux", "lin": "linux",
+    "macos": "macos", "mac": "macos", "darwin": "macos",
+}
+
+QUERY_FIELDS = ("host", "app", "os", "label")
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def normalize_os(value):
+    if not value:
+        return None
+    value = str(value).lower()
+    return OS_ALIASES.get(value, value)
+
+
+def parse_timestamp(value):
+    """Epoch seconds from an RFC 3339 / ISO string, a filename timestamp or a number."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    value = str(value)
+    if _FILENAME_TS_RE.match(value):
+        try:
+            return datetime.strptime(value.replace("T", ""), "%Y%m%d%H%M%S").timestamp()
+        except ValueError:
+            return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+
+def parse_snapshot_filename(name):
+    """Best-effort host/app/OS/label/timestamp from a snapshot filename."""
+    match = _FILENAME_RE.match(name)
+    if not match:
+        return {}
+    host, _, rest = match.group("prefix").partition("_")
+    if _DASHED_IP_RE.match(host):
+        host = host.replace("-", ".")
+    app, os_name = rest, None
+    head, _, tail = rest.rpartition("_")
+    if head and tail.lower() in OS_ALIASES:
+        app, os_name = head, OS_ALIASES[tail.lower()]
+    return {
+        "host": host or None,
+        "app": app or None,
+        "os": os_name,
+        "label": (match.group("label") or "").lower() or None,
+        "collected_at": parse_timestamp(match.group("ts")),
+    }
+
+
+def snapshot_metadata(name, snapshot):
+    """Merge metadata from the snapshot body over what the filename tells us."""
+    metadata = parse_snapshot_filename(name)
+    if isinstance(snapshot, dict):
+        context = snapshot.get("environment_context") or {}
+        os_info = context.get("os_info") if isinstance(context, dict) else None
+        if snapshot.get("application_name"):
+            metadata["app"] = snapshot["application_name"]
+        if snapshot.get("application_type"):
+            metadata["app_type"] = snapshot["application_type"]
+        if isinstance(os_info, dict) and os_info.get("name"):
+            metadata["os"] = normalize_os(os_info["name"])
+        collected_at = parse_timestamp(snapshot.get("timestamp"))
+        if collected_at is not None:
+            metadata["collected_at"] = collected_at
+    return metadata
+
+
+def describe_snapshot_file(path):
+    """
+    Read one snapshot file and return its catalog row as a dict. A snapshot
+    that can't be read (missing or corrupt objects, ...) is catalogued from
+    its filename and manifest alone.
+    Module-level so it can run in a worker process during rebuilds.
+    """
+    path = Path(path)
+    try:
+        snapshot = load_snapshot(path, compact=True)
+    except SNAPSHOT_READ_ERRORS as e:
+        if not isinstance(e, ValueError):
+            print(f"⚠️ Could not read snapshot {path.name}, cataloguing it without its body: {type(e).__name__}: {e}")
+        snapshot = None
+    return _describe(path, snapshot)
+
+
+def _describe_for_rebuild(path):
+    """describe_snapshot_file, or None (logged) if not even the manifest can be read."""
+    try:
+        return describe_snapshot_file(path)
+    except SNAPSHOT_READ_ERRORS as e:
+        print(f"⚠️ Skipping unreadable snapshot {Path(path).name}: {type(e).__name__}: {e}")
+        return None
+
+
+def _describe(path, snapshot):
+    stat = path.stat()
+    sha256, size_bytes = snapshot_digest(path)
+    metadata = snapshot_metadata(path.name, snapshot)
+    return {
+        **metadata,
+        "name": path.name,
+        "size_bytes": size_bytes,
+        "file_bytes": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256": sha256,
+        "collected_at": metadata.get("collected_at") or stat.st_mtime,
+    }
+
+
+# size_bytes is the logical snapshot size (what a manifest reassembles to);
+# file_bytes / mtime_ns are the file's own stat, what rebuild() compares.
+COLUMNS = ("name", "host", "app", "app_type", "os", "label", "collected_at", "size_bytes", "sha256",
+           "file_bytes", "mtime_ns", "indexed_at")
+INTERNAL_COLUMNS = ("file_bytes", "mtime_ns", "indexed_at")
+
+
+class SnapshotCatalog:
+    def __init__(self, db_path, snapshot_dir):
+        self.db_path = Path(db_path)
+        self.snapshot_dir = Path(snapshot_dir)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS snapshots (
+                name TEXT PRIMARY KEY,
+                host TEXT,
+                app TEXT,
+                app_type TEXT,
+                os TEXT,
+                label TEXT,
+                collected_at REAL,
+                size_bytes INTEGER,
+                sha256 TEXT,
+                file_bytes INTEGER,
+                mtime_ns INTEGER,
+                indexed_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS idx_snapshots_host ON snapshots (host, collected_at);
+            CREATE INDEX IF NOT EXISTS idx_snapshots_app ON snapshots (app, collected_at);
+            CREATE INDEX IF NOT EXISTS idx_snapshots_os ON snapshots (os, collected_at);
+            CREATE INDEX IF NOT EXISTS idx_snapshots_label ON snapshots (label, collected_at);
+            CREATE INDEX IF NOT EXISTS idx_snapshots_collected_at ON snapshots (collected_at);
+            CREATE INDEX IF NOT EXISTS idx_snapshots_sha256 ON snapshots (sha256);
+        """)
+        if "file_bytes" not in {r["name"] for r in self._conn.execute("PRAGMA table_info(snapshots)")}:
+            # Catalogs from before file_bytes; their rows get re-indexed on the next rebuild.
+            self._conn.execute("ALTER TABLE snapshots ADD COLUMN file_bytes INTEGER")
+        self._conn.commit()
+
+    def _upsert(self, rows):
+        now = time.time()
+        values = [tuple(now if c == "indexed_at" else row.get(c) for c in COLUMNS) for row in rows]
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO snapshots ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                values,
+            )
+            self._conn.commit()
+
+    def record(self, path, snapshot=None, **metadata):
+        """
+        Index a snapshot that was just written. `snapshot` is the parsed body
+        if the caller already has it; explicit `metadata` (host, app, os,
+        label, ...) wins over anything parsed.
+        """
+        path = Path(path)
+        row = describe_snapshot_file(path) if snapshot is None else _describe(path, snapshot)
+        for key, value in metadata.items():
+            if value:
+                row[key] = normalize_os(value) if key == "os" else value
+        if row.get("label"):
+            row["label"] = str(row["label"]).lower()
+        self._upsert([row])
+        return self.row_to_item(row)
+
+    def remove(self, name):
+        with self._lock:
+            self._conn.execute("DELETE FROM snapshots WHERE name = ?", (name,))
+            self._conn.commit()
+
+    def get(self, name):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM snapshots WHERE name = ?", (name,)).fetchone()
+        return self.row_to_item(row) if row else None
+
+    def position(self, name):
+        """
+        Raw row of `name` (host, app, collected_at as epoch seconds) plus the
+        names of the snapshots just before and after it from the same host
+        and app, by collection time. None if `name` isn't catalogued.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT name, host, app, collected_at FROM snapshots WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            params = (row["host"], row["app"], row["collected_at"], row["collected_at"], name)
+            before = self._conn.execute(
+                "SELECT name FROM snapshots WHERE host IS ? AND app IS ? AND (collected_at < ? OR (collected_at = ? AND name < ?)) "
+                "ORDER BY collected_at DESC, name DESC LIMIT 1", params,
+            ).fetchone()
+            after = self._conn.execute(
+                "SELECT name FROM snapshots WHERE host IS ? AND app IS ? AND (collected_at > ? OR (collected_at = ? AND name > ?)) "
+                "ORDER BY collected_at, name LIMIT 1", params,
+            ).fetchone()
+        return {**dict(row), "previous": before[0] if before else None, "next": after[0] if after else None}
+
+    def successions(self):
+        """Every row (raw) with the name of the snapshot before it from the same host and app."""
+        with self._lock:
+            return [dict(r) for r in self._conn.execute(
+                "SELECT name, host, app, collected_at, "
+                "LAG(name) OVER (PARTITION BY host, app ORDER BY collected_at, name) AS previous FROM snapshots"
+            )]
+
+    def versions(self):
+        """{name: mtime_ns} for every catalogued snapshot."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT name, mtime_ns FROM snapshots").fetchall())
+
+    @staticmethod
+    def row_to_item(row):
+        """A catalog row as returned by the API (collected_at as ISO time)."""
+        row = dict(row)
+        item = {c: row.get(c) for c in COLUMNS if c not in INTERNAL_COLUMNS}
+        if item.get("collected_at") is not None:
+            item["collected_at"] = datetime.fromtimestamp(item["collected_at"]).isoformat(timespec="seconds")
+        return item
+
+    def query(self, host=None, app=None, os=None, label=None, since=None, until=None, limit=DEFAULT_PAGE_SIZE, offset=0):
+        """
+        Newest-first page of snapshots matching every given filter.
+
+        Returns:
+            dict: {"total": matching rows, "limit", "offset", "items": [...]}
+        """
+        clauses, params = [], []
+        for column, value in (("host", host), ("app", app), ("os", normalize_os(os)), ("label", label and label.lower())):
+            if value:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        for op, value in ((">=", since), ("<=", until)):
+            ts = parse_timestamp(value)
+            if ts is not None:
+                clauses.append(f"collected_at {op} ?")
+                params.append(ts)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+        offset = max(0, int(offset or 0))
+
+        with self._lock:
+            total = self._conn.execute(f"SELECT COUNT(*) FROM snapshots {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT * FROM snapshots {where} ORDER BY collected_at DESC, name LIMIT ? OFFSET ?",
+                params + [limit, offset],
+            ).fetchall()
+        return {"total": total, "limit": limit, "offset": offset, "items": [self.row_to_item(r) for r in rows]}
+
+    def facets(self):
+        """Distinct values per filterable field, for populating filter controls."""
+        with self._lock:
+            return {
+                field: [r[0] for r in self._conn.execute(
+                    f"SELECT DISTINCT {field} FROM snapshots WHERE {field} IS NOT NULL ORDER BY {field}"
+                )]
+                for field in QUERY_FIELDS
+            }
+
+    def rebuild(self, full=False, max_workers=None):
+        """
+        Bring the catalog in line with the snapshot directory: index new or
+        changed files in parallel worker processes and drop rows for files that
+        are gone. With `full=True` every file is re-read.
+        """
+        started = time.time()
+        with self._lock:
+            known = {r["name"]: (r["file_bytes"], r["mtime_ns"]) for r in self._conn.execute(
+                "SELECT name, file_bytes, mtime_ns FROM snapshots"
+            )}
+
+        on_disk, stale = set(), []
+        with os.scandir(self.snapshot_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json") or not entry.is_file():
+                    continue
+                on_disk.add(entry.name)
+                stat = entry.stat()
+                if full or known.get(entry.name) != (stat.st_size, stat.st_mtime_ns):
+                    stale.append(entry.path)
+
+        described = []
+        if stale:
+            if len(stale) == 1 or max_workers == 1:
+                described = [_describe_for_rebuild(p) for p in stale]
+            else:
+                with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                    described = list(pool.map(_describe_for_rebuild, stale, chunksize=max(1, len(stale) // 64)))
+        rows = [row for row in described if row is not None]
+        if rows:
+            self._upsert(rows)
+
+        removed = [name for name in known if name not in on_disk]
+        if removed:
+            with self._lock:
+                self._conn.executemany("DELETE FROM snapshots WHERE name = ?", [(n,) for n in removed])
+                self._conn.commit()
+
+        return {
+            "files": len(on_disk),
+            "indexed": len(rows),
+            "skipped": len(described) - len(rows),
+            "removed": len(removed),
+            "seconds": round(time.time() - started, 3),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the snapshot catalog from a snapshot directory.")
+    parser.add_argument("snapshot_dir", type=Path)
+    parser.add_argument("--db", type=Path, default=Path(__file__).resolve().parent / "snapshot_catalog.sqlite3")
+    parser.add_argument("--full", action="store_true", help="Re-read every file, not only new or changed ones")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    catalog = SnapshotCatalog(args.db, args.snapshot_dir)
+    print(json.dumps(catalog.rebuild(full=args.full, max_workers=args.workers), indent=2))
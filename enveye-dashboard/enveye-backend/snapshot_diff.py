@@ -0,0 +1,223 @@
+"""
+Snapshot-aware diff engine for EnvEye environment contexts.
+
+Replaces the generic DeepDiff walk used by /compare. Snapshots produced by the
+agent have a fixed shape, so we can join `app_folder_files` on the file path
+and compare `sha256` / `size_bytes` / `modified` directly, and treat the other
+sections (`required_services_status`, `critical_environment_variables`,
+`os_info`, ...) as flat maps. Cost is linear in the number of entries.
+
+The report uses the same layout as `json.loads(DeepDiff(..., view='tree').to_json())`
+so the frontend (DiffTable.jsx) and the AI prompt keep working unchanged:
+
+    {
+        "type_changes":            {path: {old_type, new_type, old_value, new_value}},
+        "dictionary_item_added":   {path: value},
+        "dictionary_item_removed": {path: value},
+        "values_changed":          {path: {new_value, old_value}},
+    }
+
+Paths are rendered the DeepDiff way, e.g. root['app_folder_files']['bin\\app.dll']['sha256'].
+Lists are compared as whole values and reported under `values_changed`.
+
+`app_folder_files` may also be a FileTable (see file_table.py), as in
+snapshots loaded with `compact=True`; two tables are diffed with a sorted
+merge over their columns, and only the entries that differ are built.
+
+The report is collected from a stream of changes (iter_changes), which
+callers can also consume directly to filter, page or stream a diff without
+building the whole report (see diff_pages.py).
+"""
+from collections.abc import Mapping
+
+from file_table import FileTable, diff_rows
+
+FILES_SECTION = "app_folder_files"
+FILE_FIELDS = ("sha256", "size_bytes", "modified")
+FILE_FIELD_SET = frozenset(FILE_FIELDS)
+
+_MISSING = object()
+
+REPORT_TYPES = ("type_changes", "dictionary_item_added", "dictionary_item_removed", "values_changed")
+
+
+def format_key(key):
+    """Render a dict key as a DeepDiff path element (`['key']`)."""
+    if not isinstance(key, str):
+        return f"[{key}]"
+    has_quote = "'" in key
+    has_double_quote = '"' in key
+    if has_quote and has_double_quote:
+        return "[" + repr(key) + "]"
+    if has_quote:
+        return f'["{key}"]'
+    return f"['{key}']"
+
+
+def new_report():
+    return {report_type: {} for report_type in REPORT_TYPES}
+
+
+def finalize_report(report):
+    """Drop empty report types, like DeepDiff does."""
+    return {report_type: entries for report_type, entries in report.items() if entries}
+
+
+def build_report(changes):
+    """Collect a stream of changes into a DeepDiff-style report."""
+    report = new_report()
+    for report_type, _, _, path, value in changes:
+        report[report_type][path] = value
+    return finalize_report(report)
+
+
+def _value_change(section, key, path, old_value, new_value):
+    if type(old_value) is not type(new_value):
+        return ("type_changes", section, key, path, {
+            "old_type": type(old_value).__name__,
+            "new_type": type(new_value).__name__,
+            "old_value": old_value,
+            "new_value": new_value,
+        })
+    return ("values_changed", section, key, path, {"new_value": new_value, "old_value": old_value})
+
+
+def mapping_changes(old, new, path, section, key=None):
+    """Changes between two (possibly nested) dicts, key by key."""
+    for item_key, old_value in old.items():
+        key_path = path + format_key(item_key)
+        top_key = item_key if key is None else key
+        if item_key not in new:
+            yield ("dictionary_item_removed", section, top_key, key_path, old_value)
+            continue
+        new_value = new[item_key]
+        if old_value == new_value and type(old_value) is type(new_value):
+            continue
+        if isinstance(old_value, dict) and isinstance(new_value, dict):
+            yield from mapping_changes(old_value, new_value, key_path, section, top_key)
+        else:
+            yield _value_change(section, top_key, key_path, old_value, new_value)
+
+    for item_key, new_value in new.items():
+        if item_key not in old:
+            yield ("dictionary_item_added", section, item_key if key is None else key,
+                   path + format_key(item_key), new_value)
+
+
+def file_entry_changes(old_entry, new_entry, path, section, file_path):
+    """Changes of one `app_folder_files` entry, field by field."""
+    if not (isinstance(old_entry, dict) and isinstance(new_entry, dict)):
+        yield _value_change(section, file_path, path, old_entry, new_entry)
+        return
+
+    # Entries with missing or extra fields fall back to a generic map diff.
+    if old_entry.keys() != FILE_FIELD_SET or new_entry.keys() != FILE_FIELD_SET:
+        yield from mapping_changes(old_entry, new_entry, path, section, file_path)
+        return
+
+    for field in FILE_FIELDS:
+        old_value = old_entry[field]
+        new_value = new_entry[field]
+        if old_value != new_value or type(old_value) is not type(new_value):
+            yield _value_change(section, file_path, path + format_key(field), old_value, new_value)
+
+
+def app_folder_files_changes(old_files, new_files, section=FILES_SECTION):
+    """Set-based join of two file maps on their relative path."""
+    path = "root" + format_key(section)
+    for file_path, old_entry in old_files.items():
+        new_entry = new_files.get(file_path, _MISSING)
+        if new_entry is _MISSING:
+            yield ("dictionary_item_removed", section, file_path, path + format_key(file_path), old_entry)
+        elif old_entry != new_entry:
+            yield from file_entry_changes(old_entry, new_entry, path + format_key(file_path), section, file_path)
+
+    for file_path, new_entry in new_files.items():
+        if file_path not in old_files:
+            yield ("dictionary_item_added", section, file_path, path + format_key(file_path), new_entry)
+
+
+def file_table_changes(old_table, new_table, section=FILES_SECTION):
+    """app_folder_files_changes() for two FileTables."""
+    path = "root" + format_key(section)
+    for file_path, old_row, new_row in diff_rows(old_table, new_table):
+        file_key_path = path + format_key(file_path)
+        if new_row is None:
+            yield ("dictionary_item_removed", section, file_path, file_key_path, old_table.entry(old_row))
+        elif old_row is None:
+            yield ("dictionary_item_added", section, file_path, file_key_path, new_table.entry(new_row))
+        else:
+            yield from file_entry_changes(
+                old_table.entry(old_row), new_table.entry(new_row), file_key_path, section, file_path
+            )
+
+
+def _plain(value):
+    """Tables go into reports as the dicts they stand for."""
+    return value.to_dict() if isinstance(value, FileTable) else value
+
+
+def iter_context_changes(old_context, new_context):
+    """
+    Changes between two `environment_context` dicts, in a stable order:
+    section by section as they appear in the old context (file tables by
+    path), then sections only the new one has.
+
+    Yields:
+        tuple: (report_type, section, key, path, value), where `key` is the
+        top-level item of the section the change is under (file path,
+        service, variable), or None when a whole section was added, removed
+        or replaced, and `path` / `value` are as in the report.
+    """
+    old_context = old_context or {}
+    new_context = new_context or {}
+
+    for section, old_section in old_context.items():
+        section_path = "root" + format_key(section)
+        if section not in new_context:
+            yield ("dictionary_item_removed", section, None, section_path, _plain(old_section))
+            continue
+        new_section = new_context[section]
+        if isinstance(old_section, FileTable) and isinstance(new_section, FileTable):
+            yield from file_table_changes(old_section, new_section, section)
+        elif not (isinstance(old_section, Mapping) and isinstance(new_section, Mapping)):
+            if old_section != new_section or type(old_section) is not type(new_section):
+                yield _value_change(section, None, section_path, _plain(old_section), _plain(new_section))
+        elif section == FILES_SECTION:
+            yield from app_folder_files_changes(old_section, new_section, section)
+        else:
+            yield from mapping_changes(old_section, new_section, section_path, section)
+
+    for section, new_section in new_context.items():
+        if section not in old_context:
+            yield ("dictionary_item_added", section, None, "root" + format_key(section), _plain(new_section))
+
+
+def iter_changes(old_snapshot, new_snapshot):
+    """iter_context_changes() for two parsed snapshot documents."""
+    return iter_context_changes(
+        old_snapshot.get("environment_context", {}),
+        new_snapshot.get("environment_context", {}),
+    )
+
+
+def diff_environment_context(old_context, new_context):
+    """
+    Diff two `environment_context` dicts.
+
+    Args:
+        old_context (dict): environment_context of the first (baseline) snapshot.
+        new_context (dict): environment_context of the second snapshot.
+
+    Returns:
+        dict: DeepDiff-style report (see module docstring). Empty when identical.
+    """
+    return build_report(iter_context_changes(old_context, new_context))
+
+
+def diff_snapshots(old_snapshot, new_snapshot):
+    """Diff the `environment_context` of two parsed snapshot documents."""
+    return diff_environment_context(
+        old_snapshot.get("environment_context", {}),
+        new_snapshot.get("environment_context", {}),
+    )
@@ -0,0 +1,398 @@
+"""
+Fleet-wide inverted index over stored snapshots.
+
+Answers "which snapshots contain widevinecdm.dll with this sha256?", "where
+is service W stopped?" or "where is APP_ENV set to staging?" from SQLite,
+without opening any snapshot.
+
+Every leaf of a snapshot's environment context is a term (section, item,
+value). Keys are the flattened ones fleet_compare and the drift timeline use:
+- for app_folder_files, the item is the file path and the value its sha256;
+- for services, the name and status;
+- for environment variables, the name and value;
+- and so on for the other sections.
+Each term also gets a lower-cased `leaf`: the file name for files, the item
+itself otherwise. So `widevinecdm.dll` matches the file wherever it lives,
+and service and variable names match regardless of case.
+
+Terms are posted against *units* rather than snapshots. In the sectioned
+store a unit is one section object (a chunk of app_folder_files, the
+services map, ...), and every snapshot with the same content shares it, so a
+fleet of near-identical hosts costs little more than one host. A plain JSON
+snapshot or a delta is a unit of its own. A query finds the matching units,
+then the snapshots referencing them, joined with the catalog for host, app
+and collection time.
+
+Snapshots are indexed as they are catalogued. A unit another snapshot
+already indexed isn't read again. rebuild() catches up with the catalog and
+reads new units in a process pool:
+
+    python snapshot_index.py snapshots/<user> [--db snapshot_catalog.sqlite3] [--full]
+"""
+import argparse
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from fleet_compare import flatten_context, flatten_snapshot, render_value
+from snapshot_catalog import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, SnapshotCatalog
+from snapshot_diff import FILES_SECTION
+from snapshot_store import MANIFEST_FORMAT, SNAPSHOT_READ_ERRORS, load_snapshot, read_manifest, read_section
+
+SERVICES_SECTION = "required_services_status"
+VARIABLES_SECTION = "critical_environment_variables"
+# Most terms a single query may match (e.g. every service that is "Stopped")
+MAX_QUERY_TERMS = 10000
+
+
+def term_leaf(section, item):
+    if section == FILES_SECTION:
+        item = item.replace("\\", "/").rsplit("/", 1)[-1]
+    return item.lower()
+
+
+def term_query(file=None, sha256=None, service=None, status=None, variable=None, value=None, section=None, item=None):
+    """
+    search() arguments for the API's query parameters: a file (a path, or
+    just its name) and/or its sha256, a service and/or its status, or an
+    environment variable and/or its value; or a raw section / item / value.
+
+    Raises:
+        ValueError: If parameters of different kinds are mixed.
+    """
+    families = [
+        name for name, given in (("file", file or sha256), ("service", service or status), ("variable", variable))
+        if given
+    ]
+    if len(families) > 1 or (families and section):
+        raise ValueError("Search for one kind of term at a time (file, service, variable or section).")
+    if file or sha256:
+        if value:
+            raise ValueError("Use 'sha256' for a file's value.")
+        query = {"section": FILES_SECTION, "value": sha256.lower() if sha256 else None}
+        if file and ("/" in file or "\\" in file):
+            query["item"] = file
+        elif file:
+            query["leaf"] = file
+        return query
+    if service or status:
+        if value:
+            raise ValueError("Use 'status' for a service's value.")
+        return {"section": SERVICES_SECTION, "leaf": service, "value": status}
+    if variable:
+        return {"section": VARIABLES_SECTION, "leaf": variable, "value": value}
+    return {"section": section, "item": item, "value": value}
+
+
+def context_terms(flat):
+    """[(section, item, value, leaf)] for a flattened context (see fleet_compare.flatten_context)."""
+    terms = []
+    for parts, value in flat.items():
+        if len(parts) == 1 and value == ():  # an empty section
+            continue
+        section = str(parts[0])
+        item = "/".join(str(part) for part in parts[1:])
+        text = value if isinstance(value, str) else json.dumps(render_value(value), ensure_ascii=False)
+        terms.append((section, item, text, term_leaf(section, item)))
+    return terms
+
+
+def snapshot_units(path):
+    """
+    [(unit key, unit spec)] making up the stored snapshot at `path`: its
+    section objects if it is a sectioned manifest, otherwise the whole file.
+    """
+    path = Path(path)
+    manifest = read_manifest(path)
+    if manifest and manifest["format"] == MANIFEST_FORMAT and manifest["sectioned"]:
+        return [(f"{key}:{digest}", ("section", key, digest, codec)) for key, _, digest, codec in manifest["sections"]]
+    return [(f"file:{path.name}:{path.stat().st_mtime_ns}", ("file",))]
+
+
+def unit_terms(path, spec):
+    """Terms of one unit of the snapshot at `path`. Module-level so it can run in a worker process."""
+    if spec[0] == "section":
+        _, key, digest, codec = spec
+        return context_terms(flatten_context({key: read_section(path, digest, codec)}))
+    return context_terms(flatten_snapshot(load_snapshot(path, compact=True)))
+
+
+def _unit_terms_task(args):
+    """unit_terms, or None (logged) if the unit can't be read."""
+    try:
+        return unit_terms(*args)
+    except SNAPSHOT_READ_ERRORS as e:
+        print(f"⚠️ Could not index {Path(args[0]).name} ({args[1][0]}): {type(e).__name__}: {e}")
+        return None
+
+
+class SnapshotIndex:
+    """Inverted index from context terms to snapshots, kept in the catalog database."""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.snapshot_dir = catalog.snapshot_dir
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(catalog.db_path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS index_units (
+                unit_id INTEGER PRIMARY KEY,
+                key TEXT UNIQUE NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS index_terms (
+                term_id INTEGER PRIMARY KEY,
+                section TEXT NOT NULL,
+                item TEXT NOT NULL,
+                value TEXT NOT NULL,
+                leaf TEXT NOT NULL,
+                UNIQUE (section, item, value)
+            );
+            CREATE INDEX IF NOT EXISTS idx_index_terms_leaf ON index_terms (section, leaf, value);
+            CREATE INDEX IF NOT EXISTS idx_index_terms_value ON index_terms (value);
+            CREATE TABLE IF NOT EXISTS index_postings (
+                term_id INTEGER NOT NULL,
+                unit_id INTEGER NOT NULL,
+                PRIMARY KEY (term_id, unit_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_index_postings_unit ON index_postings (unit_id);
+            CREATE TABLE IF NOT EXISTS index_refs (
+                name TEXT NOT NULL,
+                unit_id INTEGER NOT NULL,
+                PRIMARY KEY (name, unit_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_index_refs_unit ON index_refs (unit_id);
+            CREATE TABLE IF NOT EXISTS index_snapshots (
+                name TEXT PRIMARY KEY,
+                mtime_ns INTEGER
+            );
+            CREATE TEMP TABLE IF NOT EXISTS staged_terms (
+                unit_id INTEGER, section TEXT, item TEXT, value TEXT, leaf TEXT
+            );
+            CREATE TEMP TABLE IF NOT EXISTS query_terms (
+                term_id INTEGER PRIMARY KEY
+            );
+        """)
+        self._conn.commit()
+
+    def _unit_ids(self, keys):
+        ids = {}
+        for key in keys:
+            row = self._conn.execute("SELECT unit_id FROM index_units WHERE key = ?", (key,)).fetchone()
+            if row:
+                ids[key] = row[0]
+        return ids
+
+    def _drop_orphans(self, unit_ids):
+        """Delete the given units (and their postings) if no snapshot references them any more."""
+        orphans = [(u,) for u in unit_ids
+                   if self._conn.execute("SELECT 1 FROM index_refs WHERE unit_id = ? LIMIT 1", (u,)).fetchone() is None]
+        self._conn.executemany("DELETE FROM index_postings WHERE unit_id = ?", orphans)
+        self._conn.executemany("DELETE FROM index_units WHERE unit_id = ?", orphans)
+        return len(orphans)
+
+    def _store(self, snapshots, unit_terms_by_key):
+        """
+        snapshots: [(name, mtime_ns, [unit keys])]; unit_terms_by_key: terms
+        of the units that aren't indexed yet.
+        """
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO index_units (key) VALUES (?)", [(k,) for k in unit_terms_by_key])
+            unit_ids = self._unit_ids(unit_terms_by_key)
+            for key, terms in unit_terms_by_key.items():
+                unit_id = unit_ids[key]
+                self._conn.executemany(
+                    "INSERT INTO staged_terms VALUES (?, ?, ?, ?, ?)", [(unit_id, *term) for term in terms]
+                )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO index_terms (section, item, value, leaf) "
+                "SELECT section, item, value, leaf FROM staged_terms"
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO index_postings (term_id, unit_id) SELECT t.term_id, s.unit_id FROM staged_terms s "
+                "JOIN index_terms t ON t.section = s.section AND t.item = s.item AND t.value = s.value"
+            )
+            self._conn.execute("DELETE FROM staged_terms")
+
+            replaced = set()
+            for name, mtime_ns, keys in snapshots:
+                replaced.update(r[0] for r in self._conn.execute("SELECT unit_id FROM index_refs WHERE name = ?", (name,)))
+                self._conn.execute("DELETE FROM index_refs WHERE name = ?", (name,))
+                unit_ids = self._unit_ids(keys)
+                self._conn.executemany("INSERT OR IGNORE INTO index_refs VALUES (?, ?)", [(name, u) for u in unit_ids.values()])
+                self._conn.execute("INSERT OR REPLACE INTO index_snapshots VALUES (?, ?)", (name, mtime_ns))
+            self._drop_orphans(replaced)
+            self._conn.commit()
+
+    def _missing_units(self, units):
+        with self._lock:
+            known = self._unit_ids(key for key, _ in units)
+        return [(key, spec) for key, spec in units if key not in known]
+
+    def record(self, name):
+        """Index a newly catalogued (or rewritten) snapshot; units already indexed are only referenced."""
+        path = self.snapshot_dir / name
+        if not path.is_file():
+            return None
+        units = snapshot_units(path)
+        missing = self._missing_units(units)
+        self._store([(name, path.stat().st_mtime_ns, [key for key, _ in units])],
+                    {key: unit_terms(path, spec) for key, spec in missing})
+        return {"units": len(units), "indexed_units": len(missing)}
+
+    def remove(self, name):
+        with self._lock:
+            unit_ids = [r[0] for r in self._conn.execute("SELECT unit_id FROM index_refs WHERE name = ?", (name,))]
+            self._conn.execute("DELETE FROM index_refs WHERE name = ?", (name,))
+            self._conn.execute("DELETE FROM index_snapshots WHERE name = ?", (name,))
+            self._drop_orphans(unit_ids)
+            self._conn.commit()
+
+    def rebuild(self, full=False, max_workers=None):
+        """
+        Bring the index in line with the catalog: forget snapshots that are
+        gone and index new or rewritten ones, reading each distinct unit once,
+        in parallel. With `full=True` everything is re-read.
+        """
+        started = time.time()
+        expected = self.catalog.versions()
+        with self._lock:
+            if full:
+                for table in ("index_postings", "index_refs", "index_units", "index_terms", "index_snapshots"):
+                    self._conn.execute(f"DELETE FROM {table}")
+                self._conn.commit()
+            known = dict(self._conn.execute("SELECT name, mtime_ns FROM index_snapshots").fetchall())
+
+        gone = [name for name in known if name not in expected]
+        for name in gone:
+            self.remove(name)
+
+        snapshots, tasks = [], {}
+        for name, mtime_ns in expected.items():
+            path = self.snapshot_dir / name
+            if known.get(name) == mtime_ns or not path.is_file():
+                continue
+            try:
+                units = snapshot_units(path)
+            except SNAPSHOT_READ_ERRORS as e:
+                print(f"⚠️ Could not index {name}: {type(e).__name__}: {e}")
+                continue
+            snapshots.append((name, mtime_ns, [key for key, _ in units]))
+            for key, spec in units:
+                tasks.setdefault(key, (str(path), spec))
+        missing = self._missing_units(list(tasks.items()))
+        tasks = {key: tasks[key] for key, _ in missing}
+
+        keys = list(tasks)
+        if len(keys) <= 1 or max_workers == 1:
+            results = [_unit_terms_task(tasks[key]) for key in keys]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                results = list(pool.map(_unit_terms_task, [tasks[key] for key in keys],
+                                        chunksize=max(1, len(keys) // 64)))
+        terms = {key: result for key, result in zip(keys, results) if result is not None}
+        # A snapshot with an unreadable unit is left out, to be retried on the next rebuild.
+        snapshots = [s for s in snapshots if all(key in terms or key not in tasks for key in s[2])]
+        if snapshots:
+            self._store(snapshots, terms)
+        if gone or full:
+            with self._lock:
+                self._conn.execute("DELETE FROM index_terms WHERE term_id NOT IN (SELECT term_id FROM index_postings)")
+                self._conn.commit()
+
+        return {"snapshots": len(expected), "indexed": len(snapshots), "units_read": len(keys),
+                "removed": len(gone), "seconds": round(time.time() - started, 3)}
+
+    def search(self, section=None, item=None, leaf=None, value=None, host=None, app=None,
+               limit=DEFAULT_PAGE_SIZE, offset=0):
+        """
+        Newest-first page of snapshots holding a term that matches every given
+        field: `item` exactly, `leaf` case-insensitively (a file name, service
+        or variable), `value` exactly. Each item lists the matching terms.
+
+        Raises:
+            ValueError: If no term field is given or too many terms match.
+        """
+        clauses, params = [], []
+        for column, field in (("section", section), ("item", item), ("leaf", leaf and leaf.lower()), ("value", value)):
+            if field is not None:
+                clauses.append(f"{column} = ?")
+                params.append(field)
+        if not any(field is not None for field in (item, leaf, value)):
+            raise ValueError("Give at least one of item, leaf or value.")
+        snapshot_clauses, snapshot_params = [], []
+        for column, field in (("host", host), ("app", app)):
+            if field:
+                snapshot_clauses.append(f"s.{column} = ?")
+                snapshot_params.append(field)
+        limit = max(1, min(int(limit or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+        offset = max(0, int(offset or 0))
+
+        with self._lock:
+            terms = {r["term_id"]: r for r in self._conn.execute(
+                f"SELECT term_id, section, item, value FROM index_terms WHERE {' AND '.join(clauses)} LIMIT ?",
+                params + [MAX_QUERY_TERMS + 1],
+            )}
+            if len(terms) > MAX_QUERY_TERMS:
+                raise ValueError(f"More than {MAX_QUERY_TERMS} terms match; narrow the query.")
+            self._conn.execute("DELETE FROM query_terms")
+            self._conn.executemany("INSERT INTO query_terms VALUES (?)", [(t,) for t in terms])
+            # CROSS JOIN pins the join order: from the few matching terms to
+            # their units to the snapshots, never the other way round.
+            matching = (
+                "SELECT DISTINCT r.name FROM query_terms q CROSS JOIN index_postings p ON p.term_id = q.term_id "
+                "CROSS JOIN index_refs r ON r.unit_id = p.unit_id"
+            )
+            where = " AND ".join(["s.name IN (SELECT name FROM matching)", *snapshot_clauses])
+            total = self._conn.execute(
+                f"WITH matching AS ({matching}) SELECT COUNT(*) FROM snapshots s WHERE {where}", snapshot_params
+            ).fetchone()[0]
+            rows = self._conn.execute(
+                f"WITH matching AS ({matching}) SELECT * FROM snapshots s WHERE {where} "
+                "ORDER BY s.collected_at DESC, s.name LIMIT ? OFFSET ?",
+                snapshot_params + [limit, offset],
+            ).fetchall()
+            names = [r["name"] for r in rows]
+            hits = {}
+            for name in names:
+                hits[name] = [r[0] for r in self._conn.execute(
+                    "SELECT DISTINCT q.term_id FROM query_terms q CROSS JOIN index_postings p ON p.term_id = q.term_id "
+                    "CROSS JOIN index_refs r ON r.unit_id = p.unit_id WHERE r.name = ?", (name,),
+                )]
+            self._conn.execute("DELETE FROM query_terms")
+            self._conn.commit()
+
+        items = []
+        for row in rows:
+            item_dict = SnapshotCatalog.row_to_item(row)
+            item_dict["matches"] = [
+                {"section": terms[t]["section"], "item": terms[t]["item"], "value": terms[t]["value"]}
+                for t in sorted(hits[row["name"]])
+            ]
+            items.append(item_dict)
+        return {"total": total, "limit": limit, "offset": offset, "items": items}
+
+    def stats(self):
+        with self._lock:
+            return {
+                table: self._conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table in ("index_snapshots", "index_units", "index_terms", "index_postings", "index_refs")
+            }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the inverted index for a snapshot directory.")
+    parser.add_argument("snapshot_dir", type=Path)
+    parser.add_argument("--db", type=Path, default=Path(__file__).resolve().parent / "snapshot_catalog.sqlite3")
+    parser.add_argument("--full", action="store_true", help="Re-read every snapshot, not only new or changed ones")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    catalog = SnapshotCatalog(args.db, args.snapshot_dir)
+    catalog.rebuild(max_workers=args.workers)
+    index = SnapshotIndex(catalog)
+    print(json.dumps(index.rebuild(full=args.full, max_workers=args.workers), indent=2))
+    print(json.dumps(index.stats(), indent=2))
@@ -0,0 +1,184 @@
+"""
+Streaming ingest for uploaded snapshots.
+
+An upload is copied to a temporary file in the snapshot directory in fixed
+size chunks and then validated with an incremental JSON parser (ijson, if
+installed), which also picks out the few fields the catalog needs. Neither
+step holds the document in memory, so peak memory scales with the chunk size
+rather than the snapshot. Without ijson the file is validated with
+`json.load` instead, still off the event loop.
+
+read_compact_snapshot() parses a plain snapshot incrementally too, packing
+its app_folder_files into a FileTable as the entries stream past (see
+file_table.py), so the per-file dicts never all exist at once.
+
+Both steps are blocking and are meant to run in a worker thread.
+"""
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from file_table import FILES_KEY, SECTIONED_KEY, FileTable, compact_snapshot
+
+try:
+    import ijson
+except ImportError:  # optional; falls back to a full json.load
+    ijson = None
+
+DEFAULT_CHUNK_BYTES = 1024 * 1024
+PART_SUFFIX = ".part"
+
+# Fields kept while scanning: everything snapshot_metadata() and delta
+# handling look at, as ijson prefixes.
+METADATA_PREFIXES = {
+    "application_name",
+    "application_type",
+    "timestamp",
+    "delta_format",
+    "base",
+    "base_timestamp",
+    "environment_context.os_info.name",
+}
+SCALAR_EVENTS = {"string", "number", "boolean", "null"}
+CONTAINER_STARTS = {"start_map", "start_array"}
+CONTAINER_ENDS = {"end_map", "end_array"}
+FILES_PREFIX = f"{SECTIONED_KEY}.{FILES_KEY}"
+
+
+class InvalidSnapshot(ValueError):
+    pass
+
+
+def spool_upload(fileobj, dest_dir, chunk_size=DEFAULT_CHUNK_BYTES):
+    """
+    Copy an uploaded file object to a temporary `*.part` file in `dest_dir`
+    (same filesystem as the store, so it can be renamed into place).
+
+    Returns:
+        Path: The temporary file.
+    """
+    fd, tmp = tempfile.mkstemp(dir=dest_dir, prefix=".upload-", suffix=PART_SUFFIX)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = fileobj.read(chunk_size)
+                if not chunk:
+                    break
+                out.write(chunk)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return Path(tmp)
+
+
+def _nest(flat):
+    """{'a.b': v} -> {'a': {'b': v}}"""
+    nested = {}
+    for prefix, value in flat.items():
+        *parents, leaf = prefix.split(".")
+        node = nested
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[leaf] = value
+    return nested
+
+
+def _metadata_of(document):
+    flat = {}
+    for prefix in METADATA_PREFIXES:
+        node = document
+        for part in prefix.split("."):
+            node = node.get(part) if isinstance(node, dict) else None
+        if node is not None:
+            flat[prefix] = node
+    return _nest(flat)
+
+
+def scan_snapshot_file(path, chunk_size=DEFAULT_CHUNK_BYTES):
+    """
+    Validate that `path` holds a single JSON object and return its metadata
+    fields, shaped like a (very sparse) snapshot.
+
+    Raises:
+        InvalidSnapshot: If the file isn't a well-formed JSON object.
+    """
+    if ijson is None:
+        try:
+            with open(path, "rb") as f:
+                document = json.load(f)
+        except ValueError as e:
+            raise InvalidSnapshot(str(e)) from e
+        if not isinstance(document, dict):
+            raise InvalidSnapshot("Snapshot must be a JSON object")
+        return _metadata_of(document)
+
+    flat = {}
+    try:
+        with open(path, "rb") as f:
+            events = ijson.parse(f, buf_size=chunk_size)
+            first = next(events, None)
+            if first is None or first[1] != "start_map":
+                raise InvalidSnapshot("Snapshot must be a JSON object")
+            for prefix, event, value in events:
+                if event in SCALAR_EVENTS and prefix in METADATA_PREFIXES:
+                    flat[prefix] = value
+    except ijson.JSONError as e:
+        raise InvalidSnapshot(str(e)) from e
+    return _nest(flat)
+
+
+def _skip_container(events):
+    """Consume events up to the end of the container whose start was just read."""
+    depth = 1
+    for _, event, _ in events:
+        if event in CONTAINER_STARTS:
+            depth += 1
+        elif event in CONTAINER_ENDS:
+            depth -= 1
+            if not depth:
+                return
+
+
+def read_compact_snapshot(fileobj, chunk_size=DEFAULT_CHUNK_BYTES):
+    """
+    Parse a plain JSON snapshot from a seekable binary file object, with its
+    app_folder_files as a FileTable built straight from the stream.
+
+    Two passes: the file entries are streamed into the table first, then the
+    rest of the document is parsed with that map skipped.
+
+    Raises:
+        InvalidSnapshot: If it isn't a well-formed JSON object.
+    """
+    if ijson is None:
+        try:
+            document = json.load(fileobj)
+        except ValueError as e:
+            raise InvalidSnapshot(str(e)) from e
+        if not isinstance(document, dict):
+            raise InvalidSnapshot("Snapshot must be a JSON object")
+        return compact_snapshot(document)
+
+    start = fileobj.tell()
+    builder = ijson.ObjectBuilder()
+    has_files = False
+    try:
+        table = FileTable.from_items(ijson.kvitems(fileobj, FILES_PREFIX, buf_size=chunk_size, use_float=True))
+        fileobj.seek(start)
+        events = ijson.parse(fileobj, buf_size=chunk_size, use_float=True)
+        for prefix, event, value in events:
+            if prefix == FILES_PREFIX and event == "start_map" and len(builder.containers) == 2:
+                builder.event("null", None)  # placeholder keeps the key's position
+                _skip_container(events)
+                has_files = True
+            else:
+                builder.event(event, value)
+    except ijson.JSONError as e:
+        raise InvalidSnapshot(str(e)) from e
+    document = getattr(builder, "value", None)
+    if not isinstance(document, dict):
+        raise InvalidSnapshot("Snapshot must be a JSON object")
+    if has_files:
+        document[SECTIONED_KEY][FILES_KEY] = table
+    return document
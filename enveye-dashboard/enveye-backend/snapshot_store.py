@@ -0,0 +1,572 @@
+"""
+Content-addressed, compressed snapshot storage.
+
+A stored snapshot `<name>.json` is a small manifest: the top-level fields
+inline, plus an ordered list of section hashes. Sections are one per
+`environment_context` key, except `app_folder_files`, which is cut into
+chunks at content-defined boundaries (a path whose hash hits a fixed bit
+pattern ends a chunk), so adding or removing one file only changes the chunk
+it lands in. Each section is stored once under `objects/` by the sha256 of
+its JSON, compressed with zstd when `zstandard` is installed and gzip
+otherwise. Near-identical snapshots of the same host share almost all of
+their sections.
+
+A snapshot can also be stored as a delta: the name of a base snapshot plus
+the app_folder_files entries added, modified and removed since (and any other
+environment_context keys that changed), as produced by `enveye-agent --base`.
+Deltas are applied when read; chains are capped at `max_delta_depth`, beyond
+which the snapshot is written out in full instead. Deleting a snapshot first
+rewrites any deltas based on it as full snapshots.
+
+Plain JSON snapshot files (written before this store existed, or with the
+"files" backend) are still read transparently; `load_snapshot` and
+`iter_snapshot_json` handle all three forms, and `load_snapshot(...,
+compact=True)` reads any of them with app_folder_files as a FileTable.
+
+    python snapshot_store.py migrate snapshots/<user>   # convert plain files in place
+    python snapshot_store.py gc snapshots/<user>        # drop unreferenced sections
+    python snapshot_store.py compact snapshots/<user>   # flatten over-long delta chains
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+import zlib
+from pathlib import Path
+
+from file_table import FileTable, compact_snapshot
+from snapshot_ingest import read_compact_snapshot
+
+try:
+    import zstandard
+except ImportError:  # optional; gzip is always available
+    zstandard = None
+
+MANIFEST_FORMAT = "enveye-sections/1"
+DELTA_FORMAT = "enveye-delta/1"
+# Every stored (non-plain) form starts with this, so a few bytes tell them apart.
+STORED_PREFIX = b'{"format":"enveye-'
+OBJECTS_DIR = "objects"
+SECTIONED_KEY = "environment_context"
+CHUNKED_KEY = "app_folder_files"
+CODEC_SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+READ_CHUNK = 1024 * 1024
+# A write stores its objects before its manifest, so gc spares objects written
+# or reused (touched) this recently even if no manifest refers to them yet.
+DEFAULT_GC_GRACE_SECONDS = 3600
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _compress(data, codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Snapshot section is zstd-compressed but 'zstandard' is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def default_codec():
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def is_manifest(head):
+    return head.startswith(STORED_PREFIX)
+
+
+def is_delta_document(document):
+    """True for a delta as sent by the agent (not yet stored)."""
+    return isinstance(document, dict) and document.get("delta_format") == DELTA_FORMAT
+
+
+class DeltaBaseNotFound(Exception):
+    pass
+
+
+# What reading a damaged store can raise: a missing or truncated object, bad
+# compression or JSON, a malformed manifest, a delta whose base is gone.
+SNAPSHOT_READ_ERRORS = (OSError, EOFError, ValueError, KeyError, TypeError, RuntimeError, zlib.error,
+                        DeltaBaseNotFound) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+def objects_dir_for(path):
+    return Path(path).parent / OBJECTS_DIR
+
+
+def _object_path(objects_dir, digest, codec):
+    return objects_dir / digest[:2] / (digest + CODEC_SUFFIXES[codec])
+
+
+def _atomic_write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def chunk_files(files, boundary_bits=8):
+    """
+    Split an app_folder_files mapping into ordered chunks. A chunk ends after
+    any path whose hash has its low `boundary_bits` bits clear (~2**bits files
+    per chunk on average), independent of what else is in the mapping.
+    """
+    mask = (1 << boundary_bits) - 1
+    chunk = {}
+    for path, entry in files.items():
+        chunk[path] = entry
+        digest = hashlib.blake2b(path.encode("utf-8", "surrogatepass"), digest_size=8).digest()
+        if int.from_bytes(digest, "little") & mask == 0:
+            yield chunk
+            chunk = {}
+    if chunk:
+        yield chunk
+
+
+# Delta keys that describe the delta itself rather than snapshot fields
+DELTA_META_KEYS = {"delta_format", "base", "base_timestamp", "removed_context", SECTIONED_KEY, CHUNKED_KEY}
+
+
+def apply_delta(base, delta):
+    """Return the snapshot `delta` describes on top of the `base` snapshot dict."""
+    snapshot = dict(base)
+    for key, value in delta.items():
+        if key not in DELTA_META_KEYS:
+            snapshot[key] = value
+
+    context = dict(base.get(SECTIONED_KEY) or {})
+    for key in delta.get("removed_context") or []:
+        context.pop(key, None)
+    for key, value in (delta.get(SECTIONED_KEY) or {}).items():
+        if key != CHUNKED_KEY:
+            context[key] = value
+
+    file_delta = delta.get(CHUNKED_KEY) or {}
+    files = dict(context.get(CHUNKED_KEY) or {})
+    for path in file_delta.get("removed") or []:
+        files.pop(path, None)
+    added = file_delta.get("added") or {}
+    files.update(added)
+    files.update(file_delta.get("modified") or {})
+    # Keep the agent's sorted order so a compacted delta chunks like a full upload.
+    context[CHUNKED_KEY] = dict(sorted(files.items())) if added else files
+    snapshot[SECTIONED_KEY] = context
+    return snapshot
+
+
+class _Store:
+    """Delta handling shared by both storage layouts."""
+
+    def __init__(self, snapshot_dir, max_delta_depth=8):
+        self.snapshot_dir = Path(snapshot_dir)
+        self.max_delta_depth = max_delta_depth
+
+    def _base_path(self, name):
+        if not name or Path(name).name != name:
+            raise DeltaBaseNotFound(str(name))
+        path = self.snapshot_dir / name
+        if not path.is_file():
+            raise DeltaBaseNotFound(name)
+        return path
+
+    def write_delta(self, path, delta):
+        """
+        Store an agent delta under `path`. The delta is applied once here to
+        validate it and record the result's hash; it is stored as a delta
+        unless that would make the chain longer than `max_delta_depth`.
+
+        Returns:
+            dict: The materialized snapshot.
+
+        Raises:
+            DeltaBaseNotFound: If the base snapshot isn't in the store.
+        """
+        base_path = self._base_path(delta.get("base"))
+        base_manifest = read_manifest(base_path)
+        depth = 1
+        if base_manifest and base_manifest["format"] == DELTA_FORMAT:
+            depth += base_manifest["depth"]
+        snapshot = apply_delta(load_snapshot(base_path), delta)
+
+        if depth > self.max_delta_depth:
+            self.write(path, snapshot)
+            return snapshot
+
+        serialized = _dumps(snapshot)
+        manifest = {
+            "format": DELTA_FORMAT,
+            "base": base_path.name,
+            "depth": depth,
+            "size_bytes": len(serialized),
+            "sha256": hashlib.sha256(serialized).hexdigest(),
+            "delta": {k: v for k, v in delta.items() if k not in ("delta_format", "base")},
+        }
+        _atomic_write(Path(path), _dumps(manifest))
+        return snapshot
+
+    def _deltas(self):
+        for path in self.snapshot_dir.glob("*.json"):
+            manifest = read_manifest(path)
+            if manifest and manifest["format"] == DELTA_FORMAT:
+                yield path, manifest
+
+    def delete(self, path):
+        """
+        Delete a stored snapshot, first rewriting deltas based on it as full
+        snapshots. Returns the names of the rewritten snapshots.
+        """
+        path = Path(path)
+        rebased = []
+        for delta_path, manifest in self._deltas():
+            if manifest["base"] == path.name:
+                self.write(delta_path, load_snapshot(delta_path))
+                rebased.append(delta_path.name)
+        path.unlink()
+        return rebased
+
+    def compact(self, max_depth=None):
+        """Rewrite deltas deeper than `max_depth` as full snapshots, shallowest first."""
+        max_depth = self.max_delta_depth if max_depth is None else max_depth
+        deep = sorted(((m["depth"], p) for p, m in self._deltas() if m["depth"] > max_depth), key=lambda item: item[0])
+        for _, delta_path in deep:
+            self.write(delta_path, load_snapshot(delta_path))
+        return {"compacted": len(deep)}
+
+    def ingest(self, path):
+        """
+        Bring a file a collector wrote at `path` into the store: deltas are
+        applied against their base, full snapshots are stored in this layout.
+        Returns the snapshot dict, or None if the file was already stored.
+        """
+        path = Path(path)
+        with open(path, "rb") as f:
+            if is_manifest(f.read(len(STORED_PREFIX))):
+                return None
+            f.seek(0)
+            document = json.load(f)
+        if is_delta_document(document):
+            return self.write_delta(path, document)
+        self.write(path, document)
+        return document
+
+
+class SectionStore(_Store):
+    """Writes snapshots as manifests + shared, compressed section objects."""
+
+    # Plain JSON files written into the directory are re-encoded by ingest().
+    converts_plain_files = True
+
+    def __init__(self, snapshot_dir, codec=None, boundary_bits=8, max_delta_depth=8,
+                 gc_grace_seconds=DEFAULT_GC_GRACE_SECONDS):
+        super().__init__(snapshot_dir, max_delta_depth)
+        self.gc_grace_seconds = gc_grace_seconds
+        self.objects_dir = self.snapshot_dir / OBJECTS_DIR
+        self.codec = codec or default_codec()
+        if self.codec == "zstd" and zstandard is None:
+            self.codec = "gzip"
+        self.boundary_bits = boundary_bits
+
+    def _put_section(self, value, stats):
+        data = _dumps(value)
+        digest = hashlib.sha256(data).hexdigest()
+        for codec in CODEC_SUFFIXES:
+            try:
+                # Touch it so a concurrent gc sees it as in use.
+                os.utime(_object_path(self.objects_dir, digest, codec))
+            except FileNotFoundError:
+                continue
+            stats["shared"] += 1
+            return [digest, codec]
+        _atomic_write(_object_path(self.objects_dir, digest, self.codec), _compress(data, self.codec))
+        stats["written"] += 1
+        return [digest, self.codec]
+
+    def build_manifest(self, snapshot):
+        stats = {"written": 0, "shared": 0}
+        fields, sections = {}, []
+        for key, value in snapshot.items():
+            if key != SECTIONED_KEY or not isinstance(value, dict):
+                fields[key] = value
+                continue
+            fields[key] = None  # placeholder keeps the key's position
+            for sub_key, sub_value in value.items():
+                if sub_key == CHUNKED_KEY and isinstance(sub_value, dict):
+                    chunks = chunk_files(sub_value, self.boundary_bits) if sub_value else [{}]
+                    for chunk in chunks:
+                        sections.append([sub_key, "chunk", *self._put_section(chunk, stats)])
+                else:
+                    sections.append([sub_key, "value", *self._put_section(sub_value, stats)])
+
+        serialized = _dumps(snapshot)
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "size_bytes": len(serialized),
+            "sha256": hashlib.sha256(serialized).hexdigest(),
+            "fields": fields,
+            "sectioned": isinstance(snapshot.get(SECTIONED_KEY), dict),
+            "sections": sections,
+        }
+        return manifest, stats
+
+    def write(self, path, snapshot):
+        """Store `snapshot` under `path` (a name in the snapshot directory)."""
+        manifest, stats = self.build_manifest(snapshot)
+        _atomic_write(Path(path), _dumps(manifest))
+        return stats
+
+    def referenced_objects(self):
+        referenced = set()
+        for manifest_path in self.snapshot_dir.glob("*.json"):
+            manifest = read_manifest(manifest_path)
+            if manifest and manifest["format"] == MANIFEST_FORMAT:
+                referenced.update(section[2] for section in manifest["sections"])
+        return referenced
+
+    def collect_garbage(self):
+        """
+        Delete section objects no manifest refers to any more, except those
+        written or reused in the last `gc_grace_seconds` (a write in progress
+        may not have stored its manifest yet).
+        """
+        referenced = self.referenced_objects()
+        removed = freed = 0
+        if not self.objects_dir.exists():
+            return {"removed": 0, "freed_bytes": 0}
+        for obj in self.objects_dir.glob("*/*"):
+            if obj.name.split(".")[0] in referenced or obj.name.startswith(".tmp-"):
+                continue
+            # Move it aside first: a write that touches it from here on gets
+            # FileNotFoundError and stores its own copy; one that touched it
+            # just before is caught by the mtime check, and it goes back.
+            doomed = obj.with_name(f".tmp-gc-{obj.name}")
+            try:
+                os.replace(obj, doomed)
+            except FileNotFoundError:
+                continue
+            stat = doomed.stat()
+            if stat.st_mtime > time.time() - self.gc_grace_seconds:
+                os.replace(doomed, obj)
+                continue
+            freed += stat.st_size
+            doomed.unlink()
+            removed += 1
+        return {"removed": removed, "freed_bytes": freed}
+
+    def stats(self):
+        logical = manifests = deltas = manifest_bytes = plain_bytes = plain = 0
+        for path in self.snapshot_dir.glob("*.json"):
+            manifest = read_manifest(path)
+            if manifest:
+                if manifest["format"] == DELTA_FORMAT:
+                    deltas += 1
+                else:
+                    manifests += 1
+                logical += manifest["size_bytes"]
+                manifest_bytes += path.stat().st_size
+            else:
+                plain += 1
+                plain_bytes += path.stat().st_size
+        object_bytes = objects = 0
+        if self.objects_dir.exists():
+            for obj in self.objects_dir.glob("*/*"):
+                objects += 1
+                object_bytes += obj.stat().st_size
+        stored = manifest_bytes + object_bytes
+        return {
+            "codec": self.codec,
+            "manifests": manifests,
+            "deltas": deltas,
+            "plain_files": plain,
+            "objects": objects,
+            "logical_bytes": logical,
+            "stored_bytes": stored,
+            "plain_bytes": plain_bytes,
+            "ratio": round(logical / stored, 2) if stored else None,
+        }
+
+
+class PlainFileStore(_Store):
+    """The original layout: each snapshot is a pretty-printed JSON file."""
+
+    converts_plain_files = False
+
+    def write(self, path, snapshot):
+        _atomic_write(Path(path), json.dumps(snapshot, indent=4).encode("utf-8"))
+        return None
+
+    def ingest(self, path):
+        # Full snapshots are already in this layout; only deltas need work.
+        path = Path(path)
+        with open(path, "rb") as f:
+            if is_manifest(f.read(len(STORED_PREFIX))):
+                return None
+            f.seek(0)
+            document = json.load(f)
+        return self.write_delta(path, document) if is_delta_document(document) else document
+
+    def collect_garbage(self):
+        return {"removed": 0, "freed_bytes": 0}
+
+    def stats(self):
+        files = list(self.snapshot_dir.glob("*.json"))
+        return {"codec": None, "plain_files": len(files), "plain_bytes": sum(p.stat().st_size for p in files)}
+
+
+def open_store(snapshot_dir, config=None):
+    config = config or {}
+    max_delta_depth = config.get("max_delta_depth", 8)
+    if config.get("backend", "sections") == "files":
+        return PlainFileStore(snapshot_dir, max_delta_depth=max_delta_depth)
+    return SectionStore(snapshot_dir, codec=config.get("compression"),
+                        boundary_bits=config.get("chunk_boundary_bits", 8), max_delta_depth=max_delta_depth,
+                        gc_grace_seconds=config.get("gc_grace_seconds", DEFAULT_GC_GRACE_SECONDS))
+
+
+def read_manifest(path):
+    """The manifest (sections or delta) stored at `path`, or None if it is a plain JSON snapshot."""
+    with open(path, "rb") as f:
+        if not is_manifest(f.read(len(STORED_PREFIX))):
+            return None
+        f.seek(0)
+        return json.load(f)
+
+
+def _read_section(objects_dir, digest, codec):
+    with open(_object_path(objects_dir, digest, codec), "rb") as f:
+        return json.loads(_decompress(f.read(), codec))
+
+
+def read_section(path, digest, codec):
+    """One section object referenced by the manifest stored at `path`."""
+    return _read_section(objects_dir_for(Path(path)), digest, codec)
+
+
+def _chunk_items(objects_dir, refs):
+    for digest, codec in refs:
+        yield from _read_section(objects_dir, digest, codec).items()
+
+
+def materialize(manifest, path, compact=False):
+    """
+    Rebuild the snapshot dict the manifest stored at `path` describes. With
+    `compact`, app_folder_files is a FileTable, filled one chunk at a time.
+    """
+    path = Path(path)
+    if manifest["format"] == DELTA_FORMAT:
+        snapshot = apply_delta(load_snapshot(path.parent / manifest["base"], compact), manifest["delta"])
+        return compact_snapshot(snapshot) if compact else snapshot
+    objects_dir = objects_dir_for(path)
+    snapshot = dict(manifest["fields"])
+    if manifest["sectioned"]:
+        context, chunks = {}, {}
+        for key, kind, digest, codec in manifest["sections"]:
+            if kind == "chunk" and compact:
+                context.setdefault(key, None)  # keeps the key's position
+                chunks.setdefault(key, []).append((digest, codec))
+                continue
+            value = _read_section(objects_dir, digest, codec)
+            if kind == "chunk":
+                context.setdefault(key, {}).update(value)
+            else:
+                context[key] = value
+        for key, refs in chunks.items():
+            context[key] = FileTable.from_items(_chunk_items(objects_dir, refs))
+        snapshot[SECTIONED_KEY] = context
+    return snapshot
+
+
+def load_snapshot(path, compact=False):
+    """
+    Parse a stored snapshot, whether it is a manifest or a plain JSON file.
+    With `compact`, its app_folder_files is a FileTable (see file_table.py)
+    rather than a dict: much smaller, and what the caches and comparisons use.
+    """
+    path = Path(path)
+    if compact:
+        with open(path, "rb") as f:
+            if not is_manifest(f.read(len(STORED_PREFIX))):
+                f.seek(0)
+                return read_compact_snapshot(f)
+        return materialize(read_manifest(path), path, compact=True)
+    with open(path, "rb") as f:
+        data = f.read()
+    if is_manifest(data):
+        return materialize(json.loads(data), path)
+    return json.loads(data)
+
+
+def snapshot_digest(path):
+    """(sha256, logical size) of a stored snapshot without materializing it."""
+    path = Path(path)
+    manifest = read_manifest(path)
+    if manifest:
+        return manifest["sha256"], manifest["size_bytes"]
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_CHUNK), b""):
+            sha.update(block)
+    return sha.hexdigest(), path.stat().st_size
+
+
+def iter_snapshot_json(path):
+    """
+    Yield the snapshot at `path` as JSON bytes for download. Plain files are
+    streamed as-is; manifests are reassembled and encoded incrementally.
+    """
+    path = Path(path)
+    manifest = read_manifest(path)
+    if manifest is None:
+        with open(path, "rb") as f:
+            yield from iter(lambda: f.read(READ_CHUNK), b"")
+        return
+    encoder = json.JSONEncoder(indent=2, ensure_ascii=False)
+    buffer = []
+    size = 0
+    for piece in encoder.iterencode(materialize(manifest, path)):
+        buffer.append(piece)
+        size += len(piece)
+        if size >= READ_CHUNK:
+            yield "".join(buffer).encode("utf-8")
+            buffer, size = [], 0
+    buffer.append("\n")
+    yield "".join(buffer).encode("utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the sectioned snapshot store.")
+    parser.add_argument("command", choices=("migrate", "gc", "compact", "stats"))
+    parser.add_argument("snapshot_dir", type=Path)
+    parser.add_argument("--codec", choices=tuple(CODEC_SUFFIXES), default=None)
+    parser.add_argument("--max-delta-depth", type=int, default=8)
+    parser.add_argument("--gc-grace-seconds", type=float, default=DEFAULT_GC_GRACE_SECONDS)
+    args = parser.parse_args()
+
+    store = SectionStore(args.snapshot_dir, codec=args.codec, max_delta_depth=args.max_delta_depth,
+                         gc_grace_seconds=args.gc_grace_seconds)
+    if args.command == "migrate":
+        converted = 0
+        for snapshot_path in sorted(args.snapshot_dir.glob("*.json")):
+            if store.ingest(snapshot_path) is not None:
+                converted += 1
+        print(f"Converted {converted} snapshot(s).")
+    elif args.command == "gc":
+        print(json.dumps(store.collect_garbage(), indent=2))
+    elif args.command == "compact":
+        print(json.dumps(store.compact(), indent=2))
+    print(json.dumps(store.stats(), indent=2))
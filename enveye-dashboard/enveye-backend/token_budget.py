@@ -0,0 +1,233 @@
+"""
+Token counting and prompt budgeting for AI diagnosis.
+
+- `get_encoder()` loads the tiktoken encoding once per process, on first use.
+- `fits_budget()` encodes in chunks and stops as soon as a budget is exceeded.
+- `pack_prompt_inputs()` fills a per-vendor context budget with the error
+  message, OCR text, diff entries and log blocks, most relevant first, so big
+  incidents produce a bounded prompt instead of a truncated or oversized one.
+"""
+import json
+from functools import lru_cache
+
+from config_loader import CONFIG
+from log_blocks import BLOCK_SEPARATOR, split_important_log_blocks
+from snapshot_diff import REPORT_TYPES, FILES_SECTION, format_key
+
+ENCODING_NAME = "cl100k_base"
+CHUNK_CHARS = 16 * 1024
+# Conservative chars-per-token ratio used to size slices before encoding them.
+CHARS_PER_TOKEN = 4
+
+DEFAULT_CONTEXT_TOKENS = {"openai": 16000, "gemini": 30000, "perplexity": 12000}
+DEFAULT_RESPONSE_TOKENS = 2000
+
+# Share of the budget each input may take on the first pass. Inputs that don't
+# fit in their share are packed on a second pass from what the others left.
+SECTION_SHARES = (
+    ("error_message", 0.10),
+    ("screenshot_text", 0.10),
+    ("diff", 0.50),
+    ("log_content", 0.30),
+)
+
+
+@lru_cache(maxsize=None)
+def get_encoder():
+    """
+    The tiktoken encoding, loaded once. Returns None if it can't be loaded
+    (e.g. the BPE file can't be downloaded), in which case token counts fall
+    back to a chars-per-token estimate.
+    """
+    try:
+        from tiktoken import get_encoding
+        return get_encoding(ENCODING_NAME)
+    except Exception as e:
+        print(f"⚠️ Could not load tiktoken encoding '{ENCODING_NAME}', estimating tokens instead: {e}")
+        return None
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    encoder = get_encoder()
+    if encoder is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def fits_budget(text, budget):
+    """True if `text` is at most `budget` tokens; stops encoding once it's over."""
+    if not text:
+        return True
+    if len(text) > budget * 32:
+        # No realistic text averages more than 32 chars per token.
+        return False
+    if len(text.encode("utf-8")) <= budget:
+        # Every token covers at least one byte.
+        return True
+    if get_encoder() is None:
+        return count_tokens(text) <= budget
+    used = 0
+    for start in range(0, len(text), CHUNK_CHARS):
+        used += count_tokens(text[start:start + CHUNK_CHARS])
+        if used > budget:
+            return False
+    return True
+
+
+def truncate_to_budget(text, budget, keep="head"):
+    """Cut `text` to at most `budget` tokens, keeping its head or its tail."""
+    if budget <= 0 or not text:
+        return ""
+    if fits_budget(text, budget):
+        return text
+    encoder = get_encoder()
+    if encoder is None:
+        chars = budget * CHARS_PER_TOKEN
+        return text[:chars] if keep == "head" else text[-chars:]
+    window = budget * CHARS_PER_TOKEN
+    while True:
+        piece = text[:window] if keep == "head" else text[-window:]
+        tokens = encoder.encode(piece, disallowed_special=())
+        if len(tokens) > budget or len(piece) == len(text):
+            break
+        window *= 2
+    tokens = tokens[:budget] if keep == "head" else tokens[-budget:]
+    return encoder.decode(tokens)
+
+
+def context_budget(vendor, model=None):
+    """Prompt token budget for a vendor (context size minus room for the reply)."""
+    ai_config = CONFIG.get("ai", {})
+    context_tokens = {**DEFAULT_CONTEXT_TOKENS, **ai_config.get("context_tokens", {})}
+    total = context_tokens.get(model) or context_tokens.get(vendor) or min(DEFAULT_CONTEXT_TOKENS.values())
+    return max(0, total - ai_config.get("response_tokens", DEFAULT_RESPONSE_TOKENS))
+
+
+# --- Diff entries ---
+
+def _diff_entry_rank(report_type, path):
+    # Service / env / OS changes first, then type changes, then file changes.
+    in_files = path.startswith("root" + format_key(FILES_SECTION))
+    return (in_files, REPORT_TYPES.index(report_type))
+
+
+def iter_diff_entries(diff):
+    """Flatten a diff report into (report_type, path, value), most relevant first."""
+    entries = [
+        (report_type, path, value)
+        for report_type in REPORT_TYPES
+        for path, value in (diff.get(report_type) or {}).items()
+    ]
+    # Stable sort keeps each report's own ordering within a rank.
+    entries.sort(key=lambda entry: _diff_entry_rank(entry[0], entry[1]))
+    return entries
+
+
+def _render_diff_entry(report_type, path, value):
+    return json.dumps({report_type: {path: value}}, indent=2)
+
+
+def pack_diff(diff, budget):
+    """Largest prefix of the ranked diff entries that fits; returns (diff, omitted)."""
+    if hasattr(diff, "render"):
+        # A DiffDigest (diff_digest.py) packs its own ranked lines.
+        return diff.render(budget)
+    if not isinstance(diff, dict):
+        text = truncate_to_budget(_render(diff), budget)
+        return text, int(text != _render(diff))
+    packed = {}
+    used = 0
+    entries = iter_diff_entries(diff)
+    kept = 0
+    for report_type, path, value in entries:
+        cost = count_tokens(_render_diff_entry(report_type, path, value))
+        if used + cost > budget:
+            break
+        packed.setdefault(report_type, {})[path] = value
+        used += cost
+        kept += 1
+    return packed, len(entries) - kept
+
+
+def pack_log_content(log_content, budget):
+    """Fit log content: verbatim if possible, else the newest important blocks."""
+    if fits_budget(log_content, budget):
+        return log_content, 0
+    blocks = log_content.split(BLOCK_SEPARATOR)
+    if len(blocks) == 1:
+        # Raw log text: reduce it to its error blocks first.
+        blocks = list(split_important_log_blocks(log_content))
+
+    kept = []
+    used = 0
+    for block in reversed(blocks):
+        cost = count_tokens(block) + 5
+        if used + cost > budget:
+            break
+        kept.append(block)
+        used += cost
+    if not kept:
+        return truncate_to_budget(log_content, budget, keep="tail"), max(1, len(blocks))
+    kept.reverse()
+    return BLOCK_SEPARATOR.join(kept), len(blocks) - len(kept)
+
+
+def _pack_section(name, value, budget):
+    if name == "diff":
+        return pack_diff(value, budget)
+    if name == "log_content":
+        return pack_log_content(value, budget)
+    text = truncate_to_budget(value, budget)
+    return text, int(text != value)
+
+
+def _render(value):
+    if isinstance(value, str):
+        return value
+    if hasattr(value, "render"):
+        return value.render()[0]
+    return json.dumps(value, indent=2) if value else ""
+
+
+def pack_prompt_inputs(inputs, budget):
+    """
+    Fit the prompt inputs into `budget` tokens.
+
+    Args:
+        inputs (dict): error_message, screenshot_text, diff and log_content.
+            The diff may be a report or a DiffDigest, which is packed to text.
+        budget (int): Token budget for all of them together.
+
+    Returns:
+        dict: Same keys with packed values, plus `omitted` counts per key.
+    """
+    shares = dict(SECTION_SHARES)
+    packed = {}
+    omitted = {}
+    remaining = budget
+
+    # First pass: everything that fits within its share goes in unchanged.
+    pending = []
+    for name, share in SECTION_SHARES:
+        value = inputs.get(name)
+        if not value and not hasattr(value, "render"):
+            # An empty DiffDigest still renders ("No relevant differences.").
+            value = {} if name == "diff" else ""
+        text = _render(value)
+        if fits_budget(text, int(budget * share)):
+            packed[name] = text if hasattr(value, "render") else value
+            remaining -= count_tokens(text)
+        else:
+            pending.append(name)
+
+    # Second pass: oversized inputs split what's left, in priority order.
+    for index, name in enumerate(pending):
+        pending_share = sum(shares[n] for n in pending[index:])
+        limit = max(0, int(remaining * shares[name] / pending_share))
+        packed[name], omitted[name] = _pack_section(name, inputs[name], limit)
+        remaining -= count_tokens(_render(packed[name]))
+
+    packed["omitted"] = omitted
+    return packed
@@ -1,7 +1,7 @@
 // App-level: Modular version of DiffViewer
 import { useState, useEffect, useRef } from "react";
 import axios from "axios";
-import { API_BASE_URL } from './api';
+import { API_BASE_URL, postEventStream } from './api';
 import DiffTable from "./DiffTable.jsx";
 import DiagnosisPanel from "./DiagnosisPanel.jsx";
 
@@ -52,7 +52,7 @@ function DiffViewer({ diffData }) {
 
   const readLogContents = async (logPath) => {
     try {
-      const response = await axios.post(`${API_BASE_URL}/read_log`, { path: logPath });
+      const response = await axios.post(`${API_BASE_URL}/read_log`, { path: logPath, blocks: true });
       return response.data.content || "";
     } catch (err) {
       console.warn("Failed to read log:", err);
@@ -69,10 +69,16 @@ function DiffViewer({ diffData }) {
         error_screenshot_text: errorScreenshot ? await extractTextFromImage(errorScreenshot) : "",
         log_content: logPath ? await readLogContents(logPath) : ""
       };
-      const response = await axios.post(`${API_BASE_URL}/start_diagnosis`, payload);
-      setSessionId(response.data.session_id);
-      setDiagnosisAI(response.data.ai_response);
-      setChatHistory([{ role: "ai", content: response.data.ai_response }]);
+      let streamed = "";
+      const result = await postEventStream("/start_diagnosis_stream", payload, (event, data) => {
+        if (event === "session") setSessionId(data.session_id);
+        if (event === "message" && data.delta) {
+          streamed += data.delta;
+          setDiagnosisAI(streamed);
+        }
+      });
+      setDiagnosisAI(result.ai_response);
+      setChatHistory([{ role: "ai", content: result.ai_response }]);
     } catch (err) {
       console.error("Diagnosis failed", err);
       alert("\u274C Failed to start diagnosis.");
@@ -85,14 +91,14 @@ function DiffViewer({ diffData }) {
     if (!followupText.trim()) return;
     setChatLoading(true);
     try {
-      const response = await axios.post(`${API_BASE_URL}/followup`, {
+      const result = await postEventStream("/followup_stream", {
         session_id: sessionId,
         followup_text: followupText
-      });
+      }, () => {});
       setChatHistory(prev => [
         ...prev,
         { role: "user", content: followupText },
-        { role: "ai", content: response.data.ai_response }
+        { role: "ai", content: result.ai_response }
       ]);
       setFollowupText("");
     } catch (err) {
@@ -5,3 +5,45 @@ export async function loadConfig() {
   const config = await res.json();
   API_BASE_URL = config.backend_ip;
 }
+
+// POST to a server-sent-events endpoint. Calls onEvent(event, data) for every
+// event and resolves with the data of the final "done" event.
+export async function postEventStream(path, body, onEvent) {
+  const res = await fetch(`${API_BASE_URL}${path}`, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(body),
+  });
+  if (!res.ok || !res.body) {
+    throw new Error(`Request to ${path} failed with status ${res.status}`);
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let result = null;
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const raw = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      let event = "message";
+      let data = "";
+      for (const line of raw.split("\n")) {
+        if (line.startsWith("event: ")) event = line.slice(7);
+        else if (line.startsWith("data: ")) data += line.slice(6);
+      }
+      const parsed = data ? JSON.parse(data) : {};
+      if (event === "error") throw new Error(parsed.error || "Stream failed");
+      if (event === "done") result = parsed;
+      onEvent(event, parsed);
+    }
+  }
+  return result;
+}